@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+'''imaplib vs. the pipelined asyncio IMAP client, with network latency, for listing and for
+rendering while downloading'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# The stand-in delays every response by --latency without blocking the commands after it,
+# like a network would. Rendering is simulated by --render seconds of sleep per article, so
+# the numbers show the overlap and not pandoc.
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark the asyncio IMAP client')
+parser.add_argument('--messages', '-n', default=60, type=int)
+parser.add_argument('--photo-bytes',    default=100000, type=int)
+parser.add_argument('--latency',  '-l', default=0.03, type=float,
+                    help='network latency of every response in seconds')
+parser.add_argument('--render',   '-r', default=0.02, type=float,
+                    help='seconds it takes to render an article')
+parser.add_argument('--bye-every',      default=50, type=int,
+                    help='drop the connection every n fetches in the reconnect check')
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import photo_mailbox
+from mail2blog.config import CONFIG
+from mail2blog.database import Blog
+from mail2blog.imapconnector import ImapConnector, message_id_of
+from mail2blog.imappool import ImapPool
+from mail2blog.aioimap import AsyncImapConnector, AsyncImapPool
+
+def timed(name, function):
+    start = time.perf_counter()
+    result = function()
+    print(F"{name:40} {time.perf_counter() - start:8.3f} s")
+    return result
+
+def listing(server):
+    '''the same headers and messages through both clients'''
+    def blocking():
+        connector = ImapConnector()
+        headers = [(uid, msg['message-id']) for uid, msg in connector.get_header_list()]
+        raw = connector.get_raw_message(headers[-1][1].strip('<>'))
+        connector.disconnect()
+        return headers, raw
+    async def pipelined():
+        connector = AsyncImapConnector()
+        headers = [(uid, msg['message-id']) for uid, msg in await connector.get_header_list()]
+        raw = await connector.get_raw_message(headers[-1][1].strip('<>'))
+        await connector.disconnect()
+        return headers, raw
+    CONFIG.read_dict({'imap': {'fetch_batch_size': '10'}})
+    server.reset_counters()
+    expected = timed("imaplib: list, fetch one", blocking)
+    trips = server.round_trips
+    server.reset_counters()
+    result = timed("asyncio: list, fetch one", lambda: asyncio.run(pipelined()))
+    print(F"    {trips} vs. {server.round_trips} commands")
+    assert result == expected
+    async def messages():
+        connector = AsyncImapConnector()
+        result = [msg['message-id'] for msg in await connector.get_message_list()]
+        await connector.disconnect()
+        return result
+    assert asyncio.run(messages()) == [message_id for _, message_id in expected[0]]
+    CONFIG.remove_option('imap', 'fetch_batch_size')
+
+def render(pool, entries, streaming=True):
+    '''render every article; without streaming only after all are downloaded'''
+    bodies = pool.fetch_bodies(entries)
+    if not streaming:
+        bodies = list(bodies)
+    rendered = []
+    for entry, fetched in bodies:
+        assert fetched, entry.message_id
+        time.sleep(bench_args.render)
+        rendered.append(entry.message_id)
+    pool.close()
+    assert rendered == [entry.message_id for entry in entries]
+
+def clear(raw_output):
+    for message_id in os.listdir(raw_output):
+        os.remove(os.path.join(raw_output, message_id, 'raw.mail'))
+
+def main():
+    mailbox = Mailbox(photo_mailbox(bench_args.messages, photo_bytes=bench_args.photo_bytes))
+    with tempfile.TemporaryDirectory() as tmp, \
+            ImapStandIn(mailbox, network_latency=bench_args.latency) as server:
+        raw_output = os.path.join(tmp, 'raw')
+        CONFIG.read_dict({'imap': dict(server.config(), fetch_chunk_size='65536'),
+                          'locations': {'database': os.path.join(tmp, 'mail2blog.db'),
+                                        'raw_output': raw_output}})
+        listing(server)
+
+        blog = Blog()
+        blog.read_entries_from_imap()
+        entries = blog.entries
+        print(F"{len(entries)} articles, {bench_args.render * len(entries):.1f} s of rendering")
+        timed("imaplib, download first, then render", lambda: render(ImapPool(1), entries, False))
+        clear(raw_output)
+        timed("imaplib, render while downloading", lambda: render(ImapPool(1), entries))
+        clear(raw_output)
+        timed("imaplib, 4 connections", lambda: render(ImapPool(4), entries))
+        clear(raw_output)
+        timed("asyncio, download first, then render",
+              lambda: render(AsyncImapPool(), entries, False))
+        clear(raw_output)
+        timed("asyncio, render while downloading", lambda: render(AsyncImapPool(), entries))
+        raws = {message_id_of(raw): raw for _, raw in mailbox.messages}
+        for entry in entries:
+            with open(os.path.join(raw_output, entry.message_id, 'raw.mail'), 'rb') as fh:
+                assert fh.read() == raws[entry.message_id]
+
+        clear(raw_output)
+        server.bye_every = bench_args.bye_every
+        timed(F"asyncio, BYE every {bench_args.bye_every} fetches",
+              lambda: render(AsyncImapPool(), entries))
+        print(F"    {server.byes} BYEs")
+        assert server.byes
+
+if __name__ == '__main__':
+    sys.exit(main())
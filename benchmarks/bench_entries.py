@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+'''Time and memory of 100k Blog_entry objects: eagerly decoded vs. __slots__ and lazy fields'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import gc
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+parser = argparse.ArgumentParser(description='benchmark the Blog_entry model')
+parser.add_argument('--entries', '-n', default=100000, type=int)
+parser.add_argument('--max-bytes',     default=250, type=int,
+                    help='target: bytes per entry')
+parser.add_argument('--max-us',        default=3, type=float,
+                    help='target: microseconds to create an entry')
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mail2blog.config import CONFIG
+from mail2blog import tools
+from mail2blog.database import Blog, Blog_entry, store_entries
+
+class EagerEntry:
+    '''Blog_entry as it was: everything decoded in __init__, in a __dict__'''
+    def __init__(self, message_id=None, email_from=None, subject=None, epoch=None, source="db",
+                 uid=None, render_state='new'):
+        self.message_id = message_id
+        self.uid        = uid
+        self.email_from = email_from
+        self.subject    = tools.email_decode(subject)
+        self.source     = source
+        self.render_state = render_state
+        self.epoch      = epoch if epoch is not None else int(time.time())
+        self.date = tools.format_date(self.epoch)
+        self.author = str(email_from).split('<')[0]
+        self.author_email = str(email_from).split('<')[1].replace('>','')
+
+    def get_subject(self, replace_spaces=False):
+        if not replace_spaces:
+            return self.subject
+        s = re.sub(r"[^\w\s]", '', str(self.subject))
+        return re.sub(r"[\s+/-]", '_', s)
+
+    def get_link(self):
+        return F"{self.get_subject(replace_spaces=True)}-{self.message_id}.html"
+
+def rows(n):
+    subjects = ['Wandern im Schwarzwald', '=?utf-8?q?Gr=C3=BC=C3=9Fe_aus_M=C3=BCnchen?=',
+                'Day 3: 42 km & rain']
+    return [dict(message_id=F"post-{i}@example.org", email_from="Jane Doe <jane@example.org>",
+                 subject=F"{subjects[i % 3]} {i}", date=1300000000 + i * 600, source='db',
+                 uid=None, render_state='rendered') for i in range(n)]
+
+def build(cls, data):
+    return [cls(row['message_id'], row['email_from'], row['subject'], row['date'],
+                source=row['source'], uid=row['uid'], render_state=row['render_state'])
+            for row in data]
+
+def measure(name, function):
+    '''wall time, and the memory that stays allocated (in a second run: tracemalloc is slow)'''
+    gc.collect()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    del result
+    gc.collect()
+    tracemalloc.start()
+    result = function()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_entry = size / len(result)
+    print(F"{name:36} {elapsed:7.3f} s  {elapsed / len(result) * 1e6:6.2f} us  "
+          F"{size / 2**20:7.1f} MiB  {per_entry:6.0f} bytes/entry")
+    return result, elapsed, per_entry
+
+def main():
+    data = rows(bench_args.entries)
+    for cls in (EagerEntry, Blog_entry):
+        entries, elapsed, per_entry = measure(F"{cls.__name__}: create",
+                                              lambda cls=cls: build(cls, data))
+        if cls is Blog_entry:
+            assert elapsed / len(entries) * 1e6 < bench_args.max_us
+            assert per_entry < bench_args.max_bytes
+        # what an article needs of its entry: the slug three times, subject, author, date
+        start = time.perf_counter()
+        for entry in entries:
+            for _ in range(3):
+                entry.get_subject(replace_spaces=True)
+            (entry.subject, entry.author, entry.author_email, entry.date)
+        print(F"{cls.__name__ + ': fields of every entry':36} "
+              F"{time.perf_counter() - start:7.3f} s")
+        del entries
+
+    # the lazy fields are the ones of the eager entry
+    for old, new in zip(build(EagerEntry, data[:300]), build(Blog_entry, data[:300])):
+        assert (str(old.subject), old.date, old.author, old.author_email, old.get_link()) == \
+               (str(new.subject), new.date, new.author, new.author_email, new.get_link())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        CONFIG.read_dict({'locations': {'database': os.path.join(tmp, 'mail2blog.db')}})
+        store_entries(build(Blog_entry, data))
+        blog = Blog()
+        start = time.perf_counter()
+        blog.read_entries_from_db(newest_first=True)
+        print(F"{'Blog.read_entries_from_db':36} {time.perf_counter() - start:7.3f} s  "
+              F"{len(blog.entries)} entries")
+
+if __name__ == '__main__':
+    sys.exit(main())
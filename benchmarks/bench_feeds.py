@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+'''Feed generation on a big blog: cost per run, size compared to the index, stable ids'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+parser = argparse.ArgumentParser(description='benchmark the atom and rss feeds')
+parser.add_argument('--entries', '-n', default=5000, type=int)
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from mail2blog.config import CONFIG
+from mail2blog import search
+from mail2blog.database import Blog, Blog_entry, store_entries
+from mail2blog.feeds import Feeds
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+def entry(i):
+    return Blog_entry(F"post-{i}@example.org", F"Jane Doe <jane@example.org>",
+                      F"Post <{i}> & \"more\"", 1300000000 + i * 86400)
+
+def timed(name, function):
+    start = time.perf_counter()
+    result = function()
+    print(F"{name:24} {(time.perf_counter() - start) * 1000:8.1f} ms  {result}")
+    return result
+
+def atom_ids(path):
+    return [e.find(ATOM + 'id').text for e in ET.parse(path).getroot().iter(ATOM + 'entry')]
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'blog')
+        CONFIG.read_dict({'locations': {'database': os.path.join(tmp, 'mail2blog.db'),
+                                        'blog_output': output,
+                                        # the feeds must not need any mail
+                                        'raw_output': os.path.join(tmp, 'nothing-here'),
+                                        'blog_link_base': 'https://blog.example.org/'},
+                          'templates': {'index_new': os.path.join(ROOT, 'templates/index_new.j2')}})
+        entries = [entry(i) for i in range(bench_args.entries)]
+        store_entries(entries)
+        for e in entries[-50:]:
+            search.index_article(e.message_id, e.subject, 'Some text of the article. ' * 40)
+
+        timed('first run', lambda: Feeds().write())
+        atom = os.path.join(output, 'atom.xml')
+        ids = atom_ids(atom)
+        assert len(ids) == 20 and len(set(ids)) == 20
+        ET.parse(os.path.join(output, 'rss.xml'))
+        mtime = os.stat(atom).st_mtime_ns
+        assert not timed('nothing new', lambda: Feeds().write())
+        assert os.stat(atom).st_mtime_ns == mtime
+
+        store_entries([entry(bench_args.entries)])
+        timed('one new post', lambda: Feeds().write())
+        new_ids = atom_ids(atom)
+        assert new_ids[1:] == ids[:-1]           # ids are stable
+        # an old post is not in the feed: it stays as it is
+        store_entries([Blog_entry("old@example.org", "Jane Doe <jane@example.org>", "Old", 1)])
+        assert not timed('one old post', lambda: Feeds().write())
+
+        index_md = Blog().generate_index_new()
+        print(F"atom.xml {os.path.getsize(atom) / 1024:.1f} KiB, rss.xml "
+              F"{os.path.getsize(os.path.join(output, 'rss.xml')) / 1024:.1f} KiB; "
+              F"the index markdown alone is {len(index_md.encode()) / 1024:.1f} KiB")
+
+if __name__ == '__main__':
+    sys.exit(main())
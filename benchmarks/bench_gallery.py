@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+'''Cold build and rebuild of a photo gallery after adding one image'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark the gallery generator')
+parser.add_argument('--photos',  '-n', default=300, type=int)
+parser.add_argument('--width',         default=2000, type=int)
+parser.add_argument('--height',        default=1500, type=int)
+parser.add_argument('--workers',       default='1,4', help='comma separated thread counts')
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from PIL import Image, ImageDraw
+from mail2blog.config import CONFIG
+from mail2blog import database
+from mail2blog.gallery import Gallery
+
+def make_photo(path, seed):
+    '''a photo-like image: a gradient with some shapes, so jpeg has something to do'''
+    rnd = random.Random(seed)
+    image = Image.linear_gradient('L').resize((bench_args.width, bench_args.height))
+    image = Image.merge('RGB', (image, image.rotate(90), image.rotate(180)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(30):
+        x, y = rnd.randrange(bench_args.width), rnd.randrange(bench_args.height)
+        draw.ellipse((x, y, x + rnd.randrange(50, 400), y + rnd.randrange(50, 400)),
+                     fill=(rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    if path.endswith('.png'):
+        image.save(path)
+    else:
+        image.save(path, quality=90)
+
+def build(name, source_dir, workers):
+    CONFIG.read_dict({'gallery': {'workers': str(workers)}})
+    start = time.perf_counter()
+    processed = Gallery(name, source_dir).build()
+    return processed, time.perf_counter() - start
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        CONFIG.read_dict({'locations': {'database': os.path.join(tmp, 'mail2blog.db'),
+                                        'gallery_output': os.path.join(tmp, 'gallery')}})
+        database.init_sql_tables()
+        source_dir = os.path.join(tmp, 'media')
+        os.makedirs(source_dir)
+        for i in range(bench_args.photos):
+            # every tenth photo is a png
+            make_photo(os.path.join(source_dir, F"photo-{i:04}.{'png' if i % 10 == 9 else 'jpg'}"), i)
+
+        for workers in [int(w) for w in bench_args.workers.split(',')]:
+            name = F"bench-{workers}"
+            processed, elapsed = build(name, source_dir, workers)
+            print(F"cold   {workers:2} workers  {processed:4} processed  {elapsed:8.3f} s")
+            assert processed == bench_args.photos
+            assert len(os.listdir(os.path.join(tmp, 'gallery', name, 'gallery', 'thumbs'))) \
+                    == bench_args.photos
+
+        make_photo(os.path.join(source_dir, 'photo-new.jpg'), -1)
+        processed, elapsed = build(name, source_dir, workers)
+        print(F"+1     {workers:2} workers  {processed:4} processed  {elapsed:8.3f} s")
+        assert processed == 1
+        processed, elapsed = build(name, source_dir, workers)
+        print(F"again  {workers:2} workers  {processed:4} processed  {elapsed:8.3f} s")
+        assert processed == 0
+
+if __name__ == '__main__':
+    sys.exit(main())
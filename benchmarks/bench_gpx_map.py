@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+'''Page weight and time of the map script for a long GPX track'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import datetime
+import io
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark the map script of gpx tracks')
+parser.add_argument('--points',    '-n', default=86400, type=int, help='1 Hz: one day')
+parser.add_argument('--tolerance', '-t', default=5.0, type=float, help='[map] gpx_tolerance')
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+import gpxpy.gpx
+import pypandoc
+from mail2blog.config import CONFIG
+from mail2blog import geometry
+from mail2blog import gpxreduce
+from mail2blog import tools
+
+def synthetic_track(n, seed=0):
+    '''a walk at 1.4 m/s with slowly changing direction and 2 m of gps noise'''
+    rnd = np.random.default_rng(seed)
+    heading = np.cumsum(rnd.normal(0, 0.05, n))
+    xy = np.cumsum(np.column_stack((np.cos(heading), np.sin(heading))) * 1.4, axis=0)
+    xy += rnd.normal(0, 2, (n, 2))
+    lat = 61.0 + np.degrees(xy[:, 1] / geometry.EARTH_RADIUS)
+    lon = 9.5 + np.degrees(xy[:, 0] / (geometry.EARTH_RADIUS * np.cos(np.radians(61.0))))
+    gpx = gpxpy.gpx.GPX()
+    track = gpxpy.gpx.GPXTrack()
+    segment = gpxpy.gpx.GPXTrackSegment()
+    start = datetime.datetime(2021, 7, 1, 6, 0, 0)
+    for i, (la, lo) in enumerate(zip(lat.tolist(), lon.tolist())):
+        segment.points.append(gpxpy.gpx.GPXTrackPoint(la, lo,
+                time=start + datetime.timedelta(seconds=i)))
+    track.segments.append(segment)
+    gpx.tracks.append(track)
+    return gpx
+
+def legacy_script(gpx_data):
+    '''the point list as tools.geo_include wrote it before'''
+    geo_data = 'var latlngs = [\n'
+    is_first = True
+    for track in gpx_data.tracks:
+        for segment in track.segments:
+            for point in segment.points:
+                if not is_first:
+                    geo_data += ",\n"
+                if is_first:
+                    is_first=False
+                geo_data += F"[{point.latitude}, {point.longitude}]"
+    return geo_data + '];'
+
+def pandoc_time(script):
+    '''time pandoc needs for a short page with script as after body include'''
+    with tempfile.NamedTemporaryFile('w', suffix='.html') as fh:
+        fh.write(script)
+        fh.flush()
+        start = time.perf_counter()
+        pypandoc.convert_text('A walk.', 'html', format='md',
+                extra_args=['-s', '--metadata=title:walk', F'--include-after-body={fh.name}'])
+        return time.perf_counter() - start
+
+def max_deviation(latlon, polyline):
+    '''largest distance in metres of an original point from the drawn polyline'''
+    latitude = latlon[:, 0].mean()
+    points = geometry.project(latlon, latitude)
+    drawn  = geometry.project(polyline, latitude)
+    kept = np.flatnonzero(geometry.simplify_mask(points, bench_args.tolerance))
+    span = np.clip(np.searchsorted(kept, np.arange(len(points)), side='right') - 1,
+                   0, len(kept) - 2)
+    start, end = drawn[span], drawn[span + 1]
+    chord = end - start
+    length2 = np.maximum((chord ** 2).sum(axis=1), 1e-12)
+    t = np.clip(((points - start) * chord).sum(axis=1) / length2, 0, 1)
+    return np.hypot(*(points - start - chord * t[:, None]).T).max()
+
+def main():
+    CONFIG.read_dict({'map': {'gpx_tolerance': str(bench_args.tolerance)}})
+    gpx = synthetic_track(bench_args.points)
+
+    start = time.perf_counter()
+    legacy = legacy_script(gpx)
+    legacy_time = time.perf_counter() - start
+    print(F"[lat, lon] literals  {len(legacy)/1024:9.1f} KiB  {legacy_time:8.3f} s  "
+          F"pandoc {pandoc_time(legacy):8.3f} s")
+
+    start = time.perf_counter()
+    polylines = geometry.encode_gpx(gpx)
+    script = tools.geo_include(polylines)
+    elapsed = time.perf_counter() - start
+    print(F"encoded polyline     {len(script)/1024:9.1f} KiB  {elapsed:8.3f} s  "
+          F"pandoc {pandoc_time(script):8.3f} s  ({len(legacy)/len(script):.0f}x smaller)")
+
+    # the render path streams the gpx attachment instead of building gpxpy objects
+    xml = gpx.to_xml().encode('utf-8')
+    start = time.perf_counter()
+    parsed = geometry.encode_gpx(gpxpy.parse(xml.decode('utf-8')))
+    parse_time = time.perf_counter() - start
+    start = time.perf_counter()
+    streamed = gpxreduce.map_polylines(io.BytesIO(xml), bench_args.tolerance)
+    print(F"gpxpy.parse + simplify {parse_time:8.3f} s, streamed {time.perf_counter() - start:8.3f} s")
+    assert streamed == parsed == polylines
+
+    latlon  = geometry.segment_arrays(gpx)[0]
+    decoded = geometry.decode_polyline(polylines[0])
+    assert np.abs(decoded - geometry.simplify(latlon)).max() <= 0.5 / 10**geometry.PRECISION
+    deviation = max_deviation(latlon, decoded)
+    print(F"{len(decoded)} of {len(latlon)} points kept, max deviation {deviation:.2f} m")
+    # tolerance plus the rounding of the encoding (1e-5 degrees is ~1.1 m)
+    assert deviation <= bench_args.tolerance + 1.5
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+'''Time and peak memory of reduce-gpx.py on a big recorder dump'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import datetime
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark reduce-gpx.py')
+parser.add_argument('--size',  default=200, type=int, help='gpx file size in MiB')
+parser.add_argument('--cap',   default=100, type=int, help='allowed peak RSS in MiB')
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+STRATEGIES = [('time', ['--interval', '60']), ('distance', ['--distance', '10']),
+              ('rdp', ['--tolerance', '5'])]
+
+def write_gpx(path, size):
+    '''a 1 Hz recording, split into a track per day and a segment per hour'''
+    start = datetime.datetime(2021, 7, 1, 6, 0, 0)
+    points = 0
+    with open(path, 'w') as fp:
+        fp.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                 '<gpx version="1.1" creator="bench" xmlns="http://www.topografix.com/GPX/1/1">\n')
+        lat, lon, heading = 61.0, 9.5, 0.0
+        while fp.tell() < size:
+            fp.write(F'  <trk><name>Day {points // 86400 + 1}</name>\n')
+            for _ in range(24):
+                fp.write('    <trkseg>\n')
+                lines = []
+                for _ in range(3600):
+                    heading += math.sin(points / 97.0) * 0.05
+                    lat += math.cos(heading) * 1.3e-5
+                    lon += math.sin(heading) * 2.6e-5
+                    stamp = (start + datetime.timedelta(seconds=points)).isoformat() + 'Z'
+                    lines.append(F'      <trkpt lat="{lat:.7f}" lon="{lon:.7f}">'
+                                 F'<ele>{100 + points % 50}</ele><time>{stamp}</time></trkpt>\n')
+                    points += 1
+                fp.write(''.join(lines))
+                fp.write('    </trkseg>\n')
+            fp.write('  </trk>\n')
+        fp.write('</gpx>\n')
+    return points
+
+def run(arguments):
+    '''run reduce-gpx.py, return its output, wall time and peak RSS in bytes'''
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'reduce-gpx.py')] + arguments,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               env=dict(os.environ, PYTHONPATH=ROOT))
+    output = process.stdout.read().decode()
+    _, status, usage = os.wait4(process.pid, 0)
+    assert status == 0, output
+    return output.strip(), time.perf_counter() - start, usage.ru_maxrss * 1024
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        gpx_file = os.path.join(tmp, 'dump.gpx')
+        points = write_gpx(gpx_file, bench_args.size * 2**20)
+        print(F"{os.path.getsize(gpx_file)/2**20:.1f} MiB, {points} points")
+        for strategy, options in STRATEGIES:
+            output_file = os.path.join(tmp, F'{strategy}.gpx')
+            output, elapsed, maxrss = run([gpx_file, '-s', strategy, '-o', output_file] + options)
+            print(F"{strategy:8}  {elapsed:8.3f} s  peak RSS {maxrss/2**20:7.1f} MiB  "
+                  F"{os.path.getsize(output_file)/2**20:7.1f} MiB  {output.split(': ')[-1]}")
+            assert maxrss < bench_args.cap * 2**20, F"peak RSS above {bench_args.cap} MiB"
+
+if __name__ == '__main__':
+    sys.exit(main())
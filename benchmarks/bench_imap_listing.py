@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+'''Compare per-message header fetching with batched UID FETCH against the IMAP stand-in'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import email
+import os
+import sys
+import time
+
+parser = argparse.ArgumentParser(description='benchmark ImapConnector.get_message_list')
+parser.add_argument('--messages', '-n', default=3000, type=int)
+parser.add_argument('--latency',  '-l', default=0.001, type=float,
+                    help='artificial per-command server latency in seconds')
+parser.add_argument('--batch-size',     default=500, type=int)
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox
+from mail2blog.config import CONFIG
+from mail2blog.imapconnector import ImapConnector
+
+def list_one_by_one(connector):
+    '''the listing as it was done before: SEARCH ALL plus one FETCH per message'''
+    res, data = connector.M.search(None, 'ALL')
+    msg_list = []
+    for num in data[0].split():
+        res, data = connector.M.fetch(num, '(BODY[HEADER])')
+        msg_list.append(email.message_from_string(data[0][1].decode('iso-8859-1')))
+    return msg_list
+
+def measure(server, name, function):
+    connector = ImapConnector()
+    connector.connect()
+    server.reset_counters()
+    start = time.perf_counter()
+    msg_list = function(connector)
+    elapsed = time.perf_counter() - start
+    print(F"{name:12} {len(msg_list):6} messages  {server.round_trips:6} round trips  "
+          F"{server.bytes_sent/1024:9.1f} KiB  {elapsed:8.3f} s")
+    connector.disconnect()
+    return msg_list
+
+def main():
+    with ImapStandIn(Mailbox(text_mailbox(bench_args.messages)), latency=bench_args.latency) as server:
+        CONFIG.read_dict({'imap': dict(server.config(), fetch_batch_size=str(bench_args.batch_size))})
+        old = measure(server, 'one-by-one', list_one_by_one)
+        new = measure(server, 'batched', lambda c: c.get_message_list())
+        assert [m['message-id'] for m in old] == [m['message-id'] for m in new]
+        assert [m['subject'] for m in old] == [m['subject'] for m in new]
+
+if __name__ == '__main__':
+    sys.exit(main())
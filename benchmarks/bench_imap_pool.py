@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+'''Wall time of a cold body download with a growing IMAP connection pool'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark parallel body fetching')
+parser.add_argument('--messages', '-n', default=40, type=int)
+parser.add_argument('--photo-bytes',    default=300000, type=int)
+parser.add_argument('--latency',  '-l', default=0.05, type=float,
+                    help='artificial per-command server latency in seconds')
+parser.add_argument('--sizes',          default='1,2,4,8',
+                    help='comma separated pool sizes')
+parser.add_argument('--bye-every',      default=7, type=int,
+                    help='drop a connection every n fetches in the reconnect check')
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import photo_mailbox
+from mail2blog.config import CONFIG
+from mail2blog.database import Blog
+from mail2blog.imappool import ImapPool
+
+def main():
+    mailbox = Mailbox(photo_mailbox(bench_args.messages, photo_bytes=bench_args.photo_bytes))
+    with tempfile.TemporaryDirectory() as tmp, \
+            ImapStandIn(mailbox, latency=bench_args.latency) as server:
+        CONFIG.read_dict({'imap': dict(server.config(), max_connections='16'),
+                          'locations': {'database': os.path.join(tmp, 'mail2blog.db'),
+                                        'raw_output': os.path.join(tmp, 'raw')}})
+        blog = Blog()
+        blog.read_entries_from_imap()
+        for size in [int(s) for s in bench_args.sizes.split(',')]:
+            pool = ImapPool(size)
+            start = time.perf_counter()
+            ids = [entry.message_id for entry, fetched in pool.fetch_bodies(blog.entries)
+                   if fetched]
+            elapsed = time.perf_counter() - start
+            pool.close()
+            assert ids == [entry.message_id for entry in blog.entries]
+            print(F"{size:2} connections  {len(ids):4} bodies  {elapsed:8.3f} s")
+
+        server.bye_every = bench_args.bye_every
+        pool = ImapPool(4)
+        fetched = [entry for entry, fetched in pool.fetch_bodies(blog.entries) if fetched]
+        pool.close()
+        assert len(fetched) == len(blog.entries)
+        print(F"reconnect check: {server.byes} connections dropped, all bodies fetched")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+'''Round trips of the incremental IMAP header sync against the IMAP stand-in'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark the incremental IMAP sync')
+parser.add_argument('--messages', '-n', default=3000, type=int)
+parser.add_argument('--latency',  '-l', default=0.001, type=float,
+                    help='artificial per-command server latency in seconds')
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox, text_message
+from mail2blog.config import CONFIG
+from mail2blog.imapconnector import ImapConnector
+from mail2blog.database import ImapSync
+
+def measure(server, name):
+    connector = ImapConnector()
+    server.reset_counters()
+    start = time.perf_counter()
+    rows = ImapSync(connector).sync()
+    elapsed = time.perf_counter() - start
+    print(F"{name:22} {len(rows):6} messages  {server.round_trips:5} round trips "
+          F"({server.commands['LOGIN'] + server.commands['ENABLE']} for login) "
+          F"{server.bytes_sent/1024:9.1f} KiB  {elapsed:8.3f} s")
+    connector.disconnect()
+    return rows
+
+def main():
+    mailbox = Mailbox(text_mailbox(bench_args.messages))
+    with tempfile.TemporaryDirectory() as tmp, \
+            ImapStandIn(mailbox, latency=bench_args.latency) as server:
+        CONFIG.read_dict({'imap': server.config(),
+                          'locations': {'database': os.path.join(tmp, 'mail2blog.db')}})
+        rows = measure(server, 'cold')
+        assert len(rows) == bench_args.messages
+        rows = measure(server, 'no change')
+        assert len(rows) == bench_args.messages
+        mailbox.append(text_message(bench_args.messages))
+        rows = measure(server, 'one new message')
+        assert rows[-1]['message_id'] == F"bench-0-{bench_args.messages}@mail2blog.example.org"
+        mailbox.expunge(1)
+        rows = measure(server, 'one expunged message')
+        assert len(rows) == bench_args.messages
+        mailbox.uidvalidity += 1
+        rows = measure(server, 'UIDVALIDITY change')
+        assert len(rows) == bench_args.messages
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+'''Time to produce the blog index: from all IMAP headers vs. from the database'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark generating the index')
+parser.add_argument('--messages', '-n', default=5000, type=int)
+parser.add_argument('--latency',  '-l', default=0.001, type=float,
+                    help='artificial per-command server latency in seconds')
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox, text_message
+from mail2blog.config import CONFIG
+from mail2blog import context
+from mail2blog import database
+from mail2blog import db
+from mail2blog import templating
+from mail2blog.database import Blog, ImapSync
+
+def legacy_index():
+    '''how view.generate_index got the index before: all headers from IMAP, then the
+    entries of the blog in memory'''
+    blog = Blog()
+    for row in reversed(ImapSync().sync()):
+        blog.entries.append(database.Blog_entry(row['message_id'], row['email_from'],
+                row['subject'], row['date'], source='imap', uid=row['uid']))
+    template = templating.get_template('index_new')
+    return template.render(article_list=[entry.to_dict() for entry in blog.entries])
+
+def timed(name, server, function):
+    server.reset_counters()
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    if context.current().imap.connected:
+        context.current().imap.disconnect()
+    print(F"{name:32} {elapsed * 1000:9.1f} ms  {server.round_trips:5} round trips")
+    return result
+
+def update_and_index():
+    Blog.update_from_imap()
+    return Blog().generate_index_new()
+
+def main():
+    mailbox = Mailbox(text_mailbox(bench_args.messages))
+    with tempfile.TemporaryDirectory() as tmp, \
+            ImapStandIn(mailbox, latency=bench_args.latency) as server:
+        CONFIG.read_dict({'imap': server.config(),
+                          'templates': {'index_new': os.path.join(ROOT, 'templates/index_new.j2')},
+                          'database': {'batch_size': '500'}})
+
+        CONFIG.read_dict({'locations': {'database': os.path.join(tmp, 'legacy.db')}})
+        old = timed('before: header sync, first run', server, legacy_index)
+        timed('before: header sync, nothing new', server, legacy_index)
+
+        CONFIG.read_dict({'locations': {'database': os.path.join(tmp, 'mail2blog.db')}})
+        new = timed('database, first run', server, update_and_index)
+        assert new == old
+        timed('database, nothing new', server, update_and_index)
+        mailbox.append(text_message(bench_args.messages))
+        new = timed('database, one new message', server, update_and_index)
+        assert F"bench-0-{bench_args.messages}@" in new.split('\n')[2]
+        offline = timed('database, offline', server, lambda: Blog().generate_index_new())
+        assert offline == new and server.round_trips == 0
+
+        # keyset pages add up to the whole, in order
+        rows = db.query('''select message_id from mail2blog order by date desc, message_id desc''')
+        paged, before = [], None
+        while True:
+            page = Blog.index_page(before, limit=333)
+            if not page:
+                break
+            paged += [row['message_id'] for row in page]
+            before = (page[-1]['date'], page[-1]['message_id'])
+        assert paged == [row[0] for row in rows]
+
+if __name__ == '__main__':
+    sys.exit(main())
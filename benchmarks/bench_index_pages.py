@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+'''Cost of adding a post to a big blog: one index.html vs. pages and archives'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark the index pages')
+parser.add_argument('--entries',   '-n', default=5000, type=int)
+parser.add_argument('--page-size', '-p', default=50, type=int)
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from mail2blog.config import CONFIG
+from mail2blog.archive import IndexPages
+from mail2blog.database import Blog, Blog_entry, store_entries
+from mail2blog.renderbackend import PandocRenderer
+
+THEMES = ['header_include', 'body_before_include', 'body_after_include',
+          'header_include_no_map', 'body_before_include_no_map', 'body_after_include_no_map']
+
+def entry(i):
+    '''one post a day'''
+    return Blog_entry(F"post-{i}@example.org", "Jane Doe <jane@example.org>",
+                      F"Post number {i}", 1300000000 + i * 86400)
+
+def single_page(output):
+    '''how the index was made before: all entries in one page'''
+    pandoc = PandocRenderer()
+    pandoc.submit(Blog().generate_index_new(), os.path.join(output, 'single.html'), title='Blog')
+    pandoc.flush()
+
+def build(force=False):
+    pandoc  = PandocRenderer()
+    written = IndexPages(force=force).write(pandoc)
+    pandoc.flush()
+    return written
+
+def timed(name, function):
+    start = time.perf_counter()
+    result = function()
+    print(F"{name:28} {time.perf_counter() - start:8.3f} s", end='')
+    return result
+
+def size(output, names):
+    return sum(os.path.getsize(os.path.join(output, name)) for name in names)
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, 'blog')
+        os.makedirs(output)
+        CONFIG.read_dict({'locations': {'database': os.path.join(tmp, 'mail2blog.db'),
+                                        'blog_output': output, 'temp_output': tmp},
+                          'templates': {'index_new': os.path.join(ROOT, 'templates/index_new.j2')},
+                          'themes': {option: os.path.join(ROOT, 'themes', option + '.html')
+                                     for option in THEMES},
+                          'index': {'page_size': str(bench_args.page_size)}})
+        store_entries([entry(i) for i in range(bench_args.entries)])
+
+        timed('single page', lambda: single_page(output))
+        print(F"  {size(output, ['single.html']) / 1024:8.1f} KiB")
+        written = timed('pages, first build', build)
+        print(F"  {len(written)} pages")
+
+        store_entries([entry(bench_args.entries)])
+        timed('single page, one new post', lambda: single_page(output))
+        print(F"  {size(output, ['single.html']) / 1024:8.1f} KiB")
+        written = timed('pages, one new post', build)
+        print(F"  {size(output, written) / 1024:8.1f} KiB in {', '.join(written)}")
+        # index.html, the last page, its month; and the page before, if the new post starts
+        # a page (its "newer" link changes). Its year only if it starts a month
+        years = [name for name in written if len(name) == len('archive-yyyy.html')]
+        assert len(written) - len(years) <= 4, written
+        assert max(size(output, [name]) for name in written) < 32 * 1024
+        written = timed('pages, nothing new', build)
+        print(F"  {len(written)} pages")
+        assert not written
+
+        # the pages together show every entry once
+        listed = []
+        for name in os.listdir(output):
+            if name.startswith('page-'):
+                with open(os.path.join(output, name)) as fh:
+                    listed += [line for line in fh if 'href="Post_number' in line]
+        assert len(listed) == bench_args.entries + 1
+
+if __name__ == '__main__':
+    sys.exit(main())
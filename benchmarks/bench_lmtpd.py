@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+'''Delivering a burst of mails: one controller.parse_mail process per mail vs. mail2blog-lmtpd'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# The daemon runs in this process, the client below talks LMTP to it over TCP with
+# pipelining, from --connections connections at the same time.
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark mail delivery')
+parser.add_argument('--messages',    '-n', default=2000, type=int)
+parser.add_argument('--connections', '-c', default=8, type=int)
+parser.add_argument('--processes',   '-p', default=20, type=int,
+                    help='mails delivered with one process each, for comparison')
+parser.add_argument('--queue-size',        default=16, type=int)
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mail2blog.config import CONFIG
+from mail2blog import db
+from mail2blog.lmtpd import LMTPServer, SPOOL
+from synthmail import text_message
+
+async def read_reply(reader):
+    '''the lines of one (multiline) reply'''
+    lines = []
+    while True:
+        line = (await reader.readline()).decode().rstrip('\r\n')
+        lines.append(line)
+        if line[3:4] != '-':
+            return lines
+
+async def send(port, messages, recipients=1):
+    '''deliver messages over one connection; return the reply to each'''
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    await read_reply(reader)
+    writer.write(b'LHLO bench\r\n')
+    assert 'PIPELINING' in ' '.join(await read_reply(reader))
+    results = []
+    for message in messages:
+        writer.write(b'MAIL FROM:<bench@example.org>\r\n' +
+                     b'RCPT TO:<blog@example.org>\r\n' * recipients + b'DATA\r\n')
+        for _ in range(recipients + 2):     # MAIL, RCPT..., DATA
+            await read_reply(reader)
+        data = message.encode().replace(b'\n.', b'\n..').replace(b'\n', b'\r\n')
+        writer.write(data + b'.\r\n')
+        results.append([(await read_reply(reader))[0] for _ in range(recipients)])
+    writer.write(b'QUIT\r\n')
+    await read_reply(reader)
+    writer.close()
+    return results
+
+async def burst(server, messages, connections):
+    per_connection = [messages[i::connections] for i in range(connections)]
+    results = await asyncio.gather(*[send(server.port, chunk) for chunk in per_connection])
+    return [reply for result in results for reply in result]
+
+async def daemon(messages):
+    server = await LMTPServer().start()
+    longest = 0
+    async def watch():
+        nonlocal longest
+        while True:
+            longest = max(longest, server.queue.qsize())
+            await asyncio.sleep(0.001)
+    watcher = asyncio.create_task(watch())
+    start = time.perf_counter()
+    replies = await burst(server, messages, bench_args.connections)
+    elapsed = time.perf_counter() - start
+    watcher.cancel()
+    assert all(reply[0].startswith('250 ') for reply in replies), replies[:3]
+    print(F"lmtpd          {elapsed:8.3f} s  {len(messages) / elapsed:8.0f} mails/s  "
+          F"{server.commits} commits, queue at most {longest} of {server.queue_size}")
+    assert server.commits < len(messages)
+    assert longest <= server.queue_size
+
+    # bad mails are rejected, the session goes on, every recipient gets a reply
+    bad = await send(server.port, ["From: x@example.org\nSubject: no id\n\nbody\n",
+                                   "From: X <x@example.org>\nMessage-ID: <big@example.org>\n\n"
+                                   + 'x' * (server.max_size + 1) + '\n',
+                                   text_message(0, seed=9)], recipients=2)
+    assert [r[0][:3] for r in bad] == ['554', '552', '250'] and len(bad[2]) == 2, bad
+    await server.stop()
+
+def per_process(config_file, messages):
+    start = time.perf_counter()
+    for message in messages:
+        subprocess.run([sys.executable, '-c', 'import sys; sys.argv[0] = "mail2blog"; '
+                        'from mail2blog.controller import parse_mail; parse_mail()',
+                        '-c', config_file], input=message.encode(), check=True,
+                       capture_output=True, env=dict(os.environ, PYTHONPATH=ROOT))
+    elapsed = time.perf_counter() - start
+    print(F"per process    {elapsed:8.3f} s  {len(messages) / elapsed:8.0f} mails/s")
+
+def main():
+    messages = [text_message(i, seed=1) for i in range(bench_args.messages)]
+    with tempfile.TemporaryDirectory() as tmp:
+        locations = {'database': os.path.join(tmp, 'mail2blog.db'),
+                     'raw_output': os.path.join(tmp, 'raw')}
+        config_file = os.path.join(tmp, 'mail2blog.conf')
+        with open(config_file, 'w') as fh:
+            fh.write('[locations]\n' + ''.join(F"{k} = {v}\n" for k, v in locations.items()))
+        if bench_args.processes:
+            per_process(config_file, [text_message(i, seed=2)
+                                      for i in range(bench_args.processes)])
+
+        CONFIG.read_dict({'locations': locations,
+                          'lmtp': {'port': '0', 'queue_size': str(bench_args.queue_size),
+                                   'max_size': '1000000'}})
+        asyncio.run(daemon(messages))
+        stored = db.query('''select count(*) from mail2blog''')[0][0]
+        assert stored == bench_args.processes + bench_args.messages + 1, stored
+        assert len(os.listdir(locations['raw_output'])) == stored + 1     # and the SPOOL
+        assert not os.listdir(os.path.join(locations['raw_output'], SPOOL))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+'''Peak memory of storing and rendering a mail with a huge attachment'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# The message is written to disk in a streaming way, then delivered (controller.store_message)
+# and rendered (ArticleRenderer) in a child process whose ru_maxrss is checked against --cap.
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark streaming MIME parsing')
+parser.add_argument('--size',    default=500, type=int, help='message size in MiB')
+parser.add_argument('--cap',     default=100, type=int, help='allowed peak RSS in MiB')
+parser.add_argument('--buffer',  default=2**20, type=int, help='[mime] buffer_size')
+parser.add_argument('--compare', action='store_true',
+                    help='also measure email.message_from_binary_file (needs several GiB)')
+parser.add_argument('--child',   nargs=3, metavar=('MODE', 'MESSAGE', 'DIR'),
+                    help=argparse.SUPPRESS)
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+MESSAGE_ID = 'bench-huge@mail2blog.example.org'
+
+def write_message(path, size):
+    '''write a mail with a short text and a video of about size bytes (base64 encoded);
+    return the sha256 and length of the decoded video'''
+    sha = hashlib.sha256()
+    length = 0
+    with open(path, 'wb') as fp:
+        fp.write(F'Return-Path: <jane@example.org>\n'
+                 F'From: Jane Doe <jane@example.org>\n'
+                 F'To: blog@example.org\n'
+                 F'Subject: A very long video\n'
+                 F'Date: Mon, 01 Mar 2021 12:00:00 +0000\n'
+                 F'Message-ID: <{MESSAGE_ID}>\n'
+                 F'MIME-Version: 1.0\n'
+                 F'Content-Type: multipart/mixed; boundary="==bench=="\n'
+                 F'\n'
+                 F'--==bench==\n'
+                 F'Content-Type: text/plain; charset="utf-8"\n'
+                 F'\n'
+                 F'We went to the sea.\n'
+                 F'\n'
+                 F'--==bench==\n'
+                 F'Content-Type: video/mp4; name="sea.mp4"\n'
+                 F'Content-Transfer-Encoding: base64\n'
+                 F'Content-Disposition: attachment; filename="sea.mp4"\n'
+                 F'\n'.encode())
+        block = 57 * 2**14
+        while fp.tell() < size:
+            data = os.urandom(block)
+            sha.update(data)
+            length += len(data)
+            fp.write(base64.encodebytes(data))
+        fp.write(b'\n--==bench==--\n')
+    return sha.hexdigest(), length
+
+def configure(directory):
+    from mail2blog.config import CONFIG
+    CONFIG.read_dict({
+        'mime':      {'buffer_size': str(bench_args.buffer)},
+        'locations': {'database':          os.path.join(directory, 'mail2blog.db'),
+                      'raw_output':        os.path.join(directory, 'raw'),
+                      'temp_output':       os.path.join(directory, 'tmp'),
+                      'blog_output':       os.path.join(directory, 'blog'),
+                      'gallery_output':    os.path.join(directory, 'gallery'),
+                      'gallery_link_base': 'https://example.org/galleries'},
+        'templates': {'article': os.path.join(ROOT, 'templates/article.j2'),
+                      'index':   os.path.join(ROOT, 'templates/index.j2')},
+        'themes':    {option: os.path.join(ROOT, F'themes/{option}.html') for option in
+                      ('header_include', 'body_before_include', 'body_after_include',
+                       'header_include_no_map', 'body_before_include_no_map',
+                       'body_after_include_no_map')},
+        'tools':     {'bic': '/bin/true'}})
+
+def child(mode, message_file, directory):
+    configure(directory)
+    start = time.perf_counter()
+    if mode == 'stream':
+        from mail2blog import controller
+        from mail2blog.view import ArticleRenderer
+        with open(message_file, 'rb') as fp:
+            entry = controller.store_message(fp)
+        renderer = ArticleRenderer(entry)
+        video = os.path.join(renderer.media_output_dir, 'sea.mp4')
+    else:
+        import email
+        with open(message_file, 'rb') as fp:
+            msg = email.message_from_binary_file(fp)
+        video = os.path.join(directory, 'sea.mp4')
+        for part in msg.walk():
+            if part.get_content_maintype() == 'video':
+                with open(video, 'wb') as out:
+                    out.write(part.get_payload(decode=True))
+    sha = hashlib.sha256()
+    with open(video, 'rb') as fp:
+        for data in iter(lambda: fp.read(2**20), b''):
+            sha.update(data)
+    print(json.dumps({'maxrss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+                      'elapsed': time.perf_counter() - start,
+                      'sha256': sha.hexdigest()}))
+
+def run(mode, message_file, directory):
+    res = subprocess.run([sys.executable, os.path.abspath(__file__),
+                          '--buffer', str(bench_args.buffer),
+                          '--child', mode, message_file, directory],
+                         stdout=subprocess.PIPE, check=True)
+    return json.loads(res.stdout.decode().strip().split('\n')[-1])
+
+def main():
+    if bench_args.child:
+        return child(*bench_args.child)
+    with tempfile.TemporaryDirectory() as tmp:
+        message_file = os.path.join(tmp, 'huge.mail')
+        digest, length = write_message(message_file, bench_args.size * 2**20)
+        print(F"message {os.path.getsize(message_file)/2**20:8.1f} MiB, "
+              F"video {length/2**20:8.1f} MiB")
+        modes = ['stream'] + (['email'] if bench_args.compare else [])
+        for mode in modes:
+            directory = os.path.join(tmp, mode)
+            os.makedirs(directory)
+            result = run(mode, message_file, directory)
+            print(F"{mode:6}  peak RSS {result['maxrss']/2**20:8.1f} MiB  "
+                  F"{result['elapsed']:8.3f} s")
+            assert result['sha256'] == digest, "extracted video differs"
+            if mode == 'stream':
+                assert result['maxrss'] < bench_args.cap * 2**20, \
+                        F"peak RSS above {bench_args.cap} MiB"
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+'''Per-page pandoc overhead of an article rebuild: one process per page vs. batches'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark pandoc rendering backends')
+parser.add_argument('--articles', '-n', default=1000, type=int)
+parser.add_argument('--batch-sizes',    default='1,10,50,200',
+                    help='comma separated [tools] pandoc_batch_size values; 1 = one process per page')
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthmail import text_message
+from mail2blog.config import CONFIG
+from mail2blog.renderbackend import PandocRenderer
+
+def main():
+    pages = [text_message(i).split('\n\n', 1)[1] for i in range(bench_args.articles)]
+    with tempfile.TemporaryDirectory() as tmp:
+        CONFIG.read_dict({'locations': {'temp_output': tmp},
+                          'themes': {
+            'header_include_no_map':      os.path.join(ROOT, 'themes/header_include_no_map.html'),
+            'body_before_include_no_map': os.path.join(ROOT, 'themes/body_before_include_no_map.html'),
+            'body_after_include_no_map':  os.path.join(ROOT, 'themes/body_after_include_no_map.html')}})
+        results = {}
+        for batch_size in [int(b) for b in bench_args.batch_sizes.split(',')]:
+            out = os.path.join(tmp, F"out-{batch_size}")
+            os.mkdir(out)
+            renderer = PandocRenderer(batch_size)
+            start = time.perf_counter()
+            for i, page in enumerate(pages):
+                renderer.submit(page, os.path.join(out, F"{i}.html"), title=F"Article {i}")
+            renderer.flush()
+            elapsed = time.perf_counter() - start
+            print(F"batch size {batch_size:4}  {len(pages):5} pages  {elapsed:8.2f} s  "
+                  F"{elapsed / len(pages) * 1000:8.2f} ms per page")
+            results[batch_size] = [open(os.path.join(out, F"{i}.html")).read()
+                                   for i in range(len(pages))]
+        outputs = list(results.values())
+        assert all(o == outputs[0] for o in outputs), "batched output differs"
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+'''IMAP body bytes of a cold and a warm render pass with the raw message cache'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark the raw message cache')
+parser.add_argument('--messages', '-n', default=50, type=int)
+parser.add_argument('--photo-bytes',    default=500000, type=int)
+parser.add_argument('--budget',         default=2**30, type=int,
+                    help='[cache] raw_max_bytes')
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import photo_mailbox
+from mail2blog.config import CONFIG
+from mail2blog import context
+from mail2blog.database import Blog
+
+def measure(server, name):
+    blog = Blog()
+    blog.read_entries_from_imap()
+    server.reset_counters()
+    start = time.perf_counter()
+    for entry in blog.entries:
+        entry.get_message()
+    elapsed = time.perf_counter() - start
+    print(F"{name:6} {len(blog.entries):5} messages  {server.round_trips:5} round trips  "
+          F"{server.bytes_sent/2**20:9.1f} MiB from IMAP  {elapsed:8.3f} s")
+    return server.bytes_sent
+
+def main():
+    mailbox = Mailbox(photo_mailbox(bench_args.messages, photo_bytes=bench_args.photo_bytes))
+    with tempfile.TemporaryDirectory() as tmp, ImapStandIn(mailbox) as server:
+        CONFIG.read_dict({'imap': server.config(),
+                          'cache': {'raw_max_bytes': str(bench_args.budget)},
+                          'locations': {'database': os.path.join(tmp, 'mail2blog.db'),
+                                        'raw_output': os.path.join(tmp, 'raw')}})
+        measure(server, 'cold')
+        warm = measure(server, 'warm')
+        if bench_args.budget >= bench_args.messages * bench_args.photo_bytes * 3:
+            assert warm == 0
+        context.current().imap.disconnect()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+'''Full-text search: FTS5 vs. scanning the raw mails, and the size of the static index'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark full-text search')
+parser.add_argument('--articles', '-n', default=5000, type=int)
+parser.add_argument('--words',    '-w', default=300, type=int, help='words per article')
+parser.add_argument('--vocabulary', default=30000, type=int)
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mail2blog.config import CONFIG
+from mail2blog import search
+from mail2blog.database import Blog_entry, store_entries
+
+def vocabulary(rnd, size):
+    letters = 'abcdefghijklmnopqrstuvwxyzäöü'
+    return sorted({''.join(rnd.choice(letters) for _ in range(rnd.randint(3, 11)))
+                   for _ in range(size)})
+
+def articles(rnd, words, n, length):
+    '''Zipf distributed words, like real text'''
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    for i in range(n):
+        yield i, ' '.join(rnd.choices(words, weights, k=length))
+
+def scan(raw_output, words):
+    '''what finding a text took before: read every raw.mail'''
+    hits = []
+    for message_id in os.listdir(raw_output):
+        with open(os.path.join(raw_output, message_id, 'raw.mail'), encoding='utf-8') as fh:
+            text = fh.read().lower()
+        if all(word in text for word in words):
+            hits.append(message_id)
+    return hits
+
+def check_search_js(output, words, expected):
+    '''run search.js in node against the written files'''
+    shim = '''
+        const fs = require('fs'), path = require('path');
+        global.window = global;
+        global.document = {currentScript: {src: 'file://%s/'}};
+        global.fetch = (url) => Promise.resolve({ok: fs.existsSync(url.slice(7)),
+            json: () => JSON.parse(fs.readFileSync(url.slice(7), 'utf-8'))});
+        eval(fs.readFileSync('%s', 'utf-8'));
+        search(process.argv[1]).then(r => console.log(JSON.stringify(r.map(d => d.link))));
+    ''' % (output, os.path.join(output, 'search.js'))
+    res = subprocess.run(['node', '-e', shim, ' '.join(words)], capture_output=True, check=True)
+    assert sorted(json.loads(res.stdout)) == sorted(expected), res.stderr
+
+def main():
+    rnd = random.Random(0)
+    words = vocabulary(rnd, bench_args.vocabulary)
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_output = os.path.join(tmp, 'raw')
+        CONFIG.read_dict({'locations': {'database': os.path.join(tmp, 'mail2blog.db'),
+                                        'blog_output': os.path.join(tmp, 'blog'),
+                                        'raw_output': raw_output}})
+        texts = dict(articles(rnd, words, bench_args.articles, bench_args.words))
+        entries = [Blog_entry(F"a-{i}@example.org", "Jane Doe <jane@example.org>",
+                              F"Article {i}", 1600000000 + i * 86400) for i in texts]
+        store_entries(entries)
+        for entry in entries:
+            os.makedirs(os.path.join(raw_output, entry.message_id))
+            with open(os.path.join(raw_output, entry.message_id, 'raw.mail'), 'w') as fh:
+                fh.write(F"Subject: {entry.subject}\n\n{texts[int(entry.message_id[2:-12])]}\n")
+
+        start = time.perf_counter()
+        for entry in entries:
+            search.index_article(entry.message_id, entry.subject,
+                                 texts[int(entry.message_id[2:-12])])
+        elapsed = time.perf_counter() - start
+        print(F"indexing       {elapsed:8.3f} s  {len(entries) / elapsed:8.0f} articles/s")
+
+        queries = [[words[5]], [words[50], words[700]], [words[3000]]]
+        for query in queries:
+            start = time.perf_counter()
+            scanned = scan(raw_output, query)
+            scan_time = time.perf_counter() - start
+            start = time.perf_counter()
+            found = search.search(query, limit=len(entries))
+            fts_time = time.perf_counter() - start
+            print(F"{' '.join(query):24} scan {scan_time * 1000:8.1f} ms   "
+                  F"fts5 {fts_time * 1000:8.1f} ms  {len(found):5} hits")
+            assert sorted(row['message_id'] for row in found) == sorted(scanned)
+
+        static = search.StaticIndex()
+        start = time.perf_counter()
+        static.write()
+        print(F"static index   {time.perf_counter() - start:8.3f} s")
+        sizes = {name: os.path.getsize(os.path.join(static.output, name))
+                 for name in os.listdir(static.output)}
+        terms = [size for name, size in sizes.items() if name.startswith('terms-')]
+        print(F"{len(sizes)} files, {sum(sizes.values()) / 2**20:.1f} MiB in all, terms files "
+              F"{sum(terms) / len(terms) / 1024:.1f} KiB on average, "
+              F"{max(terms) / 1024:.1f} KiB at most")
+
+        # one new article touches the docs file at the end and the terms files of its words
+        entry = Blog_entry("new@example.org", "Jane Doe <jane@example.org>", "New", 1900000000)
+        store_entries([entry])
+        search.index_article(entry.message_id, entry.subject, ' '.join(words[:20]))
+        written = static.write()
+        print(F"one new article: {len(written)} of {len(sizes)} files written")
+        assert 'docs-0.json' not in written
+
+        if shutil.which('node'):
+            for query in queries:
+                found = search.search(query, limit=len(entries) + 1)
+                check_search_js(static.output, query, [row['link'] for row in found])
+            print("search.js finds the same articles")
+
+if __name__ == '__main__':
+    sys.exit(main())
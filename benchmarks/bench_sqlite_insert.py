@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+'''Insert throughput of blog entries: connect/format/commit per entry vs. the pooled db layer'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark storing blog entries in sqlite')
+parser.add_argument('--entries', '-n', default=10000, type=int)
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mail2blog.config import CONFIG
+from mail2blog import db
+from mail2blog.database import Blog, Blog_entry, store_entries
+
+HOSTILE_SUBJECTS = [
+    "Rock'n'Roll",
+    'the "best" day',
+    "'); drop table mail2blog; --",
+    "100% %s %d %(name)s",
+    "back\\slash and ? and :name",
+    "Grüße aus Åre — 山 🏔",
+    "nul\x00byte",
+    "line\nbreak",
+    "",
+]
+
+def legacy_store(database, entry):
+    '''how Blog_entry.store_in_db stored an entry before'''
+    conn = sqlite3.connect(database)
+    cur  = conn.cursor()
+    cur.execute('''insert into mail2blog values(%f, '%s', '%s', '%s')''' %
+            (entry.epoch, entry.message_id, entry.email_from, entry.subject))
+    conn.commit()
+    conn.close()
+
+def make_entries(prefix, n):
+    return [Blog_entry(F"{prefix}-{i}@example.org", "Jane Doe <jane@example.org>",
+                       F"Entry number {i}", 1600000000 + i) for i in range(n)]
+
+def count(database):
+    conn = sqlite3.connect(database)
+    rows = conn.execute('''select count(*) from mail2blog''').fetchone()[0]
+    conn.close()
+    return rows
+
+def timed(name, n, function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print(F"{name:34} {elapsed:8.3f} s  {n / elapsed:10.0f} entries/s")
+
+def check_hostile(tmp):
+    '''subjects and senders that broke the formatted insert must round-trip unchanged'''
+    CONFIG.read_dict({'locations': {'database': os.path.join(tmp, 'hostile.db')}})
+    entries = [Blog_entry(F"hostile-{i}@example.org", F"O'Brien \"{i}\" <ob@example.org>",
+                          subject, 1600000000 + i) for i, subject in enumerate(HOSTILE_SUBJECTS)]
+    entries[0].store_in_db()
+    assert store_entries(entries) == len(entries) - 1
+    assert store_entries(entries) == 0          # duplicates are ignored
+    blog = Blog()
+    blog.read_entries_from_db()
+    assert [(e.message_id, e.email_from, str(e.subject)) for e in blog.entries] == \
+           [(e.message_id, e.email_from, str(e.subject)) for e in entries]
+    assert str(blog.entries[2].subject) == "'); drop table mail2blog; --"
+    print(F"{len(entries)} hostile subjects round-trip unchanged")
+
+def main():
+    n = bench_args.entries
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_db = os.path.join(tmp, 'legacy.db')
+        conn = sqlite3.connect(legacy_db)      # rollback journal, as before
+        for statement in db.SCHEMA:
+            conn.execute(statement)
+        conn.close()
+        entries = make_entries('legacy', n)
+        timed('connect + format + commit each', n,
+              lambda: [legacy_store(legacy_db, entry) for entry in entries])
+        assert count(legacy_db) == n
+
+        CONFIG.read_dict({'locations': {'database': os.path.join(tmp, 'single.db')}})
+        entries = make_entries('single', n)
+        timed('store_in_db, commit each', n, lambda: [entry.store_in_db() for entry in entries])
+
+        CONFIG.read_dict({'locations': {'database': os.path.join(tmp, 'bulk.db')}})
+        entries = make_entries('bulk', n)
+        timed('store_entries, one transaction', n, lambda: store_entries(entries))
+        blog = Blog()
+        timed('read_entries_from_db', n, blog.read_entries_from_db)
+        assert len(blog.entries) == n
+
+        check_hostile(tmp)
+        db.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+'''Startup cost of the mail2blog commands, from python -X importtime, against a budget'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# Every measurement is a new python process; the best of --repeat runs counts. Besides the
+# import time this checks that importing has no side effects, and that the paths which render
+# nothing (mail2blog --list-messages, the ingest of controller.parse_mail) never import the
+# heavy dependencies.
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+parser = argparse.ArgumentParser(description='benchmark the startup time')
+parser.add_argument('--repeat',   '-r', default=5, type=int)
+parser.add_argument('--budget-ms',      default=150, type=float,
+                    help='budget for importing mail2blog.view (the mail2blog command)')
+parser.add_argument('--ingest-budget-ms', default=100, type=float,
+                    help='budget for importing mail2blog.controller (the stdin ingest)')
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox, text_message
+
+HEAVY = ['numpy', 'PIL', 'pypandoc', 'jinja2']
+
+def run(code, *argv, stdin=None):
+    '''run code in a fresh python with -X importtime: (stdout, {module: cumulative us})'''
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', code] + list(argv),
+                         input=stdin, capture_output=True, check=True, cwd=ROOT,
+                         env=dict(os.environ, PYTHONPATH=ROOT))
+    imports = {}
+    other   = []
+    for line in res.stderr.decode().splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, module = line.split('|')
+            if cumulative.strip().isdigit():
+                imports[module.strip()] = int(cumulative)
+        else:
+            other.append(line)
+    return res.stdout.decode(), imports, other
+
+def heavy(imports):
+    return sorted({module.split('.')[0] for module in imports} & set(HEAVY))
+
+def import_time(module):
+    '''best import time of module in ms, and what the import of it pulled in'''
+    best = None
+    for _ in range(bench_args.repeat):
+        _, imports, _ = run(F"import {module}")
+        best = imports[module] if best is None else min(best, imports[module])
+    print(F"import {module:24} {best / 1000:7.1f} ms  heavy: {heavy(imports) or 'none'}")
+    return best / 1000, imports
+
+def main():
+    _, deferred, _ = run('import numpy, PIL.Image, pypandoc, jinja2')
+    print(F"{'numpy, PIL, pypandoc, jinja2':31} "
+          F"{sum(deferred[m] for m in ('numpy', 'PIL.Image', 'pypandoc', 'jinja2')) / 1000:7.1f} ms"
+          F"  (imported only when rendering)")
+
+    view_ms, imports = import_time('mail2blog.view')
+    assert not heavy(imports), heavy(imports)
+    assert view_ms < bench_args.budget_ms, view_ms
+    ingest_ms, imports = import_time('mail2blog.controller')
+    assert not heavy(imports) and 'imaplib' not in imports
+    assert ingest_ms < bench_args.ingest_budget_ms, ingest_ms
+    for module in ('mail2blog.lmtpd', 'mail2blog.database'):
+        assert not heavy(import_time(module)[1])
+
+    # importing neither parses sys.argv, nor reads config files, nor sets up logging
+    out, _, other = run('import logging, mail2blog.view, mail2blog.lmtpd, mail2blog.context as c; '
+                        'print(logging.getLogger().handlers, c._current)', '--no-such-option')
+    assert out.strip() == '[] None' and not other, (out, other)
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            ImapStandIn(Mailbox(text_mailbox(20))) as server:
+        config_file = os.path.join(tmp, 'mail2blog.conf')
+        with open(config_file, 'w') as fh:
+            fh.write('[imap]\n' + ''.join(F"{k} = {v}\n" for k, v in server.config().items()) +
+                     F"[locations]\ndatabase = {tmp}/mail2blog.db\nraw_output = {tmp}/raw\n")
+        out, imports, _ = run('import sys; from mail2blog.view import main; sys.exit(main())',
+                              '-c', config_file, '--list-messages')
+        assert len(out.splitlines()) >= 20 and not heavy(imports), heavy(imports)
+        print(F"mail2blog --list-messages        heavy: {heavy(imports) or 'none'}")
+        out, imports, _ = run('from mail2blog.controller import parse_mail; parse_mail()',
+                              '-c', config_file, stdin=text_message(99).encode())
+        assert 'Subject:' in out and not heavy(imports), heavy(imports)
+        print(F"controller.parse_mail            heavy: {heavy(imports) or 'none'}")
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+'''Template cost of the per-entry index: compiling per call vs. the shared environment'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark template rendering')
+parser.add_argument('--entries', '-n', default=5000, type=int)
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from jinja2 import Template
+from mail2blog.config import CONFIG
+from mail2blog.database import Blog, Blog_entry
+
+def compile_per_call(entry):
+    '''how Blog_entry.__str__ rendered before: read and compile the template every time'''
+    with open(CONFIG.get('templates', 'index'), 'r') as fh:
+        template = Template(fh.read())
+    return template.render(date=entry.date, subject=entry.subject, author=entry.author,
+            author_first=entry.author.split(' ')[0], author_last=entry.author.split(' ')[1],
+            author_email=entry.author_email,
+            link=F"{entry.get_subject(replace_spaces=True)}-{entry.message_id}.html")
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        CONFIG.read_dict({'templates': {'index': os.path.join(ROOT, 'templates/index.j2'),
+                                        'index_new': os.path.join(ROOT, 'templates/index_new.j2')},
+                          'cache': {'jinja_bytecode': os.path.join(tmp, 'jinja')}})
+        blog = Blog()
+        blog.entries = [Blog_entry(F"id-{i}@example.org", "Jane Doe <jane@example.org>",
+                                   F"Entry number {i}", 1600000000 + i) for i in range(bench_args.entries)]
+        start = time.perf_counter()
+        old = "\n".join(compile_per_call(entry) for entry in blog.entries)
+        print(F"compile per entry  {time.perf_counter() - start:8.3f} s")
+        start = time.perf_counter()
+        new = blog.generate_index()
+        print(F"shared environment {time.perf_counter() - start:8.3f} s")
+        assert old == new
+
+if __name__ == '__main__':
+    sys.exit(main())
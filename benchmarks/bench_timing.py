@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+'''Cost of the timing instrumentation: off, recording a report, and with --profile'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark the timing instrumentation')
+parser.add_argument('--messages', '-n', default=100, type=int)
+parser.add_argument('--calls',          default=1000000, type=int,
+                    help='stages for the cost of one stage')
+parser.add_argument('--profile',        default=5, type=int)
+parser.add_argument('--max-overhead',   default=0.001, type=float,
+                    help='target: share of the render time the switched off stages may take')
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox, photo_mailbox, gpx_mailbox
+from mail2blog.config import CONFIG
+from mail2blog import context
+from mail2blog import parse_args
+from mail2blog import timing
+from mail2blog import view
+
+THEMES = ['header_include', 'body_before_include', 'body_after_include',
+          'header_include_no_map', 'body_before_include_no_map', 'body_after_include_no_map']
+STAGES = {'header_listing', 'body_fetch', 'article', 'walker', 'gpx', 'gallery', 'write_output',
+          'index', 'search_index', 'feeds'}
+
+def stage_cost():
+    '''seconds per stage, switched off and recording'''
+    costs = []
+    for recording in (False, True):
+        if recording:
+            timing.start()
+        start = time.perf_counter()
+        for _ in range(bench_args.calls):
+            with timing.stage('stage', 'article') as stage:
+                stage.bytes = 1
+        costs.append((time.perf_counter() - start) / bench_args.calls)
+        if recording:
+            timing._recorder = None
+    return costs
+
+def configure(tmp, server):
+    CONFIG.read_dict({
+        'imap':      server.config(),
+        'locations': {'database': os.path.join(tmp, 'mail2blog.db'),
+                      'raw_output': os.path.join(tmp, 'raw'),
+                      'temp_output': os.path.join(tmp, 'tmp'),
+                      'blog_output': os.path.join(tmp, 'blog'),
+                      'gallery_output': os.path.join(tmp, 'gallery'),
+                      'gallery_link_base': 'https://example.org/galleries'},
+        'templates': {name: os.path.join(ROOT, 'templates', name + '.j2')
+                      for name in ('article', 'index', 'index_new')},
+        'themes':    {option: os.path.join(ROOT, 'themes', option + '.html') for option in THEMES}})
+
+def run(name, argv):
+    '''one run of mail2blog that renders every article'''
+    context.activate(context.AppContext(parse_args.parseOptions(['--force'] + argv)))
+    start = time.perf_counter()
+    view.generate_index()
+    elapsed = time.perf_counter() - start
+    context.current().close()
+    print(F"{name:28} {elapsed:8.3f} s")
+    return elapsed
+
+def main():
+    off, on = stage_cost()
+    print(F"one stage, off               {off * 1e9:8.0f} ns")
+    print(F"one stage, recording         {on * 1e9:8.0f} ns")
+
+    mails = (text_mailbox(bench_args.messages) + photo_mailbox(2, seed=1, real=True) +
+             gpx_mailbox(2, seed=2))
+    mailbox = Mailbox(mails)
+    with tempfile.TemporaryDirectory() as tmp, ImapStandIn(mailbox) as server:
+        configure(tmp, server)
+        report_file     = os.path.join(tmp, 'report.json')
+        prometheus_file = os.path.join(tmp, 'mail2blog.prom')
+        recording       = {'timing': {'report': report_file, 'prometheus': prometheus_file}}
+        CONFIG.read_dict(recording)
+        run('first run (downloads)', [])
+        with open(report_file, encoding='utf-8') as fh:
+            first = json.load(fh)
+        with open(prometheus_file, encoding='utf-8') as fh:
+            metrics = dict(line.rsplit(' ', 1) for line in fh if not line.startswith('#'))
+
+        CONFIG.remove_section('timing')
+        baseline = run('timing off', [])
+        CONFIG.read_dict(recording)
+        run('report and prometheus', [])
+        with open(report_file, encoding='utf-8') as fh:
+            report = json.load(fh)
+        run(F"--profile {bench_args.profile}", ['--profile', str(bench_args.profile)])
+        with open(report_file, encoding='utf-8') as fh:
+            profiled = json.load(fh)
+        assert len(profiled['profiles']) == bench_args.profile
+        assert all(os.path.getsize(profile['file']) for profile in profiled['profiles'])
+
+    # what the stages cost when switched off, from how many a run passes
+    calls = sum(total['count'] for total in report['stages'].values())
+    calls += sum(total['count'] for total in report['subprocesses'].values())
+    overhead = calls * off / baseline
+    print(F"{calls} stages per run: {calls * off * 1e6:.0f} us switched off, "
+          F"{overhead:.5%} of the run")
+    assert overhead < bench_args.max_overhead
+
+    print('slowest stages: ' + ', '.join(F"{name} {total['seconds']:.2f} s" for name, total in
+          sorted(report['stages'].items(), key=lambda item: -item[1]['seconds'])[:5]))
+    assert STAGES <= set(first['stages']), STAGES - set(first['stages'])
+    assert int(metrics['mail2blog_articles']) == bench_args.messages + 4
+    assert float(metrics['mail2blog_stage_bytes{stage="body_fetch"}']) == \
+           sum(len(raw) for _, raw in mailbox.messages)
+    assert report['subprocesses']['pandoc']['count'] >= 1
+    assert report['stages']['article']['count'] == bench_args.messages + 4
+    slowest = sorted((a['seconds'] for a in profiled['articles'].values()), reverse=True)
+    assert [p['seconds'] for p in profiled['profiles']] == slowest[:bench_args.profile]
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+'''Per-article body lookup cost: HEADER Message-ID search vs. the local UID index'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description='benchmark message lookup by UID index')
+parser.add_argument('--sizes',    default='250,1000,4000',
+                    help='comma separated mailbox sizes')
+parser.add_argument('--articles', default=50, type=int,
+                    help='number of articles to fetch per mailbox')
+bench_args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox
+from mail2blog.config import CONFIG
+from mail2blog.imapconnector import ImapConnector
+from mail2blog.database import ImapSync
+
+def main():
+    for size in [int(s) for s in bench_args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp, \
+                ImapStandIn(Mailbox(text_mailbox(size))) as server:
+            CONFIG.read_dict({'imap': server.config(),
+                              'locations': {'database': os.path.join(tmp, 'mail2blog.db')}})
+            connector = ImapConnector()
+            rows = ImapSync(connector).sync()[-bench_args.articles:]
+            for name, use_uid in (('search', False), ('uid index', True)):
+                server.reset_counters()
+                start = time.perf_counter()
+                for row in rows:
+                    uid, raw = connector.get_raw_message(row['message_id'],
+                                                         row['uid'] if use_uid else None)
+                    assert uid == row['uid']
+                elapsed = time.perf_counter() - start
+                print(F"{size:6} messages  {name:10} {server.commands['UID SEARCH']:4} searches  "
+                      F"{elapsed / len(rows) * 1000:8.2f} ms per article")
+            connector.disconnect()
+
+if __name__ == '__main__':
+    sys.exit(main())
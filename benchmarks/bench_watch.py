@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+'''Publish latency and IMAP load of --watch (IDLE) against a run from cron'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+parser = argparse.ArgumentParser(description='benchmark the IDLE watch mode')
+parser.add_argument('--messages', '-n', default=200, type=int)
+parser.add_argument('--latency',  '-l', default=0.001, type=float,
+                    help='artificial per-command server latency in seconds')
+parser.add_argument('--cron',           default=300, type=int,
+                    help='interval of the cron job to compare with, in seconds')
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox, text_message
+from mail2blog.config import CONFIG
+
+THEMES = ['header_include', 'body_before_include', 'body_after_include',
+          'header_include_no_map', 'body_before_include_no_map', 'body_after_include_no_map']
+
+def configure(tmp, server):
+    CONFIG.read_dict({
+        'imap':      server.config(),
+        'locations': {'database': os.path.join(tmp, 'mail2blog.db'),
+                      'raw_output': os.path.join(tmp, 'raw'),
+                      'temp_output': os.path.join(tmp, 'tmp'),
+                      'blog_output': os.path.join(tmp, 'blog'),
+                      'gallery_output': os.path.join(tmp, 'gallery'),
+                      'gallery_link_base': 'https://example.org/galleries'},
+        'templates': {'article': os.path.join(ROOT, 'templates/article.j2'),
+                      'index_new': os.path.join(ROOT, 'templates/index_new.j2')},
+        'themes':    {option: os.path.join(ROOT, 'themes', option + '.html') for option in THEMES},
+        'watch':     {'keepalive': '0.5', 'backoff_min': '0.1'}})
+
+def wait_for(condition, timeout=60):
+    start = time.perf_counter()
+    while not condition():
+        assert time.perf_counter() - start < timeout, "timed out"
+        time.sleep(0.005)
+    return time.perf_counter() - start
+
+def article(blog_output, i):
+    return [name for name in os.listdir(blog_output) if F"bench-0-{i}@" in name]
+
+def main():
+    mailbox = Mailbox(text_mailbox(bench_args.messages))
+    with tempfile.TemporaryDirectory() as tmp, \
+            ImapStandIn(mailbox, latency=bench_args.latency) as server:
+        configure(tmp, server)
+        from mail2blog import view
+        from mail2blog import context
+        from mail2blog.watch import Watcher
+        imap = context.current().imap
+        blog_output = CONFIG.get('locations', 'blog_output')
+
+        # what cron does every few minutes, even when nothing is new
+        view.generate_index()
+        imap.disconnect()           # every cron run is a new process
+        server.reset_counters()
+        start = time.perf_counter()
+        view.generate_index()
+        imap.disconnect()
+        cron_time = time.perf_counter() - start
+        cron_trips = server.round_trips
+        print(F"cron run, nothing new   {cron_time:8.3f} s  {cron_trips:4} round trips; every "
+              F"{bench_args.cron} s: {3600 / bench_args.cron * cron_trips:.0f} round trips/h, "
+              F"{bench_args.cron / 2:.0f} s latency on average")
+
+        watcher = Watcher(imap, view.publish_new)
+        thread = threading.Thread(target=watcher.run, daemon=True)
+        thread.start()
+        wait_for(lambda: watcher.publishes == 1)
+
+        # one new mail: the server tells the IDLE connection about it
+        latencies = []
+        for i in range(bench_args.messages, bench_args.messages + 3):
+            server.reset_counters()
+            mailbox.append(text_message(i))
+            server.notify()
+            latencies.append(wait_for(lambda i=i: article(blog_output, i)
+                                      and watcher.publishes == i - bench_args.messages + 2))
+            print(F"watch, one new mail     {latencies[-1]:8.3f} s  {server.round_trips:4} "
+                  F"round trips {dict(server.commands)}")
+        assert max(latencies) < 10
+
+        # nothing happens: a NOOP every [watch] keepalive seconds, nothing else
+        server.reset_counters()
+        time.sleep(2)
+        print(F"watch, idle for 2 s               {server.round_trips:4} round trips "
+              F"{dict(server.commands)}")
+        assert set(server.commands) <= {'IDLE', 'NOOP'} and server.commands['NOOP'] >= 2
+
+        # the connection breaks while a mail arrives: reconnect, catch up
+        publishes = watcher.publishes
+        imap.M.socket().shutdown(socket.SHUT_RDWR)
+        new = bench_args.messages + 3
+        mailbox.append(text_message(new))
+        elapsed = wait_for(lambda: article(blog_output, new) and watcher.publishes > publishes)
+        print(F"watch, after reconnect  {elapsed:8.3f} s  {watcher.reconnects} reconnects")
+        assert watcher.reconnects == 1
+
+        watcher.stop()
+        thread.join(timeout=5)
+        index = os.path.join(blog_output, 'index.html')
+        with open(index, encoding='utf-8') as fh:
+            assert F"bench-0-{new}@" in fh.read()
+
+if __name__ == '__main__':
+    sys.exit(main())
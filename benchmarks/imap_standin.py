@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+'''Minimal local IMAP server stand-in for benchmarking mail2blog'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# Only the subset of RFC 3501 that imaplib and mail2blog actually use is implemented.
+# Every tagged command is counted, so benchmarks can report round trips next to wall time.
+
+import asyncio
+import collections
+import email
+import re
+import threading
+
+FETCH_ITEM_RE = re.compile(r'(BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+(?:\.\d+)?>)?|[A-Z0-9.]+)', re.I)
+PARTIAL_RE    = re.compile(r'<(\d+)(?:\.(\d+))?>$')
+
+def _tokenize(text):
+    '''split an IMAP argument string into atoms and quoted strings, ignoring parens'''
+    return [a if a else b for a, b in re.findall(r'"((?:[^"\\]|\\.)*)"|([^\s()]+)', text)]
+
+def _parse_sequence_set(text, maximum):
+    '''turn "1:4,7,9:*" into a set of integers'''
+    result = set()
+    for part in text.split(','):
+        if ':' in part:
+            low, high = part.split(':')
+            low  = maximum if low  == '*' else int(low)
+            high = maximum if high == '*' else int(high)
+            if low > high:
+                low, high = high, low
+            result.update(range(low, high + 1))
+        else:
+            result.add(maximum if part == '*' else int(part))
+    return result
+
+def _header_fields(raw, fields):
+    '''return only the requested header fields of a raw message, like HEADER.FIELDS'''
+    header = raw.split(b'\r\n\r\n', 1)[0]
+    wanted = {f.lower() for f in fields}
+    out = []
+    keep = False
+    for line in header.split(b'\r\n'):
+        if line[:1] in (b' ', b'\t'):
+            if keep:
+                out.append(line)
+            continue
+        keep = line.split(b':', 1)[0].decode('ascii', 'replace').strip().lower() in wanted
+        if keep:
+            out.append(line)
+    return b'\r\n'.join(out) + b'\r\n\r\n'
+
+
+class Mailbox():
+    '''A list of raw RFC822 messages with UIDs'''
+    def __init__(self, messages=None, uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.uidnext     = 1
+        self.messages    = []    # list of (uid, raw_bytes)
+        for raw in messages or []:
+            self.append(raw)
+
+    def append(self, raw):
+        if isinstance(raw, str):
+            raw = raw.encode('utf-8')
+        raw = raw.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+        self.messages.append((self.uidnext, raw))
+        self.uidnext += 1
+
+    def expunge(self, uid):
+        self.messages = [(u, r) for (u, r) in self.messages if u != uid]
+
+
+class ImapStandIn():
+    '''Serve a Mailbox over plain-text IMAP on localhost from a background thread
+
+    latency:   seconds of artificial delay added before every tagged response
+    network_latency: seconds every response takes to reach the client. Unlike latency this
+               is not spent in the server, so commands a client sends without waiting for
+               the answer to the one before (pipelining) overlap
+    bye_every: if set, a connection is dropped with BYE instead of answering its n-th FETCH'''
+    def __init__(self, mailbox=None, latency=0.0, host='127.0.0.1', port=0, bye_every=0,
+                 network_latency=0.0):
+        self.mailbox     = mailbox if mailbox is not None else Mailbox()
+        self.latency     = latency
+        self.network_latency = network_latency
+        self.bye_every   = bye_every
+        self.byes        = 0
+        self.host        = host
+        self.port        = port
+        self.commands    = collections.Counter()
+        self.bytes_sent  = 0
+        self.connections = 0
+        self._loop       = None
+        self._server     = None
+        self._thread     = None
+        self._writers    = set()
+
+    @property
+    def round_trips(self):
+        return sum(self.commands.values())
+
+    def reset_counters(self):
+        self.commands.clear()
+        self.bytes_sent = 0
+
+    def config(self):
+        '''the [imap] config section that points mail2blog to this server'''
+        return {'host': self.host, 'port': str(self.port), 'ssl': 'no',
+                'user': 'bench', 'pass': 'bench'}
+
+    def start(self):
+        ready = threading.Event()
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                    asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        async def shutdown():
+            self._server.close()
+            tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    def notify(self):
+        '''tell all connected clients (e.g. in IDLE) about the current mailbox size'''
+        def send():
+            for writer in list(self._writers):
+                writer.write(F'* {len(self.mailbox.messages)} EXISTS\r\n'.encode())
+        self._loop.call_soon_threadsafe(send)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self._writers.add(writer)
+        fetches = 0
+        loop = asyncio.get_running_loop()
+        delayed = asyncio.Queue()
+        async def deliver():
+            while True:
+                due, data = await delayed.get()
+                if data is None:
+                    return
+                await asyncio.sleep(due - loop.time())
+                writer.write(data)
+        deliverer = asyncio.create_task(deliver()) if self.network_latency else None
+        def send(data):
+            if deliverer is None:
+                writer.write(data)
+            else:
+                delayed.put_nowait((loop.time() + self.network_latency, data))
+        send(b'* OK [CAPABILITY IMAP4rev1 ENABLE IDLE UIDPLUS] mail2blog stand-in ready\r\n')
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                line = line.decode('utf-8', 'replace').rstrip('\r\n')
+                if not line:
+                    continue
+                tag, _, rest = line.partition(' ')
+                command, _, arguments = rest.partition(' ')
+                command = command.upper()
+                self.commands[command if command != 'UID'
+                        else 'UID ' + arguments.split(' ')[0].upper()] += 1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if 'FETCH' in rest.upper().split(' ')[:2]:
+                    fetches += 1
+                    if self.bye_every and fetches % self.bye_every == 0:
+                        self.byes += 1
+                        send(b'* BYE connection dropped by the stand-in\r\n')
+                        break
+                if command == 'IDLE':
+                    send(b'+ idling\r\n')
+                    await writer.drain()
+                    await reader.readline()          # DONE
+                    send(F'{tag} OK IDLE terminated\r\n'.encode())
+                    await writer.drain()
+                    continue
+                response = self._dispatch(tag, command, arguments)
+                self.bytes_sent += len(response)
+                send(response)
+                await writer.drain()
+                if command == 'LOGOUT':
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            if deliverer is not None:
+                delayed.put_nowait((0, None))
+                try:
+                    await deliverer
+                except (ConnectionError, asyncio.CancelledError):
+                    pass
+            self._writers.discard(writer)
+            writer.close()
+
+    def _dispatch(self, tag, command, arguments):
+        ok = F'{tag} OK {command} completed\r\n'.encode()
+        if command == 'CAPABILITY':
+            return b'* CAPABILITY IMAP4rev1 ENABLE IDLE UIDPLUS\r\n' + ok
+        if command in ('LOGIN', 'NOOP', 'CLOSE', 'CHECK'):
+            return ok
+        if command == 'LOGOUT':
+            return b'* BYE logging out\r\n' + ok
+        if command == 'ENABLE':
+            return b'* ENABLED UTF8=ACCEPT\r\n' + ok
+        if command in ('SELECT', 'EXAMINE'):
+            box = self.mailbox
+            return (F'* {len(box.messages)} EXISTS\r\n'
+                    F'* 0 RECENT\r\n'
+                    F'* OK [UIDVALIDITY {box.uidvalidity}] UIDs valid\r\n'
+                    F'* OK [UIDNEXT {box.uidnext}] Predicted next UID\r\n'
+                    F'* FLAGS (\\Seen)\r\n'
+                    F'{tag} OK [READ-ONLY] {command} completed\r\n').encode()
+        if command == 'SEARCH':
+            return self._search(arguments, use_uid=False) + ok
+        if command == 'FETCH':
+            return self._fetch(arguments, use_uid=False) + ok
+        if command == 'UID':
+            subcommand, _, arguments = arguments.partition(' ')
+            subcommand = subcommand.upper()
+            if subcommand == 'SEARCH':
+                return self._search(arguments, use_uid=True) + ok
+            if subcommand == 'FETCH':
+                return self._fetch(arguments, use_uid=True) + ok
+        return F'{tag} BAD unsupported command {command}\r\n'.encode()
+
+    def _search(self, arguments, use_uid):
+        tokens = _tokenize(arguments)
+        if tokens and tokens[0].upper() == 'CHARSET':
+            tokens = tokens[2:]
+        messages = self.mailbox.messages
+        maxuid = messages[-1][0] if messages else 0
+        hits = []
+        for seq, (uid, raw) in enumerate(messages, 1):
+            match = True
+            i = 0
+            while i < len(tokens):
+                token = tokens[i].upper()
+                if token == 'ALL':
+                    i += 1
+                elif token == 'UID':
+                    match &= uid in _parse_sequence_set(tokens[i+1], maxuid)
+                    i += 2
+                elif token == 'HEADER':
+                    value = email.message_from_bytes(raw.split(b'\r\n\r\n', 1)[0]).get(tokens[i+1], '')
+                    match &= tokens[i+2].lower() in str(value).lower()
+                    i += 3
+                else:
+                    match &= seq in _parse_sequence_set(tokens[i], len(messages))
+                    i += 1
+            if match:
+                hits.append(uid if use_uid else seq)
+        return ('* SEARCH' + ''.join(F' {h}' for h in hits) + '\r\n').encode()
+
+    def _fetch(self, arguments, use_uid):
+        sequence_set, _, items = arguments.partition(' ')
+        messages = self.mailbox.messages
+        if use_uid:
+            wanted = _parse_sequence_set(sequence_set, messages[-1][0] if messages else 0)
+        else:
+            wanted = _parse_sequence_set(sequence_set, len(messages))
+        items = FETCH_ITEM_RE.findall(items.strip().lstrip('(').rstrip(')'))
+        if use_uid and 'UID' not in [i.upper() for i in items]:
+            items = ['UID'] + items
+        out = []
+        for seq, (uid, raw) in enumerate(messages, 1):
+            if (uid if use_uid else seq) not in wanted:
+                continue
+            parts = []
+            for item in items:
+                name = item.upper()
+                if name == 'UID':
+                    parts.append(F'UID {uid}'.encode())
+                elif name == 'RFC822.SIZE':
+                    parts.append(F'RFC822.SIZE {len(raw)}'.encode())
+                elif name == 'FLAGS':
+                    parts.append(b'FLAGS (\\Seen)')
+                else:
+                    label, data = self._section(item, raw)
+                    parts.append(F'{label} {{{len(data)}}}\r\n'.encode() + data)
+            out.append(F'* {seq} FETCH ('.encode() + b' '.join(parts) + b')\r\n')
+        return b''.join(out)
+
+    @staticmethod
+    def _section(item, raw):
+        '''return the response label and the data for a BODY[...]/RFC822 fetch item'''
+        name = item.upper()
+        if name == 'RFC822':
+            return 'RFC822', raw
+        if name == 'RFC822.HEADER':
+            return 'RFC822.HEADER', raw.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n'
+        label = item.replace('.PEEK', '').replace('.peek', '')
+        section = label[label.index('[')+1:label.index(']')].upper()
+        if section == '':
+            data = raw
+        elif section == 'HEADER':
+            data = raw.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n'
+        elif section.startswith('HEADER.FIELDS'):
+            fields = section[section.index('(')+1:section.rindex(')')].split()
+            data = _header_fields(raw, fields)
+        elif section == 'TEXT':
+            data = raw.split(b'\r\n\r\n', 1)[-1]
+        else:
+            data = b''
+        partial = PARTIAL_RE.search(label)
+        if partial:
+            start = int(partial.group(1))
+            end = start + int(partial.group(2)) if partial.group(2) else len(data)
+            data = data[start:end]
+            label = label[:partial.start()] + F'<{start}>'
+        return label, data
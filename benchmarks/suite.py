@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+'''The benchmark suite: the main paths of mail2blog on a synthetic mailbox, as JSON'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# The mailbox (text, photo and gpx mails, see synthmail.py) is generated from --seed, so two
+# runs with the same arguments work on the same bytes. It is served by the IMAP stand-in on
+# localhost; everything else goes to a temporary directory.
+#
+#     benchmarks/suite.py --size medium --output before.json
+#     (change something)
+#     benchmarks/suite.py --size medium --output after.json --compare before.json
+#
+# Every benchmark runs --repeat times; the best run counts. With --compare the suite exits
+# with 1 if a benchmark got slower than --max-slowdown times its time in the baseline.
+
+import argparse
+import contextlib
+import email
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SIZES = {'small':  {'text': 50,   'photos': 5,   'gpx': 3},
+         'medium': {'text': 500,  'photos': 20,  'gpx': 10},
+         'large':  {'text': 5000, 'photos': 100, 'gpx': 30}}
+
+parser = argparse.ArgumentParser(description='run the mail2blog benchmark suite')
+parser.add_argument('--size',     '-s', default='small', choices=list(SIZES))
+parser.add_argument('--text',           type=int, help='text mails (default: by --size)')
+parser.add_argument('--photos',         type=int, help='photo mails (default: by --size)')
+parser.add_argument('--gpx',            type=int, help='gpx mails (default: by --size)')
+parser.add_argument('--photo-bytes',    default=200000, type=int)
+parser.add_argument('--gpx-points',     default=7200, type=int, help='points per track, 1 Hz')
+parser.add_argument('--ingest',         default=10, type=int,
+                    help='mails stored by controller.parse_mail, one process each')
+parser.add_argument('--seed',           default=0, type=int)
+parser.add_argument('--repeat',   '-r', default=3, type=int)
+parser.add_argument('--only',           nargs='+', help='run only these benchmarks')
+parser.add_argument('--output',   '-o', help='write the results to this JSON file')
+parser.add_argument('--compare',  '-c', help='JSON file of an earlier run to compare with')
+parser.add_argument('--max-slowdown',   default=1.25, type=float)
+bench_args = parser.parse_args()
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from imap_standin import ImapStandIn, Mailbox
+import synthmail
+from mail2blog.config import CONFIG
+from mail2blog import context
+from mail2blog import controller
+from mail2blog import geometry
+from mail2blog import gpxreduce
+from mail2blog import parse_args
+from mail2blog import tools
+from mail2blog.database import Blog
+from mail2blog.imapconnector import ImapConnector
+from mail2blog.renderbackend import PandocRenderer
+from mail2blog.view import ArticleRenderer
+
+THEMES = ['header_include', 'body_before_include', 'body_after_include',
+          'header_include_no_map', 'body_before_include_no_map', 'body_after_include_no_map']
+
+BENCHMARKS = {}
+
+def benchmark(function):
+    '''register function(suite) as a benchmark. It returns the seconds of the part that
+    is measured, and a dict of other numbers'''
+    BENCHMARKS[function.__name__] = function
+    return function
+
+class Suite:
+    '''the mailbox, the stand-in server and the blog directories the benchmarks share'''
+    def __init__(self, tmp, server, seeds):
+        self.tmp    = tmp
+        self.server = server
+        self.seeds  = seeds      # kind of mail by the seed in its Message-ID
+        self.runs   = 0
+        CONFIG.read_dict({
+            'imap':      server.config(),
+            'locations': {'database': os.path.join(tmp, 'mail2blog.db'),
+                          'raw_output': os.path.join(tmp, 'raw'),
+                          'temp_output': os.path.join(tmp, 'tmp'),
+                          'blog_output': os.path.join(tmp, 'blog'),
+                          'gallery_output': os.path.join(tmp, 'gallery'),
+                          'gallery_link_base': 'https://example.org/galleries'},
+            'templates': {name: os.path.join(ROOT, 'templates', name + '.j2')
+                          for name in ('article', 'index', 'index_new')},
+            'themes':    {option: os.path.join(ROOT, 'themes', option + '.html')
+                          for option in THEMES},
+            'cache':     {'raw_max_bytes': str(2**40)}})
+        # render every time: the manifest would skip what is up to date
+        context.activate(context.AppContext(parse_args.parseOptions(['--force'])))
+        Blog.update_from_imap()
+        blog = Blog()
+        blog.read_entries_from_db()
+        self.entries = blog.entries
+        for entry in self.entries:
+            entry.get_message_path()
+        self.disconnect()
+
+    def kind(self, entry):
+        return self.seeds[entry.message_id.split('-')[1]]
+
+    def entries_of(self, kind):
+        return [entry for entry in self.entries if self.kind(entry) == kind]
+
+    def disconnect(self):
+        imap = context.current().imap
+        if imap.connected:
+            imap.disconnect()
+
+    def raw(self, kind):
+        entries = self.entries_of(kind)
+        for entry in entries:
+            with entry.open_message() as fh:
+                yield entry, fh.read()
+
+@benchmark
+def get_message_list(suite):
+    '''all headers of the folder through ImapConnector'''
+    connector = ImapConnector()
+    suite.server.reset_counters()
+    start = time.perf_counter()
+    messages = connector.get_message_list()
+    elapsed = time.perf_counter() - start
+    connector.disconnect()
+    return elapsed, {'messages': len(messages), 'round_trips': suite.server.round_trips}
+
+@benchmark
+def imap_sync(suite):
+    '''the header mirror of an empty database: the first run of mail2blog'''
+    database = CONFIG.get('locations', 'database')
+    suite.runs += 1
+    CONFIG.set('locations', 'database', os.path.join(suite.tmp, F"sync-{suite.runs}.db"))
+    suite.server.reset_counters()
+    try:
+        start = time.perf_counter()
+        rows = Blog.update_from_imap()
+        elapsed = time.perf_counter() - start
+        suite.disconnect()
+    finally:
+        CONFIG.set('locations', 'database', database)
+    return elapsed, {'messages': len(rows), 'round_trips': suite.server.round_trips}
+
+@benchmark
+def generate_index_new(suite):
+    '''the index markdown of all articles, from the database'''
+    start = time.perf_counter()
+    blog = Blog()
+    blog.read_entries_from_db(newest_first=True)
+    markdown = blog.generate_index_new()
+    return time.perf_counter() - start, {'articles': len(blog.entries),
+                                         'bytes': len(markdown.encode())}
+
+def render(suite, kind):
+    '''ArticleRenderer for every article of a kind, with pandoc; the bodies are local'''
+    entries = suite.entries_of(kind)
+    start = time.perf_counter()
+    pandoc = PandocRenderer()
+    for entry in entries:
+        ArticleRenderer(entry, pandoc)
+    pandoc.flush()
+    elapsed = time.perf_counter() - start
+    return elapsed, {'articles': len(entries),
+                     'ms_per_article': round(elapsed / max(len(entries), 1) * 1000, 2)}
+
+@benchmark
+def render_text(suite):
+    return render(suite, 'text')
+
+@benchmark
+def render_photo(suite):
+    '''articles with photos, including their galleries'''
+    return render(suite, 'photo')
+
+@benchmark
+def render_gpx(suite):
+    '''articles with a track, including the map'''
+    return render(suite, 'gpx')
+
+@benchmark
+def parse_mail(suite):
+    '''controller.parse_mail as an MTA runs it: a process per mail'''
+    suite.runs += 1
+    config_file = os.path.join(suite.tmp, 'ingest.conf')
+    with open(config_file, 'w') as fh:
+        fh.write('[locations]\n' + F"database = {suite.tmp}/ingest.db\n"
+                 F"raw_output = {suite.tmp}/ingest\n")
+    mails = [synthmail.text_message(i, seed=1000 + suite.runs).encode()
+             for i in range(bench_args.ingest)]
+    start = time.perf_counter()
+    for mail in mails:
+        subprocess.run([sys.executable, '-c', 'import sys; sys.argv[0] = "mail2blog"; '
+                        'from mail2blog.controller import parse_mail; parse_mail()',
+                        '-c', config_file], input=mail, check=True, capture_output=True,
+                       env=dict(os.environ, PYTHONPATH=ROOT))
+    elapsed = time.perf_counter() - start
+    return elapsed, {'mails': len(mails), 'mails_per_second': round(len(mails) / elapsed, 1)}
+
+@benchmark
+def store_message(suite):
+    '''controller.store_message in this process: the ingest without the startup'''
+    suite.runs += 1
+    mails = [synthmail.text_message(i, seed=2000 + suite.runs).encode()
+             for i in range(bench_args.ingest * 10)]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for mail in mails:
+            controller.store_message(io.BytesIO(mail))
+    elapsed = time.perf_counter() - start
+    return elapsed, {'mails': len(mails), 'mails_per_second': round(len(mails) / elapsed, 1)}
+
+@benchmark
+def gpx_map(suite):
+    '''the tracks of the gpx mails reduced to polylines, and the map script of their pages'''
+    tracks = []
+    for _, raw in suite.raw('gpx'):
+        for part in email.message_from_bytes(raw).walk():
+            if (part.get_filename() or '').endswith('.gpx'):
+                tracks.append(part.get_payload(decode=True))
+    start = time.perf_counter()
+    script = 0
+    for track in tracks:
+        polylines = gpxreduce.map_polylines(io.BytesIO(track), geometry.tolerance())
+        script += len(tools.geo_include(polylines).encode())
+    elapsed = time.perf_counter() - start
+    return elapsed, {'tracks': len(tracks), 'gpx_bytes': sum(len(track) for track in tracks),
+                     'script_bytes': script}
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=ROOT,
+                                  capture_output=True, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        revision = None
+    return {'revision': revision, 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())}
+
+def compare(results, baseline_file):
+    '''print the ratio to the baseline; the names of the benchmarks that got too slow'''
+    with open(baseline_file, encoding='utf-8') as fh:
+        baseline = json.load(fh)['results']
+    slower = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['seconds'] / baseline[name]['seconds']
+        print(F"{name:20} {baseline[name]['seconds']:9.3f} s -> {result['seconds']:9.3f} s  "
+              F"{ratio:5.2f}x")
+        if ratio > bench_args.max_slowdown:
+            slower.append(name)
+    return slower
+
+def main():
+    sizes  = {kind: getattr(bench_args, kind) if getattr(bench_args, kind) is not None
+              else count for kind, count in SIZES[bench_args.size].items()}
+    seed   = bench_args.seed * 10
+    seeds  = {str(seed): 'text', str(seed + 1): 'photo', str(seed + 2): 'gpx'}
+    mails  = (synthmail.text_mailbox(sizes['text'], seed) +
+              synthmail.photo_mailbox(sizes['photos'], seed + 1, real=True,
+                                      photo_bytes=bench_args.photo_bytes) +
+              synthmail.gpx_mailbox(sizes['gpx'], seed + 2, points=bench_args.gpx_points))
+    names  = bench_args.only or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(F"no such benchmark: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp, ImapStandIn(Mailbox(mails)) as server:
+        suite = Suite(tmp, server, seeds)
+        for name in names:
+            runs = [BENCHMARKS[name](suite) for _ in range(bench_args.repeat)]
+            seconds = [elapsed for elapsed, _ in runs]
+            best = runs[seconds.index(min(seconds))][1]
+            results[name] = dict(best, seconds=min(seconds),
+                                 median=statistics.median(seconds), runs=seconds)
+            print(F"{name:20} {min(seconds):9.3f} s  "
+                  + '  '.join(F"{key} {value}" for key, value in best.items()))
+
+    report = {'environment': environment(),
+              'parameters': dict(vars(bench_args), **sizes), 'results': results}
+    if bench_args.output:
+        with open(bench_args.output, 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, indent=2, sort_keys=True)
+    if bench_args.compare:
+        slower = compare(results, bench_args.compare)
+        if slower:
+            print(F"slower than {bench_args.max_slowdown}x the baseline: {', '.join(slower)}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
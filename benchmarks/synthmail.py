@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+'''Synthetic mails for the benchmarks'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import base64
+import datetime
+import io
+import math
+import random
+import time
+from email.utils import formatdate
+
+AUTHORS = ['Marcus Hardt <marcus@example.org>', 'Jane Doe <jane@example.org>',
+           'Jörg Müller <joerg@example.org>']
+WORDS   = ('lorem ipsum dolor sit amet consetetur sadipscing elitr sed diam nonumy eirmod '
+           'tempor invidunt ut labore et dolore magna aliquyam erat voluptua').split()
+
+def text_message(i, seed=0, paragraphs=3):
+    '''A plain markdown mail like the ones mail2blog turns into articles'''
+    rnd     = random.Random(seed * 1000003 + i)
+    author  = AUTHORS[i % len(AUTHORS)]
+    subject = ' '.join(rnd.choice(WORDS) for _ in range(4)).capitalize() + F" {i}"
+    epoch   = 1600000000 + i * 3600
+    body    = '\n\n'.join(' '.join(rnd.choice(WORDS) for _ in range(60))
+                          for _ in range(paragraphs))
+    return (F"From: {author}\n"
+            F"To: blog@example.org\n"
+            F"Subject: {subject}\n"
+            F"Date: {formatdate(epoch, localtime=False)}\n"
+            F"Message-ID: <bench-{seed}-{i}@mail2blog.example.org>\n"
+            F"Return-Path: <{author.split('<')[1]}\n"
+            F"MIME-Version: 1.0\n"
+            F"Content-Type: text/plain; charset=utf-8\n"
+            F"Content-Transfer-Encoding: 8bit\n"
+            F"\n"
+            F"# {subject}\n\n{body}\n\n-- \nsent by the benchmark at {time.ctime(epoch)}\n")
+
+def text_mailbox(count, seed=0):
+    return [text_message(i, seed) for i in range(count)]
+
+def jpeg(rnd, photo_bytes):
+    '''a real jpeg of noise, about photo_bytes large'''
+    from PIL import Image
+    side  = max(16, int(math.sqrt(photo_bytes / 1.2)))
+    image = Image.frombytes('RGB', (side, side), rnd.randbytes(side * side * 3))
+    out   = io.BytesIO()
+    image.save(out, 'JPEG', quality=85)
+    return out.getvalue()
+
+def multipart(text, attachments):
+    '''text_message() text with (content type, file name, data) attachments'''
+    header, body = text.split('\n\n', 1)
+    header   = header.replace('Content-Type: text/plain; charset=utf-8\n'
+                              'Content-Transfer-Encoding: 8bit',
+                              'Content-Type: multipart/mixed; boundary="bench-boundary"')
+    parts    = [F"--bench-boundary\nContent-Type: text/plain; charset=utf-8\n"
+                F"Content-Transfer-Encoding: 8bit\n\n{body}"]
+    for content_type, name, data in attachments:
+        data = base64.encodebytes(data).decode('ascii')
+        parts.append(F"--bench-boundary\nContent-Type: {content_type}; name=\"{name}\"\n"
+                     F"Content-Disposition: attachment; filename=\"{name}\"\n"
+                     F"Content-Transfer-Encoding: base64\n\n{data}")
+    return header + '\n\n' + '\n'.join(parts) + '--bench-boundary--\n'
+
+def photo_message(i, seed=0, photos=2, photo_bytes=200000, real=False):
+    '''A multipart mail with random "jpeg" attachments; real jpegs (of noise) with real=True,
+    for the benchmarks that build galleries'''
+    rnd      = random.Random(seed * 1000003 + i)
+    text     = text_message(i, seed)
+    return multipart(text, [('image/jpeg', F"photo {p}.jpg",
+                             jpeg(rnd, photo_bytes) if real else rnd.randbytes(photo_bytes))
+                            for p in range(photos)])
+
+def photo_mailbox(count, seed=0, **kwargs):
+    return [photo_message(i, seed, **kwargs) for i in range(count)]
+
+def gpx_track(points, seed=0):
+    '''GPX of a walk recorded at 1 Hz, with a segment per hour'''
+    rnd     = random.Random(seed)
+    start   = datetime.datetime(2021, 7, 1, 6, 0, 0)
+    lat, lon, heading = 61.0, 9.5, rnd.uniform(0, 2 * math.pi)
+    lines   = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<gpx version="1.1" creator="bench" xmlns="http://www.topografix.com/GPX/1/1">\n'
+               '  <trk><name>Walk</name>\n']
+    for i in range(points):
+        if i % 3600 == 0:
+            lines.append('    </trkseg>\n    <trkseg>\n' if i else '    <trkseg>\n')
+        heading += rnd.gauss(0, 0.05)
+        lat += math.cos(heading) * 1.3e-5 + rnd.gauss(0, 1e-5)
+        lon += math.sin(heading) * 2.6e-5 + rnd.gauss(0, 2e-5)
+        stamp = (start + datetime.timedelta(seconds=i)).isoformat() + 'Z'
+        lines.append(F'      <trkpt lat="{lat:.7f}" lon="{lon:.7f}">'
+                     F'<ele>{100 + i % 50}</ele><time>{stamp}</time></trkpt>\n')
+    lines.append('    </trkseg>\n  </trk>\n</gpx>\n')
+    return ''.join(lines)
+
+def gpx_message(i, seed=0, points=3600):
+    '''A mail with the track of the day. The attachment is text/xml: view.py looks for
+    .gpx files among the text parts'''
+    return multipart(text_message(i, seed),
+                     [('text/xml', F"track {i}.gpx", gpx_track(points, seed * 1000003 + i).encode())])
+
+def gpx_mailbox(count, seed=0, **kwargs):
+    return [gpx_message(i, seed, **kwargs) for i in range(count)]
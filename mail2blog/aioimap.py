@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+'''IMAP with asyncio: many commands in flight on one connection'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# imaplib waits for the answer to every command before it sends the next one, so each
+# command costs a full round trip to the server. AsyncImapConnector sends commands as soon
+# as they are issued and matches the answers by their tag (pipelining, RFC 3501 5.5): all
+# header batches of a listing, or the fetches of many bodies, share one round trip.
+#
+# With [imap] client = asyncio, render_articles downloads the bodies with an AsyncImapPool
+# instead of an ImapPool: one connection, at most [imap] pipeline_depth messages in flight,
+# and every article is rendered as soon as its message is there.
+# Bodies come in pieces of [imap] fetch_chunk_size bytes, which go to the raw cache file as
+# soon as they are there. All downloads of a connection share [imap] pipeline_bytes (default
+# 16 MiB): a piece is only requested while the pieces requested and not yet written fit in
+# there, so memory does not grow with the size or the number of messages in flight.
+# Errors are the ones of imaplib: IMAP4.error for NO and BAD, IMAP4.abort for a lost
+# connection.
+
+import asyncio
+import collections
+import concurrent.futures
+import email
+import logging
+import re
+import ssl
+import threading
+from imaplib import IMAP4
+
+from mail2blog.config import CONFIG
+from mail2blog.imapconnector import HEADER_FIELDS, FETCH_UID_RE, uid_sequence_set, message_id_of
+from mail2blog.imappool import ImapPool
+from mail2blog.rawcache import RawMessageCache
+
+logger = logging.getLogger(__name__)
+
+LITERAL_RE = re.compile(rb'\{(\d+)\}\r\n$')
+SIZE_RE    = re.compile(rb'RFC822\.SIZE (\d+)')
+EXISTS_RE  = re.compile(rb'^\* (\d+) EXISTS', re.I)
+CODE_RE    = re.compile(rb'\[(UIDVALIDITY|UIDNEXT) (\d+)\]', re.I)
+
+def quote(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+class AsyncImapConnector:
+    '''The methods of ImapConnector as coroutines, on one pipelined connection'''
+    def __init__(self):
+        self.connected   = False
+        self.folder      = None
+        self.exists      = None
+        self.uidvalidity = None
+        self.uidnext     = None
+        self.generation  = 0      # counts connects as they start, see AsyncImapPool.fetch
+        self.timeout     = CONFIG.getfloat('imap', 'timeout', fallback = 120)
+        self.chunk_size  = CONFIG.getint('imap', 'fetch_chunk_size', fallback = 2**20)
+        # pieces that may be requested and not yet written, see download_message
+        self.room        = asyncio.Semaphore(max(1, CONFIG.getint(
+                'imap', 'pipeline_bytes', fallback = 2**24) // self.chunk_size))
+        self._reader     = None
+        self._writer     = None
+        self._responses  = None
+        self._connecting = asyncio.Lock()
+        self._tag        = 0
+        self._pending    = {}     # tag => future of (status line, untagged responses)
+        self._untagged   = []
+
+    async def connect(self):
+        # commands connect when there is no connection: only the first of them does
+        async with self._connecting:
+            if not self.connected:
+                await self._connect()
+
+    async def _connect(self):
+        self.generation += 1
+        host = CONFIG.get('imap', 'host')
+        if CONFIG.getboolean('imap', 'ssl', fallback = True):
+            port, context = CONFIG.getint('imap', 'port', fallback = 993), ssl.create_default_context()
+        else:
+            port, context = CONFIG.getint('imap', 'port', fallback = 143), None
+        self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, ssl=context), self.timeout)
+        greeting = await self._reader.readline()
+        if not greeting.startswith(b'* OK'):
+            raise IMAP4.error(F"IMAP server said {greeting!r}")
+        self._responses = asyncio.create_task(self._read_responses())
+        self.connected  = True
+        self.folder     = CONFIG.get('imap', 'folder', fallback = 'INBOX')
+        # one round trip for all three
+        _, _, selected = await asyncio.gather(
+                self.command(F"LOGIN {quote(CONFIG.get('imap', 'user'))} "
+                             F"{quote(CONFIG.get('imap', 'pass'))}"),
+                self.command("ENABLE UTF8=ACCEPT", check=False),
+                self.command(F"EXAMINE {quote(self.folder)}"))
+        for head, _ in selected:
+            match = EXISTS_RE.match(head)
+            if match:
+                self.exists = int(match.group(1))
+            match = CODE_RE.search(head)
+            if match:
+                setattr(self, match.group(1).decode().lower(), int(match.group(2)))
+
+    async def disconnect(self):
+        try:
+            await self.command("LOGOUT", check=False)
+        except IMAP4.abort:
+            pass
+        self.drop()
+
+    def drop(self):
+        '''close the connection without the logout dialogue'''
+        self._fail(IMAP4.abort("connection closed"))
+
+    async def reset(self):
+        # not while a connection is being opened: that would be the one dropped
+        async with self._connecting:
+            self.drop()
+            await self._connect()
+
+    async def command(self, text, check=True):
+        '''send a command right away; return its untagged responses as (line, literals)
+        once it is completed'''
+        if not self.connected:
+            await self.connect()
+        self._tag += 1
+        tag = F"P{self._tag}".encode()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[tag] = future
+        self._writer.write(tag + b' ' + text.encode() + b'\r\n')
+        status, untagged = await asyncio.wait_for(future, self.timeout)
+        if check and not status.startswith(tag + b' OK'):
+            raise IMAP4.error(F"{text.split(' ')[0]} failed: {status.decode('utf-8', 'replace').strip()}")
+        return untagged
+
+    async def _read_response(self):
+        '''one response line, with the literals in it'''
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionResetError("connection closed by the server")
+        head, literals = [line], []
+        match = LITERAL_RE.search(line)
+        while match:
+            literals.append(await self._reader.readexactly(int(match.group(1))))
+            line = await self._reader.readline()
+            head.append(line)
+            match = LITERAL_RE.search(line)
+        return b''.join(head), literals
+
+    async def _read_responses(self):
+        '''hand every tagged response to its command, with the untagged ones since the
+        one before. The server answers pipelined commands in order'''
+        try:
+            while True:
+                head, literals = await self._read_response()
+                if head[:1] in (b'*', b'+'):
+                    self._untagged.append((head, literals))
+                    continue
+                future = self._pending.pop(head.split(b' ', 1)[0], None)
+                if future is not None and not future.done():
+                    future.set_result((head, self._untagged))
+                self._untagged = []
+        except (ConnectionError, asyncio.IncompleteReadError, OSError) as e:
+            self._fail(IMAP4.abort(F"IMAP connection lost: {e}"))
+
+    def _fail(self, exception):
+        self.connected = False
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exception)
+        self._pending = {}
+        self._untagged = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._responses is not None and self._responses is not asyncio.current_task():
+            self._responses.cancel()
+        self._responses = None
+
+    async def _fetch(self, uids, items):
+        '''[(uid, response line, literals)] of a UID FETCH'''
+        result = []
+        for head, literals in await self.command(F"UID FETCH {uids} {items}"):
+            match = FETCH_UID_RE.search(head)
+            if b' FETCH ' in head and match:
+                result.append((int(match.group(1)), head, literals))
+        return result
+
+    async def get_uid_list(self, min_uid=None):
+        if min_uid is None:
+            untagged = await self.command("UID SEARCH ALL")
+        else:
+            untagged = await self.command(F"UID SEARCH UID {min_uid}:*")
+        uids = [int(uid) for head, _ in untagged if head.startswith(b'* SEARCH')
+                for uid in head.split()[2:]]
+        if min_uid is not None:
+            uids = [uid for uid in uids if uid >= min_uid]
+        return uids
+
+    async def get_header_list(self, uids=None):
+        '''like ImapConnector.get_header_list, with all batches in flight at once'''
+        if uids is None:
+            uids = await self.get_uid_list()
+        uids       = sorted(uids)
+        batch_size = CONFIG.getint('imap', 'fetch_batch_size', fallback = 500)
+        items      = F"(UID BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+        batches    = await asyncio.gather(*[
+                self._fetch(uid_sequence_set(uids[start:start + batch_size]), items)
+                for start in range(0, len(uids), batch_size)])
+        headers = [(uid, email.message_from_string(literals[0].decode('iso-8859-1')))
+                   for batch in batches for uid, _, literals in batch if literals]
+        headers.sort(key=lambda h: h[0])
+        return headers
+
+    async def get_message_list(self):
+        return [msg for (uid, msg) in await self.get_header_list()]
+
+    async def find_uid(self, message_id):
+        untagged = await self.command(F'UID SEARCH HEADER "Message-ID" "<{message_id}>"')
+        for head, _ in untagged:
+            if head.startswith(b'* SEARCH') and head.split()[2:]:
+                return int(head.split()[2])
+        logger.error(F"Problem finding message in IMAP: {message_id}")
+        return None
+
+    async def fetch_raw_message(self, uid):
+        for fetched_uid, _, literals in await self._fetch(str(uid), "(BODY.PEEK[])"):
+            if fetched_uid == uid and literals:
+                return literals[0]
+        return None
+
+    async def get_raw_message(self, message_id, uid=None):
+        if uid is not None:
+            raw = await self.fetch_raw_message(uid)
+            if raw is not None and message_id_of(raw) == message_id:
+                return uid, raw
+            logger.info(F"UID {uid} no longer holds {message_id} => searching for it")
+        uid = await self.find_uid(message_id)
+        if uid is None:
+            raise KeyError(F"message not found in IMAP: {message_id}")
+        return uid, await self.fetch_raw_message(uid)
+
+    async def get_message(self, message_id):
+        uid, raw = await self.get_raw_message(message_id)
+        return email.message_from_string(raw.decode('iso-8859-1'))
+
+    async def _first_chunk(self, uid):
+        for fetched_uid, head, literals in await self._fetch(
+                str(uid), F"(RFC822.SIZE BODY.PEEK[]<0.{self.chunk_size}>)"):
+            if fetched_uid == uid:
+                size = SIZE_RE.search(head)
+                return (literals[0] if literals else b''), int(size.group(1)) if size else None
+        return None, None
+
+    async def _chunk(self, uid, offset):
+        fetched = await self._fetch(str(uid), F"(BODY.PEEK[]<{offset}.{self.chunk_size}>)")
+        return fetched[0][2][0] if fetched and fetched[0][2] else None
+
+    async def download_message(self, message_id, uid, fp):
+        '''like ImapConnector.download_message: write the raw message with the given
+        Message-ID to the binary file fp and return its uid. The first piece comes with the
+        size; the others are requested ahead as far as the room in [imap] pipeline_bytes
+        allows, and each is written and its room given back as soon as it is there'''
+        async with self.room:
+            chunk = None
+            if uid is not None:
+                chunk, size = await self._first_chunk(uid)
+                if chunk is None or message_id_of(chunk) != message_id:
+                    logger.info(F"UID {uid} no longer holds {message_id} => searching for it")
+                    chunk = None
+            if chunk is None:
+                uid = await self.find_uid(message_id)
+                if uid is None:
+                    raise KeyError(F"message not found in IMAP: {message_id}")
+                chunk, size = await self._first_chunk(uid)
+            fp.write(chunk)
+        offsets  = collections.deque(range(len(chunk), size or 0, self.chunk_size))
+        inflight = collections.deque()       # each holds room until it is written
+        try:
+            while offsets or inflight:
+                # wait for room only while none is held here, or the others could wait
+                # for this download and this one for them
+                if offsets and (not inflight or not self.room.locked()):
+                    await self.room.acquire()
+                    inflight.append(asyncio.ensure_future(self._chunk(uid, offsets.popleft())))
+                    continue
+                chunk = await inflight[0]
+                inflight.popleft()
+                self.room.release()
+                if chunk is None:
+                    raise IMAP4.error(F"could not fetch all of {message_id}")
+                fp.write(chunk)
+        finally:
+            for task in inflight:
+                if not task.cancel() and not task.cancelled():
+                    task.exception()        # failed with the connection: seen
+                self.room.release()
+        return uid
+
+class AsyncImapPool:
+    '''ImapPool with an AsyncImapConnector on an event loop in a thread of its own:
+    the bodies come over one connection, while the caller renders the ones before'''
+    def __init__(self):
+        self.depth   = max(1, CONFIG.getint('imap', 'pipeline_depth', fallback = 16))
+        self.retries = CONFIG.getint('imap', 'retries', fallback = 2)
+        self.cache   = RawMessageCache()
+        self.imap    = AsyncImapConnector()
+        self.lock    = asyncio.Lock()
+        self.completed = 0
+        # cache.store blocks in one of these while the loop writes the pieces to its file
+        self.writers = concurrent.futures.ThreadPoolExecutor(self.depth,
+                                                             thread_name_prefix='imap-cache')
+        self.loop    = asyncio.new_event_loop()
+        self.thread  = threading.Thread(target=self.loop.run_forever, name='imap-asyncio',
+                                        daemon=True)
+        self.thread.start()
+
+    async def fetch(self, message_id, uid=None):
+        '''download a message into the raw cache and return its uid, reconnecting on BYE'''
+        failures = 0
+        while True:
+            generation, completed = self.imap.generation, self.completed
+            try:
+                async with self.lock:
+                    if not self.imap.connected:
+                        await self.imap.connect()
+                def write(fp):
+                    return asyncio.run_coroutine_threadsafe(
+                            self.imap.download_message(message_id, uid, fp), self.loop).result()
+                uid, _ = await self.loop.run_in_executor(self.writers, self.cache.store,
+                                                         message_id, write)
+                self.completed += 1
+                return uid
+            except (IMAP4.abort, asyncio.TimeoutError, OSError) as e:
+                # all downloads in flight fail with the connection; only count it against
+                # this one if none got through since it was sent
+                if self.completed == completed:
+                    failures += 1
+                if failures > self.retries:
+                    raise
+                logger.warning(F"IMAP connection lost while fetching {message_id}: {e} "
+                               F"=> reconnecting")
+                async with self.lock:
+                    # the other downloads on this connection failed as well: reconnect once
+                    if self.imap.generation == generation:
+                        await self.imap.reset()
+
+    def fetch_bodies(self, entries, wanted=lambda entry: True):
+        '''like ImapPool.fetch_bodies: yield (entry, fetched) in the order of entries,
+        with at most [imap] pipeline_depth downloads in flight'''
+        pending = collections.deque()
+        for entry in entries:
+            future = None
+            if wanted(entry):
+                future = asyncio.run_coroutine_threadsafe(
+                        self.fetch(entry.message_id, entry.uid), self.loop)
+            pending.append((entry, future))
+            while len(pending) > self.depth or (pending and pending[0][1] is None):
+                yield ImapPool._result(*pending.popleft())   # pylint: disable=protected-access
+        while pending:
+            yield ImapPool._result(*pending.popleft())   # pylint: disable=protected-access
+
+    def close(self):
+        if self.imap.connected:
+            asyncio.run_coroutine_threadsafe(self.imap.disconnect(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.writers.shutdown()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+'''The index of the blog: a front page, numbered pages and per-year/month archives'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# All pages are in [locations] blog_output, next to the articles they link to:
+#   index.html            the newest [index] page_size entries, links to the archives
+#   page-<n>.html         page_size entries each, numbered from the oldest (page-1.html)
+#   archive-<yyyy>.html   links to the month archives of a year
+#   archive-<yyyy-mm>.html  the entries of a month
+# Numbering from the oldest keeps the pages stable: a new post only changes the last page,
+# index.html and the archive of its month; the year archive only changes when a month
+# begins, and no page grows beyond a month or page_size entries. Every page has a build_manifest
+# entry with the digest of what it shows, and only pages whose digest changed are rendered.
+
+import glob
+import json
+import logging
+import os
+
+from mail2blog import manifest
+from mail2blog import templating
+from mail2blog import tools
+from mail2blog.config import CONFIG
+from mail2blog.database import Blog
+from mail2blog.manifest import BuildManifest
+
+logger = logging.getLogger(__name__)
+
+PAGE_PATTERNS = ['page-*.html', 'archive-*.html']
+
+def page_file(number):
+    return F"page-{number}.html"
+
+def archive_file(period):
+    return F"archive-{period}.html"
+
+class IndexPages:
+    '''Plan the index pages of all entries in the database, and render the outdated ones'''
+    def __init__(self, blog=None, force=False):
+        self.blog       = blog if blog is not None else Blog()
+        self.force      = force
+        self.output     = CONFIG.get('locations', 'blog_output')
+        self.title      = CONFIG.get('main', 'title', fallback='Blog')
+        self.page_size  = max(1, CONFIG.getint('index', 'page_size', fallback = 50))
+        self.archives   = CONFIG.getboolean('index', 'archives', fallback = True)
+        self.manifest   = BuildManifest()
+
+    def plan(self):
+        '''{file name: (title, template context)} of all index pages'''
+        entries = list(self.blog.index_entries())      # newest first
+        total   = len(entries)
+        count   = (total + self.page_size - 1) // self.page_size
+        pages   = {}
+
+        # index.html: the newest entries; "older" leads to the page of the next one
+        older = None
+        if total > self.page_size:
+            older = page_file((total - 1 - self.page_size) // self.page_size + 1)
+        years = {}
+        for item in entries:
+            year, month = item['period'][:4], item['period']
+            years.setdefault(year, [])
+            if month not in years[year]:
+                years[year].append(month)
+        year_archives = {year: dict(name=year, link=archive_file(year),
+                                    months=[dict(name=month[5:], link=archive_file(month))
+                                            for month in reversed(months)])
+                         for year, months in years.items()}
+        archives = []
+        if self.archives:
+            archives = [year_archives[year] for year in sorted(years, reverse=True)]
+        pages['index.html'] = (self.title, dict(article_list=entries[:self.page_size],
+                previous=older, next=None, home=None, archives=archives,
+                pages=[dict(name=str(n), link=page_file(n)) for n in range(count, 0, -1)]))
+
+        # page n has the entries total - n * page_size ... total - (n - 1) * page_size - 1
+        # counted from the newest; the last page is the only one that isn't full
+        for number in range(1, count + 1):
+            first = max(0, total - number * self.page_size)
+            last  = total - (number - 1) * self.page_size
+            pages[page_file(number)] = (F"{self.title} - {number}", dict(
+                    article_list=entries[first:last],
+                    previous=page_file(number - 1) if number > 1 else None,
+                    next=page_file(number + 1) if number < count else 'index.html',
+                    home='index.html', archives=[], pages=[]))
+
+        if self.archives:
+            for year in years:
+                pages[archive_file(year)] = (F"{self.title} - {year}", dict(
+                        article_list=[], previous=None, next=None, home='index.html',
+                        archives=[year_archives[year]], pages=[]))
+            periods = {}
+            for item in entries:
+                periods.setdefault(item['period'], []).append(item)
+            for period, items in periods.items():
+                pages[archive_file(period)] = (F"{self.title} - {period}", dict(
+                        article_list=items, previous=None, next=None, home='index.html',
+                        archives=[], pages=[]))
+        return pages
+
+    def _digest(self, title, context):
+        return manifest.digest(json.dumps(context, sort_keys=True), title,
+                manifest.file_digest(CONFIG.get('templates', 'index_new', fallback=None)),
+                manifest.theme_digest())
+
+    def write(self, pandoc):
+        '''submit the outdated pages to pandoc; return their file names'''
+        tools.makepath(self.output)
+        pages   = self.plan()
+        written = []
+        template = None
+        for name, (title, context) in pages.items():
+            output_file = os.path.join(self.output, name)
+            page_digest = self._digest(title, context)
+            if not self.force and self.manifest.is_current(output_file, page_digest, adopt=False):
+                continue
+            if template is None:
+                template = templating.get_template('index_new')
+            markdown = template.render(**context)
+            pandoc.submit(markdown, output_file, title=title,
+                    done = lambda output_file=output_file, page_digest=page_digest:
+                        self.manifest.record(output_file, page_digest))
+            written.append(name)
+        self._prune(pages)
+        logger.info(F"index: {len(written)} of {len(pages)} pages outdated")
+        return written
+
+    def _prune(self, pages):
+        '''remove pages that are no longer needed, e.g. the archive of a month whose posts
+        were all deleted'''
+        for pattern in PAGE_PATTERNS:
+            for output_file in glob.glob(os.path.join(glob.escape(self.output), pattern)):
+                if os.path.basename(output_file) not in pages:
+                    logger.info(F"removing {output_file}")
+                    os.remove(output_file)
+                    self.manifest.forget(output_file)
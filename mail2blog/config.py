@@ -8,14 +8,14 @@ import sys
 from pathlib import Path
 from configparser import ConfigParser
 from configparser import ExtendedInterpolation
-from .parse_args import args
 
 logger = logging.getLogger(__name__)
 
 CONFIG = ConfigParser(interpolation=ExtendedInterpolation())
 CONFIG.optionxform = lambda option: option
 
-def set_defaults():
+def set_defaults(args):
+    '''the [main] options that come from the command line'''
     if args.logfile is not None:
         CONFIG.read_dict ({'main': {
             'basename'    :  args.basename,
@@ -35,7 +35,7 @@ def set_defaults():
             'debug'       :  args.debug,
             }})
 
-def load_config():
+def load_config(args):
     """Reload configuration from disk.
 
     Config locations, by priority (first one wins)
@@ -90,7 +90,6 @@ def test_config():
         logging.error(F"Cannot find required config entry: {e}")
         sys.exit(3)
 
-set_defaults()
-load_config()
+# set_defaults() and load_config() are called by context.start(), not on import
 # test_config()
 
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+'''The application context of one run: command line arguments and IMAP connection'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# Importing a mail2blog module has no side effects: it neither parses sys.argv, nor reads
+# config files, nor sets up logging, nor creates an IMAP connection. The entry points (view.main,
+# controller.parse_mail, lmtpd.main) call start() for all that. Library code, e.g. the
+# benchmarks, fills CONFIG itself and gets the default arguments from current().
+# Heavy dependencies (pypandoc, jinja2, numpy, PIL) are imported by the functions that use
+# them, so --list-messages or the ingest of a mail don't load what only rendering needs.
+
+import logging
+
+from mail2blog import parse_args
+
+logger = logging.getLogger(__name__)
+
+_current = None
+
+class AppContext:
+    '''What a run works with besides CONFIG: the arguments, and the IMAP connection that is
+    created when it is first used'''
+    def __init__(self, args=None):
+        self.args  = args if args is not None else parse_args.defaults()
+        self._imap = None
+
+    @property
+    def imap(self):
+        if self._imap is None:
+            from mail2blog.imapconnector import ImapConnector
+            self._imap = ImapConnector()
+        return self._imap
+
+    def close(self):
+        if self._imap is not None and self._imap.connected:
+            self._imap.disconnect()
+
+def activate(context):
+    '''make context the one of this process, and return it'''
+    global _current
+    _current = context
+    return context
+
+def current():
+    '''the context of this process; without start() one with the default arguments'''
+    if _current is None:
+        activate(AppContext())
+    return _current
+
+def start(argv=None):
+    '''what every entry point does first: parse the command line (sys.argv if argv is None),
+    read the config file and set up logging'''
+    from mail2blog import config, logsetup
+    args = parse_args.parseOptions(argv)
+    config.set_defaults(args)
+    config.load_config(args)
+    logsetup.setup_logging(args)
+    return activate(AppContext(args))
@@ -15,14 +15,16 @@ import logging
 import sys
 from sys import stdin
 import os
+import shutil
 import mimetypes
 import email
 from email.iterators import _structure
 
-from mail2blog import logsetup
+from mail2blog import context
 from mail2blog import tools 
+from mail2blog import mimestream
+from mail2blog import rawcache
 from mail2blog.config import CONFIG
-from mail2blog.parse_args import args
 from mail2blog.database import Blog_entry
 
 logger = logging.getLogger(__name__)
@@ -41,10 +43,37 @@ def main():
     print('Sender name: {}'.format(msg['from']))
 
 
-def parse_mail():
-    '''Decompose email and store in database and raw_folder'''
-    raw = stdin.read()
-    msg = email.message_from_string(raw)
+def read_header(fp):
+    '''read the header lines of a message from a binary file, up to the empty line'''
+    lines = []
+    while True:
+        line = fp.readline(mimestream.buffer_size())
+        lines.append(line)
+        if line in (b'', b'\n', b'\r\n'):
+            return b''.join(lines)
+
+def message_directory(message_id):
+    '''where the raw.mail of a message goes'''
+    return rawcache.message_directory(message_id.replace('<','').replace('>',''))
+
+def entry_from_header(msg):
+    '''the blog entry of a message, from its parsed header'''
+    return Blog_entry(msg['message-id'].replace('<', '').replace('>',''), msg['from'], msg['subject'])
+
+def write_raw(directory, header, fp):
+    '''write header and the rest of the binary file fp to directory/raw.mail'''
+    tools.makepath(directory)
+    with open(os.path.join(directory, 'raw.mail'), 'wb') as out:
+        out.write(header)
+        shutil.copyfileobj(fp, out, mimestream.buffer_size())
+
+def store_message(fp):
+    '''Store the message in the binary file fp in database and raw_folder
+
+    Only the header is parsed here; the body is copied to raw.mail in pieces of
+    [mime] buffer_size bytes, whatever the size of its attachments.'''
+    header = read_header(fp)
+    msg = email.message_from_bytes(header)
     FIELDS = ['from', 'to', 'subject', 'date', 'Message-ID', 'Return-Path', 'Content-Type']
     dec_msg = {}
     for field in FIELDS:
@@ -58,21 +87,23 @@ def parse_mail():
     print(F'Message-ID   {dec_msg["Message-ID"]}')
     print(F'Return-Path: {dec_msg["Return-Path"]}')
 
-    blog_entry = Blog_entry(msg['message-id'].replace('<', '').replace('>',''), msg['from'], msg['subject'])
+    blog_entry = entry_from_header(msg)
     blog_entry.store_in_db()
     # print(F"\nbody:{msg.get_body('plain', 'html', 'related')}")
     # print(F'Content-Type: {dec_msg["Content-Type"]}')
 
     # print(_structure(msg))
 
-    directory = CONFIG.get('locations', 'raw_output', fallback='/tmp/mail2blog') 
-    directory += "/" + msg["Message-ID"].replace('<','').replace('>','')
+    directory = message_directory(msg["Message-ID"])
 
     logger.info(F"Storing incoming messge >>{dec_msg['subject']}<< of {dec_msg['from']} to {directory}")
-    tools.makepath(directory)
+    write_raw(directory, header, fp)
+    return blog_entry
 
-    with open(os.path.join(directory, 'raw.mail'), 'w') as fp:
-        fp.write(raw)
+def parse_mail():
+    '''Decompose email from stdin and store in database and raw_folder'''
+    context.start()
+    store_message(stdin.buffer)
 
 if __name__ == '__main__':
     # sys.exit(main())
@@ -10,71 +10,180 @@
 # pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
 # pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
 
+import json
 import logging
+import os
 import sqlite3
 import time
 import email
 import re
 
 from email.iterators import _structure
-from imaplib import IMAP4_SSL
 from datetime import datetime
-from jinja2 import Template
 
-from mail2blog import logsetup
-from mail2blog.imapconnector import ImapConnector
+from mail2blog import context
+from mail2blog import db
+from mail2blog.rawcache import RawMessageCache, message_directory
 from mail2blog import tools
+from mail2blog import manifest
+from mail2blog import search
+from mail2blog import templating
+from mail2blog import timing
 from mail2blog.config import CONFIG
 # from mail2blog.parse_args import args
 
 logger = logging.getLogger(__name__)
-imap = ImapConnector()
 
-def dict_factory(cursor, row):
-    '''helper for json export from sqlite'''
-    d = {}
-    for idx, col in enumerate(cursor.description):
-        d[col[0]] = row[idx]
-    return d
+dict_factory = db.dict_factory
+
+def init_sql_tables():
+    '''helper to initialise sql db: the tables are created when the connection is opened'''
+    db.connection()
+
+class ImapSync:
+    '''Mirror the headers of the IMAP folder in the database
+
+    Only UIDs above the stored watermark are fetched. If the server reports a different
+    UIDVALIDITY, the mirror is thrown away and rebuilt from scratch.'''
+    def __init__(self, connector=None):
+        self.imap = connector if connector is not None else context.current().imap
+
+    def sync(self):
+        '''bring imap_messages up to date and return its rows, ordered by UID'''
+        init_sql_tables()
+        if not self.imap.connected:
+            self.imap.connect()
+        try:
+            with db.transaction(dict_factory) as cur:
+                self._sync(cur)
+                cur.execute('''select * from imap_messages order by uid''')
+                rows = cur.fetchall()
+        except sqlite3.OperationalError as e:
+            logger.error("SQL sync error: " + str(e))
+            raise
+        return rows
+
+    def _sync(self, cur):
+        '''fetch what is new on the server into imap_messages, within one transaction'''
+        cur.execute('''select uidvalidity, highest_uid from imap_sync where folder=?''',
+                (self.imap.folder,))
+        state = cur.fetchone()
+        highest_uid = 0
+        if state is None or state['uidvalidity'] != self.imap.uidvalidity:
+            logger.info(F"UIDVALIDITY of {self.imap.folder} is now {self.imap.uidvalidity} "
+                        F"=> full resync")
+            cur.execute('''delete from imap_messages''')
+        else:
+            highest_uid = state['highest_uid']
+
+        # UIDNEXT tells us without a round trip whether anything arrived
+        if self.imap.uidnext is None or self.imap.uidnext - 1 > highest_uid:
+            new_uids = self.imap.get_uid_list(min_uid=highest_uid + 1)
+            logger.info(F"fetching headers of {len(new_uids)} new messages")
+            rows = []
+            with timing.stage('header_listing'):
+                for uid, msg in self.imap.get_header_list(new_uids):
+                    # only what goes into imap_messages
+                    dec_msg = tools.decode_message(msg, ('from', 'to', 'subject'))
+                    rows.append((uid, dec_msg['message-id'], str(dec_msg['from']),
+                            str(dec_msg['to']), str(dec_msg['subject']),
+                            tools.dateparser(msg['date'])))
+            cur.executemany('''insert or replace into imap_messages values(?, ?, ?, ?, ?, ?)''',
+                    rows)
+            highest_uid = max([highest_uid] + new_uids)
+
+        # Fewer messages on the server than in the mirror => some were expunged
+        cur.execute('''select count(*) as count from imap_messages''')
+        if self.imap.exists is not None and cur.fetchone()['count'] != self.imap.exists:
+            uids = set(self.imap.get_uid_list())
+            cur.execute('''select uid from imap_messages''')
+            gone = [(row['uid'],) for row in cur.fetchall() if row['uid'] not in uids]
+            logger.info(F"removing {len(gone)} expunged messages")
+            cur.executemany('''delete from imap_messages where uid=?''', gone)
+
+        cur.execute('''insert or replace into imap_sync values(?, ?, ?)''',
+                (self.imap.folder, self.imap.uidvalidity, highest_uid))
+
+    @staticmethod
+    def lookup_uid(message_id):
+        '''UID of a message as recorded by the last sync, or None'''
+        rows = db.query('''select uid from imap_messages where message_id=?''', (message_id,))
+        return rows[0][0] if rows else None
+
+def store_entries(entries):
+    '''insert blog entries in a single transaction; return the number of new ones.
+    Entries whose message_id is already in the db are left alone.'''
+    try:
+        with db.transaction() as cur:
+            # rowcount, unlike total_changes, leaves out the rows of triggers (see db.py)
+            cur.executemany('''insert or ignore into mail2blog '''
+                    '''(date, message_id, email_from, subject, source, uid, author, link) '''
+                    '''values(?, ?, ?, ?, ?, ?, ?, ?)''',
+                    [entry.db_row() for entry in entries])
+            return max(cur.rowcount, 0)
+    except sqlite3.OperationalError as e:
+        logger.error("SQL insert error: " + str(e))
+        raise
 
 class Blog_entry:
-    '''Store single blog entries in th database'''
-    db_was_initialised = False
+    '''Store single blog entries in th database
+
+    Only what comes from the database or the mail header is kept. The decoded subject,
+    author, date and slug are made when they are first used, and then kept.'''
+    __slots__ = ('message_id', 'uid', 'email_from', 'raw_subject', 'source', 'render_state',
+                 'epoch', 'db_was_initialised', '_subject', '_author', '_author_email',
+                 '_date', '_slug')
 
-    def __init__(self, message_id=None, email_from=None, subject=None, epoch=None, source="db"):
+    def __init__(self, message_id=None, email_from=None, subject=None, epoch=None, source="db",
+                 uid=None, render_state='new'):
         # logger.debug("INIT bog_entry")
         self.message_id = message_id
+        self.uid        = uid
         self.email_from = email_from
-        # self.subject    = subject
-        self.subject    = tools.email_decode(subject)
+        self.raw_subject = subject
         self.source     = source
+        self.render_state = render_state
+        self.db_was_initialised = False
 
         self.epoch      = epoch
         if epoch is None:
             self.epoch  = int(time.time())
 
-        tmp = time.gmtime(self.epoch)
-        self.date = time.strftime('%a %d.%m. %y', tmp)
-        self.author = str(email_from).split('<')[0]
-        self.author_email = str(email_from).split('<')[1].replace('>','')
-        
+        self._subject = self._author = self._author_email = self._date = self._slug = None
+
+    @property
+    def subject(self):
+        if self._subject is None:
+            self._subject = tools.email_decode(self.raw_subject)
+        return self._subject
+
+    @property
+    def date(self):
+        if self._date is None:
+            self._date = tools.format_date(self.epoch)
+        return self._date
+
+    @property
+    def author(self):
+        if self._author is None:
+            self._split_from()
+        return self._author
+
+    @property
+    def author_email(self):
+        if self._author_email is None:
+            self._split_from()
+        return self._author_email
+
+    def _split_from(self):
+        '''"Jane Doe <jane@example.org>" => "Jane Doe ", "jane@example.org"'''
+        author, _, address = str(self.email_from).partition('<')
+        self._author, self._author_email = author, address.replace('>','')
+
     # def initSqlTables(self, database):
     def initSqlTables(self):
         '''helper to initialise sql db'''
-        # Setup SQL tables
-        conn = sqlite3.connect(CONFIG.get('locations', 'database', fallback = None))
-        cur = conn.cursor()
-        try:
-            cur.execute('''create table if not exists mail2blog '''
-                '''(date REAL, message_id TEXT NOT NULL UNIQUE, email_from TEXT, subject TEXT)''')
-            cur.execute('''create index if not exists name_index ON mail2blog(message_id)''')
-            cur.execute('''create index if not exists date_index ON mail2blog(date)''')
-            conn.commit()
-            conn.close()
-
-        except sqlite3.OperationalError as e:
-            logger.error("SQL Create error: " + str(e))
-            raise
+        init_sql_tables()
         self.db_was_initialised = True
         
     def get_message_id(self):
@@ -88,16 +197,63 @@ class Blog_entry:
             msg = self.get_message_from_imap()
         return msg
 
+    def get_message_digest(self):
+        '''identify the raw message without downloading or reading it'''
+        if self.source == "imap":
+            # IMAP messages never change under the same UID
+            return manifest.digest(self.source, self.message_id, self.uid)
+        try:
+            stat = os.stat(os.path.join(message_directory(self.message_id), 'raw.mail'))
+            return manifest.digest(self.source, self.message_id, stat.st_size, stat.st_mtime_ns)
+        except (OSError, ValueError):
+            return manifest.digest(self.source, self.message_id)
+
     def get_message_from_db(self):
-        directory = CONFIG.get('locations', 'raw_output', fallback='/tmp/mail2blog') 
-        directory += "/" + self.message_id
-        msg_file = open(directory + "/raw.mail", 'r')
-        msg = email.message_from_file(msg_file)
+        with open(self.get_message_path(), 'rb') as msg_file:
+            msg = email.message_from_binary_file(msg_file)
         # msg = self._decode_message(msg)
         return msg
 
+    def has_cached_message(self):
+        try:
+            return os.path.exists(RawMessageCache().path(self.message_id))
+        except ValueError:
+            return False
+
+    def get_message_path(self):
+        '''path of the raw message on disk. IMAP messages are downloaded to the cache first'''
+        if self.source != "imap":
+            return os.path.join(message_directory(self.message_id), 'raw.mail')
+        rawcache = RawMessageCache()
+        path = rawcache.touch(self.message_id)
+        if path is None:
+            path = self.download_message(rawcache)
+        return path
+
+    def download_message(self, rawcache=None):
+        if not self.db_was_initialised:
+            self.initSqlTables()
+        if rawcache is None:
+            rawcache = RawMessageCache()
+        if self.uid is None:
+            self.uid = ImapSync.lookup_uid(self.message_id)
+        self.uid, path = rawcache.store(self.message_id,
+                lambda fp: context.current().imap.download_message(self.message_id, self.uid, fp))
+        return path
+
+    def open_message(self):
+        '''open the raw message for reading as a binary file'''
+        try:
+            return open(self.get_message_path(), 'rb')
+        except FileNotFoundError:
+            if self.source != "imap":
+                raise
+            # evicted from the cache by a download running in parallel
+            return open(self.download_message(), 'rb')
+
     def get_message_from_imap(self):
-        msg = imap.get_message(self.message_id)
+        with self.open_message() as msg_file:
+            msg = email.message_from_binary_file(msg_file)
         # msg = self._decode_message(msg)
         return msg
 
@@ -112,42 +268,43 @@ class Blog_entry:
     def get_subject(self, replace_spaces=False):
         if not replace_spaces:
             return self.subject
-        s = re.sub(r"[^\w\s]", '', str(self.subject))
-        s = re.sub(r"[\s+/-]", '_', s)
-        return s
+        if self._slug is None:
+            s = re.sub(r"[^\w\s]", '', str(self.subject))
+            self._slug = re.sub(r"[\s+/-]", '_', s)
+        return self._slug
 
     def store_in_db(self):
         '''store entry in db'''
-        if not self.db_was_initialised:
-            self.initSqlTables()
-        conn = sqlite3.connect(CONFIG.get('locations', 'database', fallback = None))
-        cur  = conn.cursor()
-        try:
-            cur.execute('''insert into mail2blog values(%f, '%s', '%s', '%s')''' %
-                    (self.epoch, self.message_id, self.email_from, self.subject))
-            conn.commit()
-            conn.close()
-            logging.info('Stored entry in db: %s' % str(self))
-
-        except sqlite3.OperationalError as e:
-            logger.error("SQL Create error: " + str(e))
-            logger.error("'''insert into mail2blog values(%f, '%s', %s, '%s')'''" %
-                    (self.epoch, self.message_id, self.email_from, self.subject))
-            raise
-        except sqlite3.IntegrityError:
+        if store_entries([self]):
+            logger.info(F"Stored entry in db: {self.message_id} {self.subject}")
+        else:
             logger.warning(F"we seem to have a dupe: {self.message_id}")
+
+    def db_row(self):
+        return (self.epoch, self.message_id, str(self.email_from), str(self.subject),
+                self.source, self.uid, self.author, self.get_link())
+
+    def set_render_state(self, render_state, attachments=None):
+        '''remember the outcome of rendering, and what the article has attached (a dict of
+        counts by kind). attachments=None keeps what is known'''
+        self.render_state = render_state
+        with db.transaction() as cur:
+            cur.execute('''update mail2blog set render_state=?, '''
+                    '''attachments=coalesce(?, attachments) where message_id=?''',
+                    (render_state, json.dumps(attachments, sort_keys=True)
+                                   if attachments is not None else None, self.message_id))
+
     @classmethod
     def from_json(cls, json):
         '''create new entry from json'''
-        return (cls(json['message_id'], json['email_from'], json['subject'], json['date']))
+        return (cls(json['message_id'], json['email_from'], json['subject'], json['date'],
+                    source=json.get('source') or 'db', uid=json.get('uid'),
+                    render_state=json.get('render_state') or 'new'))
 
     def __str__(self):
         '''this is so wrong!!! Don't use the index template for each individual entry of the index!
         Rather return the entry and render the index from above!'''
-        template_file = CONFIG.get('templates', 'index')
-        with open(template_file, 'r') as fh:
-            template_data = fh.read()
-        template = Template(template_data)
+        template = templating.get_template('index')
         subject_no_spaces = self.get_subject(replace_spaces=True)
         retval = template.render(date = self.date, 
                                 subject = self.subject,
@@ -155,38 +312,68 @@ class Blog_entry:
                                 author_first = self.author.split(' ')[0],
                                 author_last  = self.author.split(' ')[1],
                                 author_email = self.author_email, 
-                                link = F"{subject_no_spaces}-{self.message_id}.html")
+                                link = self.get_link())
         logger.debug(F"subject_no_spaces: {subject_no_spaces}")
         return retval
-    def __dict__(self):
+    def to_dict(self):
+        '''data for the index template. (This used to be __dict__, which broke pickling)'''
         retval={}
         retval['author'] = self.author
         retval['subject'] = self.subject.__str__()
         retval['date'] = self.date.__str__()
-        subject_no_spaces = self.get_subject(replace_spaces=True)
-        retval['link'] = F"{subject_no_spaces}-{self.message_id}.html"
+        retval['link'] = self.get_link()
         return retval
 
+    def get_link(self):
+        '''file name of the article, relative to the index'''
+        return F"{self.get_subject(replace_spaces=True)}-{self.message_id}.html"
+
 class Blog:
     '''Class to have all blog entries'''
     def __init__(self):
         self.entries = []
         # self.read_entries_from_db()
     def generate_index_new(self):
-        '''render the index'''
+        '''render the index of all entries in the database, newest first'''
+        template = templating.get_template('index_new')
+        markdown_data = template.render(article_list=self.index_entries())
 
-        # collect data
-        blog_entry_data = []
-        for entry in self.entries:
-            blog_entry_data.append(entry.__dict__())
+        return(markdown_data)
 
-        template_file     = CONFIG.get('templates', 'index_new')
-        with open(template_file, 'r') as fh:
-            template_data = fh.read()
-        template = Template(template_data)
-        markdown_data = template.render(article_list=blog_entry_data)
+    @staticmethod
+    def index_page(before=None, limit=None):
+        '''up to limit ([database] batch_size) index rows, newest first, that come after
+        the (date, message_id) before. Keyset pagination: every page is an index range scan,
+        however far back it is'''
+        if limit is None:
+            limit = CONFIG.getint('database', 'batch_size', fallback = 1000)
+        columns = '''date, message_id, email_from, subject, author, link, attachments'''
+        if before is None:
+            return db.query(F'''select {columns} from mail2blog '''
+                    '''order by date desc, message_id desc limit ?''', (limit,),
+                    row_factory=sqlite3.Row)
+        return db.query(F'''select {columns} from mail2blog where (date, message_id) < (?, ?) '''
+                '''order by date desc, message_id desc limit ?''', (*before, limit),
+                row_factory=sqlite3.Row)
 
-        return(markdown_data)
+    def index_entries(self):
+        '''data for the index template of all entries in the database, read page by page'''
+        before = None
+        while True:
+            rows = self.index_page(before)
+            if not rows:
+                return
+            for date, message_id, email_from, subject, author, link, attachments in rows:
+                if link is None:
+                    # stored before the index columns existed
+                    entry = Blog_entry(message_id, email_from, subject, date)
+                    author, link = entry.author, entry.get_link()
+                stamp = time.gmtime(date)
+                yield {'author': author, 'subject': subject,
+                       'date': time.strftime('%a %d.%m. %y', stamp),
+                       'period': time.strftime('%Y-%m', stamp), 'link': link,
+                       'attachments': json.loads(attachments) if attachments else {}}
+            before = (rows[-1]['date'], rows[-1]['message_id'])
 
     def generate_index(self):
         '''render the index'''
@@ -195,40 +382,61 @@ class Blog:
             rendered_blog_entries.append(entry.__str__())
         return "\n".join(rendered_blog_entries)
 
-    def read_entries_from_db(self):
-        '''read entries from database'''
-        conn = sqlite3.connect(CONFIG.get('locations', 'database', fallback = None))
-        conn.row_factory = dict_factory
-        cur = conn.cursor()
+    def read_entries_from_db(self, newest_first=False, render_state=None):
+        '''read entries from database, optionally only those in the given render_state'''
+        order = 'desc' if newest_first else 'asc'
+        where = 'where render_state=?' if render_state is not None else ''
         try:
-            cur.execute('''select * from mail2blog order by date''')
-            allentries = cur.fetchall()
-            for entry in allentries:
-                self.entries.append(Blog_entry.from_json(entry))
-            # logging.info('Just read %d users' % len(allentries))
+            allentries = db.query(F'''select * from mail2blog {where} order by date {order}, '''
+                                  F'''message_id {order}''',
+                                  (render_state,) if render_state is not None else (),
+                                  row_factory=dict_factory)
         except sqlite3.OperationalError as e:
             logging.error('SQL read error: %s' % str(e))
-        except Exception as e:
-            logging.error('Error: %s' % str(e))
-            raise
-        conn.close()
+            return
+        for entry in allentries:
+            self.entries.append(Blog_entry.from_json(entry))
+
 
+    @staticmethod
+    def update_from_imap():
+        '''bring the mail2blog table up to date with the IMAP folder: only the headers of new
+        messages are downloaded (see ImapSync). Return the imap_messages rows'''
+        msg_list = ImapSync().sync()
+        known = {row[0] for row in db.query('''select message_id from mail2blog''')}
+        new_entries = [Blog_entry(message_id = row['message_id'],
+                                  email_from = row['email_from'],
+                                  subject = row['subject'],
+                                  epoch=row['date'],
+                                  source="imap",
+                                  uid=row['uid'])
+                       for row in msg_list if row['message_id'] not in known]
+        added = store_entries(new_entries)
+        with db.transaction() as cur:
+            # UIDs change with UIDVALIDITY, and expunged messages leave the blog
+            cur.execute('''update mail2blog set uid=(select uid from imap_messages '''
+                    '''where imap_messages.message_id=mail2blog.message_id) where source='imap' ''')
+            cur.execute('''delete from mail2blog where source='imap' and uid is null''')
+            removed = cur.rowcount
+        if removed:
+            search.prune()
+        logger.info(F"{added} new and {removed} removed blog entries from IMAP")
+        return msg_list
 
     def read_entries_from_imap(self, index=None, list_messages=False):
-        '''read entries from database'''
-        msg_list = imap.get_message_list()
+        '''read entries from imap, via the header mirror in the database'''
+        msg_list = self.update_from_imap()
         if index is not None:
             msg_list = [msg_list[index]]
 
         for i in range(len(msg_list)-1, -1, -1):
-            msg = msg_list[i]
-            dec_msg = tools.decode_message(msg)
+            row = msg_list[i]
             if list_messages:
-                print(F"{i:2}| {dec_msg['message-id'][0:30]:30} | {str(dec_msg['from']):34} | {str(dec_msg['to']):23} |  {dec_msg['subject']}")
-
-            epoch = tools.dateparser(msg['date'])
-            self.entries.append(Blog_entry(message_id = dec_msg['message-id'],
-                                           email_from = dec_msg['from'], 
-                                           subject = dec_msg['subject'],
-                                           epoch=epoch,
-                                           source="imap"))
+                print(F"{i:2}| {row['message_id'][0:30]:30} | {row['email_from']:34} | {row['email_to']:23} |  {row['subject']}")
+
+            self.entries.append(Blog_entry(message_id = row['message_id'],
+                                           email_from = row['email_from'], 
+                                           subject = row['subject'],
+                                           epoch=row['date'],
+                                           source="imap",
+                                           uid=row['uid']))
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+'''One SQLite connection per process, in WAL mode, shared by everything that uses the db'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# The connection is opened on first use and the tables are created at that point, so callers
+# don't have to initialise anything. It is reopened after a fork (the pid changed) or when
+# [locations] database points somewhere else. Threads of a process (imap pool, gallery
+# workers) share it; every transaction() holds a lock for its duration.
+#
+# With journal_mode=WAL readers don't block the writer and vice versa, so the MTA can deliver
+# a mail while a render is running. synchronous=NORMAL only syncs at checkpoints, which is
+# safe in WAL mode; a power cut may lose the last transactions, but never corrupts the db.
+
+import atexit
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+
+from mail2blog.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    '''create table if not exists mail2blog '''
+        '''(date REAL, message_id TEXT NOT NULL UNIQUE, email_from TEXT, subject TEXT)''',
+    '''create index if not exists name_index ON mail2blog(message_id)''',
+    '''create index if not exists date_index ON mail2blog(date)''',
+    # State of the incremental IMAP sync (see ImapSync)
+    '''create table if not exists imap_sync '''
+        '''(folder TEXT PRIMARY KEY, uidvalidity INTEGER, highest_uid INTEGER)''',
+    '''create table if not exists imap_messages '''
+        '''(uid INTEGER PRIMARY KEY, message_id TEXT, email_from TEXT, email_to TEXT, '''
+        '''subject TEXT, date REAL)''',
+    '''create index if not exists imap_message_id_index ON imap_messages(message_id)''',
+    # Digests of the inputs of every generated file (see BuildManifest)
+    '''create table if not exists build_manifest '''
+        '''(output TEXT PRIMARY KEY, digest TEXT, built REAL)''',
+    # LRU bookkeeping of the raw messages downloaded from IMAP (see RawMessageCache)
+    '''create table if not exists raw_cache '''
+        '''(message_id TEXT PRIMARY KEY, uid INTEGER, size INTEGER, last_used REAL)''',
+]
+
+# Columns added to mail2blog since its first version, added to older databases on open
+MAIL2BLOG_COLUMNS = [
+    ('source',       "TEXT DEFAULT 'db'"),   # 'db' (delivered by the MTA) or 'imap'
+    ('uid',          'INTEGER'),             # IMAP UID, as of the last sync
+    ('author',       'TEXT'),
+    ('link',         'TEXT'),                # file name of the article
+    ('render_state', "TEXT DEFAULT 'new'"),  # 'new', 'rendered' or 'failed'
+    ('attachments',  'TEXT'),                # json: number of attachments by kind
+]
+
+# Full-text search of the articles (see search.py). FTS5 is optional in sqlite, so search
+# is switched off if these can't be created
+SEARCH_SCHEMA = [
+    '''create virtual table if not exists article_text using fts5'''
+        '''(message_id UNINDEXED, subject, body, tokenize='unicode61 remove_diacritics 2')''',
+    '''create virtual table if not exists article_vocab using fts5vocab(article_text, instance)''',
+    # the doc number of an article: its rowid in article_text and its number in the static
+    # index, given when the entry is stored. Unlike the implicit rowid of mail2blog, an
+    # INTEGER PRIMARY KEY survives VACUUM
+    '''create table if not exists article_doc '''
+        '''(doc INTEGER PRIMARY KEY, message_id TEXT NOT NULL UNIQUE)''',
+    # articles indexed before article_doc existed have the rowid they had in mail2blog
+    '''insert or ignore into article_doc(doc, message_id) select rowid, message_id '''
+        '''from mail2blog where not exists (select * from article_doc)''',
+    '''create trigger if not exists article_doc_insert after insert on mail2blog begin '''
+        '''insert or ignore into article_doc(message_id) values(new.message_id); end''',
+    # changes with every change of article_text, for rebuilding the static search index
+    '''create table if not exists search_state (generation INTEGER)''',
+    '''insert into search_state select 0 where not exists (select * from search_state)''',
+]
+
+_lock  = threading.RLock()
+_state = {'pid': None, 'path': None, 'conn': None}
+
+def dict_factory(cursor, row):
+    '''helper for json export from sqlite'''
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+def _open(path):
+    conn = sqlite3.connect(path, timeout=CONFIG.getfloat('database', 'busy_timeout',
+                                                         fallback = 30.0),
+                           check_same_thread=False)
+    conn.execute('''pragma journal_mode=WAL''')
+    conn.execute('''pragma synchronous=NORMAL''')
+    try:
+        with conn:
+            for statement in SCHEMA:
+                conn.execute(statement)
+            columns = [row[1] for row in conn.execute('''pragma table_info(mail2blog)''')]
+            for column, definition in MAIL2BLOG_COLUMNS:
+                if column not in columns:
+                    conn.execute(F'''alter table mail2blog add column {column} {definition}''')
+            # the index is read page by page in this order (see Blog.index_page)
+            conn.execute('''create index if not exists date_id_index '''
+                         '''ON mail2blog(date, message_id)''')
+    except sqlite3.OperationalError as e:
+        logger.error("SQL Create error: " + str(e))
+        conn.close()
+        raise
+    try:
+        with conn:
+            for statement in SEARCH_SCHEMA:
+                conn.execute(statement)
+    except sqlite3.OperationalError as e:
+        logger.warning(F"no full-text search: {e}")
+    logger.debug(F"opened database {path}")
+    return conn
+
+def connection():
+    '''the connection of this process; use transaction() unless you hold the lock'''
+    path = CONFIG.get('locations', 'database', fallback = None)
+    with _lock:
+        if _state['pid'] != os.getpid() or _state['path'] != path:
+            # a connection inherited across fork must not be used (nor closed) by the child
+            if _state['pid'] == os.getpid():
+                _state['conn'].close()
+            _state['conn'] = _open(path)
+            _state['pid']  = os.getpid()
+            _state['path'] = path
+        return _state['conn']
+
+@contextlib.contextmanager
+def transaction(row_factory=None):
+    '''a cursor, committed if the block succeeds and rolled back if it raises'''
+    with _lock:
+        conn = connection()
+        cur = conn.cursor()
+        if row_factory is not None:
+            cur.row_factory = row_factory
+        try:
+            yield cur
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+def query(sql, parameters=(), row_factory=None):
+    '''all rows of a select'''
+    with transaction(row_factory) as cur:
+        cur.execute(sql, parameters)
+        return cur.fetchall()
+
+@atexit.register
+def close():
+    '''close the connection of this process (checkpoints the WAL)'''
+    with _lock:
+        if _state['conn'] is not None and _state['pid'] == os.getpid():
+            _state['conn'].close()
+        _state['pid'] = _state['path'] = _state['conn'] = None
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+'''Atom and RSS feeds of the newest entries, made from the database alone'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# [locations] blog_output/atom.xml and rss.xml have the newest [feed] entries entries (default
+# 20). Links are absolute with [locations] blog_link_base; feed readers reject relative ones,
+# so without it no feeds are written. Entry ids are derived from the Message-ID, so they never
+# change, and a feed is only rewritten when what it shows changed: Last-Modified and ETag of
+# the web server stay the same as long as the feed does, and polling readers get a 304.
+# The summary is the start of the article text of the search index (see search.py); no mail
+# is read for the feeds.
+
+import email.utils
+import logging
+import os
+import time
+import uuid
+
+from mail2blog import db
+from mail2blog import manifest
+from mail2blog import search
+from mail2blog import templating
+from mail2blog import tools
+from mail2blog.config import CONFIG
+from mail2blog.manifest import BuildManifest
+
+logger = logging.getLogger(__name__)
+
+# Used unless [templates] atom / rss point to templates of your own
+ATOM_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>{{title|e}}</title>
+  <id>{{id}}</id>
+  <updated>{{updated}}</updated>
+  <link rel="self" href="{{base}}atom.xml"/>
+  <link rel="alternate" href="{{base}}index.html"/>
+{% for entry in entries %}  <entry>
+    <title>{{entry.subject|e}}</title>
+    <id>{{entry.id}}</id>
+    <link rel="alternate" href="{{base}}{{entry.link|e}}"/>
+    <published>{{entry.published}}</published>
+    <updated>{{entry.updated}}</updated>
+    <author><name>{{entry.author|e}}</name></author>
+{% if entry.summary %}    <summary>{{entry.summary|e}}</summary>
+{% endif %}  </entry>
+{% endfor %}</feed>
+'''
+
+RSS_TEMPLATE = '''<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom">
+  <channel>
+    <title>{{title|e}}</title>
+    <link>{{base}}index.html</link>
+    <description>{{title|e}}</description>
+    <lastBuildDate>{{updated_rfc822}}</lastBuildDate>
+    <atom:link rel="self" type="application/rss+xml" href="{{base}}rss.xml"/>
+{% for entry in entries %}    <item>
+      <title>{{entry.subject|e}}</title>
+      <link>{{base}}{{entry.link|e}}</link>
+      <guid isPermaLink="false">{{entry.id}}</guid>
+      <pubDate>{{entry.published_rfc822}}</pubDate>
+{% if entry.summary %}      <description>{{entry.summary|e}}</description>
+{% endif %}    </item>
+{% endfor %}  </channel>
+</rss>
+'''
+
+FEEDS = {'atom': ('atom.xml', ATOM_TEMPLATE), 'rss': ('rss.xml', RSS_TEMPLATE)}
+
+def entry_id(message_id):
+    '''a stable id for an entry, as urn:uuid'''
+    return uuid.uuid5(uuid.NAMESPACE_URL, F"mid:{message_id}").urn
+
+def rfc3339(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+
+def summary(text, length):
+    '''the first length characters of text, cut at a word'''
+    text = ' '.join((text or '').split())
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(' ', 1)[0] + ' ...'
+
+class Feeds:
+    '''Write the Atom and RSS feeds of the newest entries if they changed'''
+    def __init__(self, force=False):
+        self.force   = force
+        self.output  = CONFIG.get('locations', 'blog_output')
+        self.title   = CONFIG.get('main', 'title', fallback='Blog')
+        self.base    = CONFIG.get('locations', 'blog_link_base', fallback='').rstrip('/')
+        self.count   = CONFIG.getint('feed', 'entries', fallback = 20)
+        self.summary_length = CONFIG.getint('feed', 'summary_length', fallback = 300)
+        self.manifest = BuildManifest()
+
+    def entries(self):
+        '''the newest entries, with what the feeds show of them'''
+        if search.available():
+            rows = db.query('''select date, mail2blog.message_id, mail2blog.subject, author, '''
+                    '''link, substr(article_text.body, 1, ?) from mail2blog '''
+                    '''left join article_doc on article_doc.message_id=mail2blog.message_id '''
+                    '''left join article_text on article_text.rowid=article_doc.doc '''
+                    '''order by date desc, mail2blog.message_id desc limit ?''',
+                    (self.summary_length * 2, self.count))
+        else:
+            rows = db.query('''select date, message_id, subject, author, link, null '''
+                    '''from mail2blog order by date desc, message_id desc limit ?''',
+                    (self.count,))
+        entries = []
+        for date, message_id, subject, author, link, body in rows:
+            if link is None or author is None:
+                continue     # not yet seen by the index (see Blog.index_entries)
+            entries.append(dict(id=entry_id(message_id), subject=subject, link=link,
+                    author=author.strip(), published=rfc3339(date), updated=rfc3339(date),
+                    published_rfc822=email.utils.formatdate(date, usegmt=True),
+                    summary=summary(body, self.summary_length), date=date))
+        return entries
+
+    def _template(self, kind):
+        if CONFIG.has_option('templates', kind):
+            return templating.get_template(kind)
+        return templating.environment().from_string(FEEDS[kind][1])
+
+    def write(self):
+        '''write the outdated feeds; return their file names'''
+        if not self.base:
+            logger.warning("no [locations] blog_link_base => not writing feeds, their links "
+                           "must be absolute")
+            return []
+        entries = self.entries()
+        newest  = max([entry['date'] for entry in entries], default=0)
+        context = dict(title=self.title, base=self.base + '/',
+                       id=uuid.uuid5(uuid.NAMESPACE_URL, F"feed:{self.base}:{self.title}").urn,
+                       updated=rfc3339(newest),
+                       updated_rfc822=email.utils.formatdate(newest, usegmt=True),
+                       entries=entries)
+        written = []
+        for kind, (filename, default_template) in FEEDS.items():
+            output_file = os.path.join(self.output, filename)
+            feed_digest = manifest.digest(repr(sorted(context.items(), key=lambda i: i[0])),
+                    manifest.file_digest(CONFIG.get('templates', kind, fallback=None)),
+                    default_template)
+            if not self.force and self.manifest.is_current(output_file, feed_digest, adopt=False):
+                continue
+            tools.makepath(self.output)
+            temp_file = output_file + '.tmp'
+            with open(temp_file, 'w', encoding='utf-8') as fh:
+                fh.write(self._template(kind).render(**context))
+            os.chmod(temp_file, 0o644)
+            os.replace(temp_file, output_file)
+            self.manifest.record(output_file, feed_digest)
+            written.append(filename)
+        logger.info(F"feeds: {', '.join(written) if written else 'up to date'}")
+        return written
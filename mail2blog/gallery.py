@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+'''Build photo galleries with thumbnails, without an external tool'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# Layout, as the article links to it (see ArticleRenderer._add_gallery_url):
+#   <gallery_output>/<name>/index.html
+#   <gallery_output>/<name>/gallery/thumbs/<file>
+#   <gallery_output>/<name>/gallery/images/<file>
+# Every generated file has a build_manifest entry with the digest of its source and of the
+# size settings, so only new or changed images are processed on a rebuild.
+
+import hashlib
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from mail2blog import manifest
+from mail2blog import templating
+from mail2blog import tools
+from mail2blog.config import CONFIG
+from mail2blog.manifest import BuildManifest
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.gif': 'GIF', '.webp': 'WEBP'}
+
+# Used unless [templates] gallery points to a template of your own. Title and file names
+# come from the mail, and the environment doesn't autoescape: escape them in the template
+GALLERY_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{{title|e}}</title>
+<style>
+body { font-family: sans-serif; background: #222; color: #ddd; }
+.thumbs a { display: inline-block; margin: 4px; }
+.thumbs img { max-width: {{thumb_size}}px; max-height: {{thumb_size}}px; }
+</style>
+</head>
+<body>
+<h1>{{title|e}}</h1>
+<div class="thumbs">
+{% for item in items %}<a href="gallery/images/{{item.name|urlencode}}">{% if item.thumb %}<img src="gallery/thumbs/{{item.name|urlencode}}" alt="{{item.name|e}}">{% else %}{{item.name|e}}{% endif %}</a>
+{% endfor %}</div>
+</body>
+</html>
+'''
+
+def source_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as fh:
+        for data in iter(lambda: fh.read(2**20), b''):
+            sha.update(data)
+    return sha.hexdigest()
+
+def scale_image(source, target, size, quality):
+    '''write source to target, scaled down to fit into size x size pixels (0: keep size)'''
+    from PIL import Image, ImageOps
+    image_format = IMAGE_FORMATS[os.path.splitext(source)[1].lower()]
+    with Image.open(source) as image:
+        if size and image_format == 'JPEG':
+            # let the jpeg decoder do most of the downscaling
+            image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        if size:
+            image.thumbnail((size, size), Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        temp_file = target + '.tmp'
+        image.save(temp_file, image_format, quality=quality)
+    os.replace(temp_file, target)
+    os.chmod(target, 0o644)
+
+class Gallery:
+    '''The gallery of all media files in source_dir, in [locations] gallery_output/name
+
+    Thumbnails are [gallery] thumb_size pixels, images are scaled to [gallery] image_size
+    (0 keeps them as they are, and files that are no images are copied). They are made by
+    [gallery] workers threads; Pillow releases the GIL while decoding and scaling.'''
+    def __init__(self, name, source_dir, force=False):
+        self.name       = name
+        self.source_dir = source_dir
+        self.force      = force
+        self.output     = os.path.join(CONFIG.get('locations', 'gallery_output'), name)
+        self.thumb_size = CONFIG.getint('gallery', 'thumb_size', fallback = 300)
+        self.image_size = CONFIG.getint('gallery', 'image_size', fallback = 0)
+        self.quality    = CONFIG.getint('gallery', 'quality', fallback = 85)
+        self.workers    = CONFIG.getint('gallery', 'workers', fallback = os.cpu_count() or 1)
+        self.manifest   = BuildManifest()
+
+    def _target(self, kind, filename):
+        return os.path.join(self.output, 'gallery', kind, filename)
+
+    def _update(self, filename):
+        '''bring thumbnail and image of one source file up to date; return True if
+        anything had to be made'''
+        source   = os.path.join(self.source_dir, filename)
+        is_image = os.path.splitext(filename)[1].lower() in IMAGE_FORMATS
+        sha      = source_digest(source)
+        made     = False
+        for kind, size in (('thumbs', self.thumb_size), ('images', self.image_size)):
+            if kind == 'thumbs' and not is_image:
+                continue
+            target = self._target(kind, filename)
+            input_digest = manifest.digest(sha, size, self.quality if size else None)
+            if not self.force and self.manifest.is_current(target, input_digest, adopt=False):
+                continue
+            if is_image and size:
+                scale_image(source, target, size, self.quality)
+            else:
+                shutil.copyfile(source, target)
+                os.chmod(target, 0o644)
+            self.manifest.record(target, input_digest)
+            made = True
+        return made
+
+    def _safe_update(self, filename):
+        try:
+            return self._update(filename)
+        except Exception as e:
+            logger.error(F"Could not add {filename} to gallery {self.name}: "
+                         F"{e.__class__.__name__}: {e}")
+            return False
+
+    def _prune(self, filenames):
+        '''remove outputs of files that are no longer in the gallery'''
+        for kind in ('thumbs', 'images'):
+            for filename in os.listdir(os.path.join(self.output, 'gallery', kind)):
+                if filename not in filenames:
+                    target = self._target(kind, filename)
+                    logger.info(F"removing {target} from gallery")
+                    os.remove(target)
+                    self.manifest.forget(target)
+
+    def _write_index(self, filenames):
+        if CONFIG.has_option('templates', 'gallery'):
+            template = templating.get_template('gallery')
+        else:
+            template = templating.environment().from_string(GALLERY_TEMPLATE)
+        items = [dict(name=filename, thumb=os.path.exists(self._target('thumbs', filename)))
+                 for filename in filenames]
+        html = template.render(title=self.name, items=items, thumb_size=self.thumb_size)
+        index_file = os.path.join(self.output, 'index.html')
+        try:
+            with open(index_file, 'r') as fh:
+                if fh.read() == html:
+                    return
+        except FileNotFoundError:
+            pass
+        with open(index_file, 'w') as fh:
+            fh.write(html)
+        os.chmod(index_file, 0o644)
+
+    def build(self):
+        '''update the gallery; return the number of source files that had to be processed'''
+        filenames = sorted(f for f in os.listdir(self.source_dir)
+                           if os.path.isfile(os.path.join(self.source_dir, f)))
+        for kind in ('thumbs', 'images'):
+            tools.makepath(os.path.join(self.output, 'gallery', kind), 4)
+        logger.info(F"Generating gallery for {self.name} ({len(filenames)} files)...")
+        with ThreadPoolExecutor(max_workers=max(1, self.workers),
+                                thread_name_prefix='gallery') as executor:
+            processed = sum(executor.map(self._safe_update, filenames))
+        self._prune(set(filenames))
+        self._write_index(filenames)
+        logger.info(F"gallery {self.name}: {processed} of {len(filenames)} files processed")
+        return processed
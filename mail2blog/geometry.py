@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+'''Simplify GPX tracks and encode them compactly for the map of a page'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# A day long track recorded at 1 Hz has ~86000 points, most of which lie on a straight line
+# between their neighbours at map resolution. Tracks are reduced with Ramer-Douglas-Peucker
+# (tolerance in metres) and written as encoded polylines, the format of the Google maps API:
+# ~4 characters per point instead of ~40 for a "[lat, lon]" literal. The page decodes them
+# with DECODE_POLYLINE_JS.
+
+import logging
+
+import numpy as np
+
+from mail2blog.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371000.0
+PRECISION    = 5
+
+DECODE_POLYLINE_JS = '''
+            function decodePolyline(str) {
+                var points = [], lat = 0, lon = 0, i = 0;
+                while (i < str.length) {
+                    var delta = [0, 0];
+                    for (var k = 0; k < 2; k++) {
+                        var shift = 0, result = 0, b;
+                        do {
+                            b = str.charCodeAt(i++) - 63;
+                            result |= (b & 0x1f) << shift;
+                            shift += 5;
+                        } while (b >= 0x20);
+                        delta[k] = (result & 1) ? ~(result >> 1) : (result >> 1);
+                    }
+                    lat += delta[0];
+                    lon += delta[1];
+                    points.push([lat / 1e5, lon / 1e5]);
+                }
+                return points;
+            }'''
+
+def tolerance():
+    return CONFIG.getfloat('map', 'gpx_tolerance', fallback = 5.0)
+
+def segment_arrays(gpx):
+    '''one (n, 2) array of latitude/longitude per track segment of a gpxpy GPX'''
+    arrays = []
+    for track in gpx.tracks:
+        for segment in track.segments:
+            if segment.points:
+                arrays.append(np.array([(p.latitude, p.longitude) for p in segment.points],
+                                       dtype=float))
+    return arrays
+
+def project(latlon, latitude=None):
+    '''latitude/longitude in degrees to x/y in metres, good enough within a track.
+    Longitudes are scaled for latitude (default: the mean latitude of the points)'''
+    lat = np.radians(latlon[:, 0])
+    lon = np.radians(latlon[:, 1])
+    scale = np.cos(lat.mean() if latitude is None else np.radians(latitude))
+    return np.column_stack((EARTH_RADIUS * lon * scale, EARTH_RADIUS * lat))
+
+def simplify_mask(points, max_distance):
+    '''Ramer-Douglas-Peucker on an (n, 2) array of x/y; return the boolean mask of the
+    points to keep.
+
+    Instead of recursing span by span, all open spans of one recursion level are handled
+    with a single set of numpy operations, so there are only as many Python iterations
+    as the recursion is deep.'''
+    n = len(points)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    firsts = np.array([0])
+    lasts  = np.array([n - 1])
+    while len(firsts):
+        counts = lasts - firsts - 1
+        open_spans = counts > 0
+        firsts, lasts, counts = firsts[open_spans], lasts[open_spans], counts[open_spans]
+        if not len(firsts):
+            break
+        # every inner point of every open span, and the span it belongs to
+        offsets = np.cumsum(counts) - counts
+        span    = np.repeat(np.arange(len(firsts)), counts)
+        inner   = np.arange(counts.sum()) - offsets[span] + firsts[span] + 1
+
+        start  = points[firsts][span]
+        chord  = (points[lasts] - points[firsts])[span]
+        vector = points[inner] - start
+        # distance to the chord as a line segment, not as an infinite line: the track
+        # may double back beyond its ends
+        length2 = (chord ** 2).sum(axis=1)
+        t = np.clip((vector * chord).sum(axis=1) / np.where(length2 > 0, length2, 1), 0, 1)
+        offset = vector - chord * t[:, None]
+        distances = np.hypot(offset[:, 0], offset[:, 1])
+
+        # the farthest point of every span
+        farthest = np.maximum.reduceat(distances, offsets)
+        candidates = np.flatnonzero(distances == farthest[span])
+        _, first_candidate = np.unique(span[candidates], return_index=True)
+        split_at = inner[candidates[first_candidate]]
+
+        split = farthest > max_distance
+        keep[split_at[split]] = True
+        firsts = np.concatenate((firsts[split], split_at[split]))
+        lasts  = np.concatenate((split_at[split], lasts[split]))
+    return keep
+
+def simplify(latlon, max_distance=None):
+    '''the points of an (n, 2) latitude/longitude array that are needed to draw it
+    within max_distance metres (default: [map] gpx_tolerance)'''
+    if max_distance is None:
+        max_distance = tolerance()
+    if len(latlon) < 3 or max_distance <= 0:
+        return latlon
+    return latlon[simplify_mask(project(latlon), max_distance)]
+
+def encode_polyline(latlon):
+    '''encode an (n, 2) latitude/longitude array in the encoded polyline format'''
+    values = np.round(np.asarray(latlon) * 10**PRECISION).astype(np.int64)
+    deltas = np.diff(values, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel()
+    deltas = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    chars = []
+    for value in deltas.tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1f)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return ''.join(chars)
+
+def decode_polyline(text):
+    '''the (n, 2) latitude/longitude array of an encoded polyline'''
+    values = []
+    value = shift = 0
+    for char in text:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    return np.cumsum(np.array(values, dtype=np.int64).reshape(-1, 2), axis=0) / 10**PRECISION
+
+def encode_gpx(gpx, max_distance=None):
+    '''one encoded polyline per track segment of a gpxpy GPX, simplified for the map'''
+    polylines = []
+    total = kept = 0
+    for latlon in segment_arrays(gpx):
+        simplified = simplify(latlon, max_distance)
+        total += len(latlon)
+        kept  += len(simplified)
+        polylines.append(encode_polyline(simplified))
+    logger.debug(F"gpx: kept {kept} of {total} points")
+    return polylines
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+'''Reduce the number of points of GPX tracks while streaming the file'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# The file is read with iterparse and every track point is dropped from the tree as soon as
+# it has been looked at, so memory does not grow with the file. A reducer gets the points of
+# one segment after the other and returns the ones to keep:
+#   TimeReducer      one point every interval seconds
+#   DistanceReducer  one point every distance metres
+#   RdpReducer       Ramer-Douglas-Peucker with a tolerance in metres, on windows of points
+# Points are kept with all their children (ele, time, extensions); the first and the last
+# point of every segment are always kept.
+
+import datetime
+import logging
+import math
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+from mail2blog import geometry
+
+logger = logging.getLogger(__name__)
+
+class Point:
+    __slots__ = ('lat', 'lon', 'time', 'element')
+    def __init__(self, lat, lon, time=None, element=None):
+        self.lat     = lat
+        self.lon     = lon
+        self.time    = time
+        self.element = element
+
+def parse_time(text):
+    '''the datetime of an xsd:dateTime like 2021-07-13T10:52:08Z, or None'''
+    if not text:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(text.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+def distance(a, b):
+    '''metres between two points, equirectangular: exact enough for neighbouring points'''
+    lat = math.radians((a.lat + b.lat) / 2)
+    dx  = math.radians(b.lon - a.lon) * math.cos(lat)
+    dy  = math.radians(b.lat - a.lat)
+    return geometry.EARTH_RADIUS * math.hypot(dx, dy)
+
+class TimeReducer:
+    '''keep a point if interval seconds have passed since the last kept one.
+    Points without a timestamp are kept, as there is nothing to judge them by.'''
+    def __init__(self, interval):
+        self.interval = interval
+        self.last     = None
+        self.pending  = None
+
+    def feed(self, point):
+        self.pending = point
+        if (self.last is None or point.time is None or self.last.time is None
+                or (point.time - self.last.time).total_seconds() >= self.interval):
+            self.last, self.pending = point, None
+            return [point]
+        return []
+
+    def flush(self):
+        pending, self.last, self.pending = self.pending, None, None
+        return [pending] if pending is not None else []
+
+class DistanceReducer(TimeReducer):
+    '''keep a point if it is at least min_distance metres away from the last kept one'''
+    def __init__(self, min_distance):
+        super().__init__(None)
+        self.min_distance = min_distance
+
+    def feed(self, point):
+        self.pending = point
+        if self.last is None or distance(self.last, point) >= self.min_distance:
+            self.last, self.pending = point, None
+            return [point]
+        return []
+
+class RdpReducer:
+    '''Ramer-Douglas-Peucker (see geometry.simplify_mask) on windows of up to window points.
+    The last point of a window is kept and starts the next one, so the result is within
+    tolerance of the track everywhere, and memory is bounded by the window.'''
+    def __init__(self, tolerance, window=100000):
+        self.tolerance = tolerance
+        self.window    = max(window, 3)
+        self.points    = []
+
+    def feed(self, point):
+        self.points.append(point)
+        if len(self.points) < self.window:
+            return []
+        kept = self._simplify()
+        self.points = [kept[-1]]
+        return kept[:-1]
+
+    def flush(self):
+        kept = self._simplify() if self.points else []
+        self.points = []
+        return kept
+
+    def _simplify(self):
+        points = self.points
+        if len(points) < 3 or self.tolerance <= 0:
+            return list(points)
+        latlon = np.array([(p.lat, p.lon) for p in points], dtype=float)
+        mask = geometry.simplify_mask(geometry.project(latlon), self.tolerance)
+        return [p for p, keep in zip(points, mask.tolist()) if keep]
+
+REDUCERS = {'time': TimeReducer, 'distance': DistanceReducer, 'rdp': RdpReducer}
+
+def reducer_factory(strategy, value):
+    '''a function returning a new reducer, one is used per segment'''
+    return lambda: REDUCERS[strategy](value)
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+CONTAINERS = ('gpx', 'trk', 'trkseg')
+
+def _events(source, namespaces=None):
+    '''stream a gpx file as (event, item, depth) with the root at depth 1:
+        ('start', element, depth) for gpx, trk and trkseg
+        ('point', Point, depth)   for every track point
+        ('end', element, depth)   for gpx, trk, trkseg and every complete child of them
+    Elements are detached from the tree once they have been handed out.'''
+    names    = []      # local names of the open elements
+    elements = []
+    matched  = 0       # the first matched open elements are gpx, trk and trkseg
+    local    = {}      # tag => local name
+    time_tag = 'time'
+    for event, item in ET.iterparse(source, events=('start', 'end', 'start-ns')):
+        if event == 'start-ns':
+            if namespaces is not None:
+                namespaces.append(item)
+            continue
+        if event == 'start':
+            name = local.get(item.tag)
+            if name is None:
+                name = local[item.tag] = _local(item.tag)
+            depth = len(names)
+            names.append(name)
+            elements.append(item)
+            if matched == depth and depth < 3 and name == CONTAINERS[depth]:
+                matched += 1
+                if depth == 0:
+                    time_tag = item.tag[:item.tag.find('}') + 1] + 'time'
+                yield 'start', item, depth + 1
+            continue
+        depth = len(names)
+        name = names.pop()
+        elements.pop()
+        if matched == depth:
+            matched -= 1
+        if matched < depth - 1:
+            continue              # inside of something that is copied as a whole
+        if elements:
+            elements[-1].remove(item)
+        if name == 'trkpt' and depth == 4:
+            time_element = item.find(time_tag)
+            try:
+                point = Point(float(item.get('lat')), float(item.get('lon')),
+                              parse_time(time_element.text if time_element is not None
+                                         else None), item)
+            except (TypeError, ValueError):
+                logger.warning(F"skipping track point without valid lat/lon: {item.attrib}")
+                continue
+            yield 'point', point, depth
+            continue
+        yield 'end', item, depth
+
+def read_segments(source, new_reducer):
+    '''yield an (n, 2) latitude/longitude array of the kept points of every track segment
+    of the gpx file (name or binary file object) source'''
+    latlon  = []
+    reducer = None
+    for event, item, depth in _events(source):
+        if event == 'start' and depth == 3:
+            reducer = new_reducer()
+            latlon = []
+        elif event == 'point':
+            latlon += [(p.lat, p.lon) for p in reducer.feed(item)]
+        elif event == 'end' and depth == 3 and _local(item.tag) == 'trkseg':
+            latlon += [(p.lat, p.lon) for p in reducer.flush()]
+            if latlon:
+                yield np.array(latlon, dtype=float)
+
+class _Writer:
+    '''write the reduced gpx to a text file, namespaces as in the source'''
+    def __init__(self, out, namespaces):
+        self.out = out
+        self.namespaces = namespaces
+        self.default = None
+
+    def _strip(self, element):
+        # elements of the gpx namespace are written without prefix, it is the default
+        for child in element.iter():
+            if child.tag.startswith('{' + self.default + '}'):
+                child.tag = _local(child.tag)
+        return ET.tostring(element, encoding='unicode').strip()
+
+    def _attributes(self, element):
+        prefixes = {uri: prefix for prefix, uri in self.namespaces}
+        text = ''
+        for key, value in element.attrib.items():
+            if key.startswith('{'):
+                uri, local = key[1:].split('}', 1)
+                key = F"{prefixes.get(uri, 'ns')}:{local}"
+            text += F' {key}="{_escape(value)}"'
+        return text
+
+    def root(self, element):
+        self.default = element.tag[1:].split('}', 1)[0] if element.tag.startswith('{') else ''
+        for prefix, uri in self.namespaces:
+            if prefix:
+                ET.register_namespace(prefix, uri)
+        declarations = ''.join(F' xmlns{":" + prefix if prefix else ""}="{_escape(uri)}"'
+                               for prefix, uri in self.namespaces)
+        self.out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.out.write(F'<gpx{declarations}{self._attributes(element)}>\n')
+
+    def open(self, element, indent):
+        self.out.write(F"{'  ' * indent}<{_local(element.tag)}{self._attributes(element)}>\n")
+
+    def close(self, element, indent):
+        self.out.write(F"{'  ' * indent}</{_local(element.tag)}>\n")
+
+    def element(self, element, indent):
+        self.out.write('  ' * indent + self._strip(element) + '\n')
+
+def _escape(text):
+    return (text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+                .replace('"', '&quot;'))
+
+def reduce_file(source, out, new_reducer):
+    '''copy the gpx file source to the text file out, with the track points reduced by
+    reducers from new_reducer(); return (points read, points written)'''
+    namespaces = []
+    writer  = _Writer(out, namespaces)
+    reducer = None
+    total = kept = 0
+    for event, item, depth in _events(source, namespaces):
+        name = _local(item.tag) if event != 'point' else 'trkpt'
+        if event == 'start' and depth == 1:
+            writer.root(item)
+        elif event == 'start':
+            writer.open(item, depth - 1)
+            if name == 'trkseg':
+                reducer = new_reducer()
+        elif event == 'point':
+            total += 1
+            for point in reducer.feed(item):
+                writer.element(point.element, depth - 1)
+                kept += 1
+        elif event == 'end' and depth == 1:
+            out.write('</gpx>\n')
+        elif event == 'end' and depth <= 3 and name == CONTAINERS[depth - 1]:
+            if name == 'trkseg':
+                for point in reducer.flush():
+                    writer.element(point.element, depth)
+                    kept += 1
+            writer.close(item, depth - 1)
+        elif event == 'end':
+            # metadata, waypoints, routes, track names, ... are copied as they are
+            writer.element(item, depth - 1)
+    return total, kept
+
+def map_polylines(source, tolerance):
+    '''encoded polylines of all track segments of a gpx file, reduced with RDP for the map
+    of a page (see tools.geo_include)'''
+    return [geometry.encode_polyline(latlon)
+            for latlon in read_segments(source, reducer_factory('rdp', tolerance))]
@@ -12,17 +12,60 @@
 
 import logging
 import sys
+import re
+import select
+import time
 import email
 from email.iterators import _structure
-from imaplib import IMAP4_SSL
+from imaplib import IMAP4_SSL, IMAP4
 
-from mail2blog import logsetup
 from mail2blog import tools
 from mail2blog.config import CONFIG
 # from mail2blog.parse_args import args
 
 logger = logging.getLogger(__name__)
 
+# The only header fields mail2blog ever looks at (see tools.decode_message)
+HEADER_FIELDS = ['FROM', 'TO', 'SUBJECT', 'DATE', 'MESSAGE-ID', 'RETURN-PATH', 'CONTENT-TYPE']
+FETCH_START_RE = re.compile(rb'^\d+ \(')
+FETCH_UID_RE   = re.compile(rb'UID (\d+)')
+CHANGE_RE      = re.compile(rb'^\* \d+ (EXISTS|EXPUNGE)', re.I)
+
+def uid_sequence_set(uids):
+    '''Compress a list of UIDs into an IMAP sequence set like "1:5,7,9:12"'''
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(a) if a == b else F"{a}:{b}" for a, b in ranges)
+
+def message_id_of(raw):
+    '''Message-ID of a raw message, without the angle brackets'''
+    header = raw.split(b'\r\n\r\n', 1)[0].split(b'\n\n', 1)[0]
+    msg = email.message_from_string(header.decode('iso-8859-1'))
+    return str(msg['message-id']).strip().replace('<','').replace('>','')
+
+def parse_fetch_response(data):
+    '''Group the flat imaplib FETCH response into (uid, [literal, ...]) per message'''
+    messages = []
+    for item in data:
+        head = item[0] if isinstance(item, tuple) else item
+        if head is None:
+            continue
+        if FETCH_START_RE.match(head):
+            messages.append([None, []])
+        if not messages:
+            continue
+        if messages[-1][0] is None:
+            match = FETCH_UID_RE.search(head)
+            if match:
+                messages[-1][0] = int(match.group(1))
+        if isinstance(item, tuple):
+            messages[-1][1].append(item[1])
+    return [(uid, literals) for uid, literals in messages]
+
 def test():
     host       = CONFIG.get('imap', 'host')
     imap_debug = CONFIG.getint('imap', 'debug', fallback = 0)
@@ -71,22 +114,55 @@ def test():
 
 class ImapConnector():
     def __init__(self):
-        self.connected = False
+        self.connected   = False
+        self.folder      = None
+        self.exists      = None
+        self.uidvalidity = None
+        self.uidnext     = None
 
     def connect(self):
         host           = CONFIG.get('imap', 'host')
         imap_debug     = CONFIG.getint('imap', 'debug', fallback = 0)
         user           = CONFIG.get('imap', 'user')
         passwd         = CONFIG.get('imap', 'pass')
-        self.M         = IMAP4_SSL(host)
+        timeout        = CONFIG.getfloat('imap', 'timeout', fallback = 120)
+        if CONFIG.getboolean('imap', 'ssl', fallback = True):
+            self.M     = IMAP4_SSL(host, CONFIG.getint('imap', 'port', fallback = 993),
+                                   timeout=timeout)
+        else:
+            self.M     = IMAP4(host, CONFIG.getint('imap', 'port', fallback = 143),
+                               timeout=timeout)
         self.M.debug   = imap_debug
         res        = self.M.login(user, passwd)
         if res[0] != 'OK':
             logger.error(F"Problem logging in to IMAP: {res}")
         self.M.enable("UTF8=ACCEPT")
-        self.M.select(readonly=True)
+        self.folder    = CONFIG.get('imap', 'folder', fallback = 'INBOX')
+        res, data      = self.M.select(self.folder, readonly=True)
+        if res != 'OK':
+            logger.error(F"Problem selecting {self.folder} in IMAP: {res}")
+        self.exists      = int(data[0]) if data and data[0] is not None else None
+        self.uidvalidity = self._select_response('UIDVALIDITY')
+        self.uidnext     = self._select_response('UIDNEXT')
+        self._changes()
         self.connected=True
 
+    def _select_response(self, code):
+        '''return the integer value of a response code sent with SELECT, e.g. UIDNEXT'''
+        res, data = self.M.response(code)
+        try:
+            return int(data[-1])
+        except (TypeError, ValueError, IndexError):
+            return None
+
+    def _changes(self):
+        '''forget the EXISTS and EXPUNGE responses imaplib collected; True if there were any.
+        Servers send them whenever the folder changes, also in the middle of other commands'''
+        changed = False
+        for name in ('EXISTS', 'EXPUNGE'):
+            changed = self.M.untagged_responses.pop(name, None) is not None or changed
+        return changed
+
     def __del__(self):
         '''disconnect from imap'''
         try:
@@ -102,31 +178,218 @@ class ImapConnector():
         self.M.logout()
         self.connected = False
 
+    def drop(self):
+        '''close a broken connection without the logout dialogue'''
+        try:
+            self.M.shutdown()
+        except Exception:
+            pass
+        self.connected = False
+
+    def reset(self):
+        '''drop a broken connection without the logout dialogue, and connect again'''
+        self.drop()
+        self.connect()
 
-    def get_message_list(self):
+    def refresh(self):
+        '''select the folder again, for the current EXISTS, UIDVALIDITY and UIDNEXT'''
         if not self.connected:
             self.connect()
-        res, data = self.M.search(None, 'ALL')
-        msg_list = []
-        for num in data[0].split():
-            # res, data = M.fetch(num, '(RFC822)')
-            res, data = self.M.fetch(num, '(BODY[HEADER])')
-            # print(F"Message #{int(num)} ")
-            # print(F"---\n{data[0][1]}\n---")
-            msg_list.append (email.message_from_string(data[0][1].decode('iso-8859-1')))
-        return msg_list
+            return
+        res, data = self.M.select(self.folder, readonly=True)
+        if res != 'OK':
+            raise IMAP4.error(F"Problem selecting {self.folder} in IMAP: {res}")
+        self.exists      = int(data[0]) if data and data[0] is not None else None
+        self.uidvalidity = self._select_response('UIDVALIDITY')
+        self.uidnext     = self._select_response('UIDNEXT')
+        self._changes()
 
-    def get_message(self, message_id):
+    def noop(self):
+        '''keep the connection alive, and find out early if it is dead. Return True if the
+        server reported new or expunged messages meanwhile'''
+        res, data = self.M.noop()
+        if res != 'OK':
+            raise IMAP4.abort(F"NOOP failed: {res} {data}")
+        return self._changes()
+
+    def idle(self, timeout):
+        '''IDLE (RFC 2177) for at most timeout seconds. Return True as soon as the server
+        reports new or expunged messages, False if nothing happened'''
+        if not self.connected:
+            self.connect()
+        if self._changes():
+            # reported during the commands since the last SELECT
+            return True
+        tag = self.M._new_tag()   # pylint: disable=protected-access
+        self.M.send(tag + b' IDLE\r\n')
+        changed  = False
+        while True:
+            line = self.M.readline()
+            if line.startswith(b'+'):
+                break
+            if line and not line.startswith(b'* '):
+                raise IMAP4.error(F"IDLE refused: {line!r}")
+            # the folder may change just before the server answers IDLE
+            changed = self._idle_response(line) or changed
+        deadline = time.monotonic() + timeout
+        sock     = self.M.socket()
+        while not changed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # ssl may hold decrypted data select() doesn't know about. Anything imaplib
+            # has buffered already is read after DONE
+            pending = sock.pending() if hasattr(sock, 'pending') else 0
+            if not pending and not select.select([sock], [], [], remaining)[0]:
+                break
+            changed = self._idle_response(self.M.readline())
+        self.M.send(b'DONE\r\n')
+        while True:
+            line = self.M.readline()
+            if line.startswith(tag):
+                if not line.startswith(tag + b' OK'):
+                    raise IMAP4.error(F"IDLE failed: {line!r}")
+                return changed
+            changed = self._idle_response(line) or changed
+
+    @staticmethod
+    def _idle_response(line):
+        if not line:
+            raise IMAP4.abort("connection closed during IDLE")
+        if line.startswith(b'* BYE'):
+            raise IMAP4.abort(F"server said {line.decode('utf-8', 'replace').strip()}")
+        return CHANGE_RE.match(line) is not None
+
+
+    def get_uid_list(self, min_uid=None):
+        '''UIDs of all messages in the selected folder, optionally only those >= min_uid'''
+        if not self.connected:
+            self.connect()
+        if min_uid is None:
+            res, data = self.M.uid('SEARCH', None, 'ALL')
+        else:
+            res, data = self.M.uid('SEARCH', None, 'UID', F"{min_uid}:*")
+        if res != 'OK':
+            raise IMAP4.error(F"Problem listing messages in IMAP: {res} {data}")
+        uids = [int(uid) for uid in data[0].split()]
+        if min_uid is not None:
+            # "n:*" always matches the highest UID, even if it is below n
+            uids = [uid for uid in uids if uid >= min_uid]
+        return uids
+
+    def get_header_list(self, uids=None):
+        '''Fetch the headers mail2blog uses for the given UIDs (default: all)
+
+        Headers are fetched in UID sequence-set batches of [imap] fetch_batch_size messages,
+        so listing costs one round trip per batch instead of one per message.
+        Returns a list of (uid, email.message.Message), ordered by UID. A batch the server
+        refuses raises IMAP4.error: ImapSync must not move its watermark past it'''
+        if not self.connected:
+            self.connect()
+        if uids is None:
+            uids = self.get_uid_list()
+        uids       = sorted(uids)
+        batch_size = CONFIG.getint('imap', 'fetch_batch_size', fallback = 500)
+        items      = F"(UID BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+        headers    = []
+        for start in range(0, len(uids), batch_size):
+            batch = uids[start:start+batch_size]
+            res, data = self.M.uid('FETCH', uid_sequence_set(batch), items)
+            if res != 'OK':
+                raise IMAP4.error(F"Problem fetching headers from IMAP: {res} {data}")
+            for uid, literals in parse_fetch_response(data):
+                if uid is None or not literals:
+                    continue
+                headers.append((uid, email.message_from_string(literals[0].decode('iso-8859-1'))))
+        headers.sort(key=lambda h: h[0])
+        return headers
+
+    def get_message_list(self):
+        return [msg for (uid, msg) in self.get_header_list()]
+
+    def find_uid(self, message_id):
+        '''search the folder for a Message-ID. This is a linear scan on most servers'''
         if not self.connected:
             self.connect()
         # res, data = self.M.search(None,  '(HEADER "Message-ID" "<YO1ZCXx5apR53NRG@nemo.hardt-it.de>")')
-        res, data = self.M.search(None, F'(HEADER "Message-ID" "<{message_id}>")')
+        res, data = self.M.uid('SEARCH', None, F'(HEADER "Message-ID" "<{message_id}>")')
+        if res != 'OK' or not data[0]:
+            logger.error(F"Problem finding message in IMAP: {res} {data}")
+            return None
+        return int(data[0].split()[0])
+
+    def fetch_raw_message(self, uid):
+        '''return the raw bytes of the message with the given UID, or None'''
+        if not self.connected:
+            self.connect()
+        res, data = self.M.uid('FETCH', str(uid), '(RFC822)')
         if res != 'OK':
-            logger.error(F"Problem finding message in IMAP: {res}")
-        res, data = self.M.fetch(data[0], '(RFC822)')
+            logger.error(F"Problem fetching from IMAP: {res}")
+            return None
+        for fetched_uid, literals in parse_fetch_response(data):
+            if fetched_uid == uid and literals:
+                return literals[0]
+        return None
+
+    def fetch_raw_chunk(self, uid, offset, length):
+        '''return up to length bytes of the message with the given UID, starting at offset'''
+        if not self.connected:
+            self.connect()
+        res, data = self.M.uid('FETCH', str(uid), F'(BODY.PEEK[]<{offset}.{length}>)')
         if res != 'OK':
             logger.error(F"Problem fetching from IMAP: {res}")
-        msg = email.message_from_string(data[0][1].decode('iso-8859-1'))
+            return None
+        for fetched_uid, literals in parse_fetch_response(data):
+            if fetched_uid == uid:
+                return literals[0] if literals else b''
+        return None
+
+    def download_message(self, message_id, uid, fp):
+        '''write the raw message with the given Message-ID to the binary file fp; return its uid
+
+        The message is fetched in pieces of [imap] fetch_chunk_size bytes, so a big
+        attachment is never held in memory as a whole.'''
+        chunk_size = CONFIG.getint('imap', 'fetch_chunk_size', fallback = 2**20)
+        chunk = None
+        if uid is not None:
+            chunk = self.fetch_raw_chunk(uid, 0, chunk_size)
+            if chunk is None or message_id_of(chunk) != message_id:
+                logger.info(F"UID {uid} no longer holds {message_id} => searching for it")
+                chunk = None
+        if chunk is None:
+            uid = self.find_uid(message_id)
+            if uid is None:
+                raise KeyError(F"message not found in IMAP: {message_id}")
+            chunk = self.fetch_raw_chunk(uid, 0, chunk_size)
+        offset = 0
+        while chunk:
+            fp.write(chunk)
+            offset += len(chunk)
+            if len(chunk) < chunk_size:
+                break
+            chunk = self.fetch_raw_chunk(uid, offset, chunk_size)
+            if chunk is None:
+                raise IMAP4.error(F"could not fetch {message_id} beyond byte {offset}")
+        return uid
+
+    def get_raw_message(self, message_id, uid=None):
+        '''return (uid, raw bytes) of the message with the given Message-ID
+
+        If the UID is known (see ImapSync) the message is fetched directly. The header
+        search is only used when there is no UID or the UID points to a different message.'''
+        if uid is not None:
+            raw = self.fetch_raw_message(uid)
+            if raw is not None and message_id_of(raw) == message_id:
+                return uid, raw
+            logger.info(F"UID {uid} no longer holds {message_id} => searching for it")
+        uid = self.find_uid(message_id)
+        if uid is None:
+            raise KeyError(F"message not found in IMAP: {message_id}")
+        return uid, self.fetch_raw_message(uid)
+
+    def get_message(self, message_id):
+        uid, raw = self.get_raw_message(message_id)
+        msg = email.message_from_string(raw.decode('iso-8859-1'))
         return msg
 
 
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+'''Fetch message bodies over several IMAP connections at once'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import collections
+import logging
+import queue
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from imaplib import IMAP4
+
+from mail2blog.imapconnector import ImapConnector
+from mail2blog.rawcache import RawMessageCache
+from mail2blog.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+class ImapPool:
+    '''A fixed set of ImapConnectors, handed out to a work queue of body downloads
+
+    The pool size is [imap] connections, capped so that together with the connector
+    in database.py we stay within [imap] max_connections (the server's per-user limit).'''
+    def __init__(self, size=None):
+        if size is None:
+            size = CONFIG.getint('imap', 'connections', fallback = 4)
+        max_connections = CONFIG.getint('imap', 'max_connections', fallback = 8)
+        self.size    = max(1, min(size, max_connections - 1))
+        self.retries = CONFIG.getint('imap', 'retries', fallback = 2)
+        self.cache   = RawMessageCache()
+        self.idle    = queue.Queue()
+        self.connectors = [ImapConnector() for _ in range(self.size)]
+        for connector in self.connectors:
+            self.idle.put(connector)
+
+    def fetch(self, message_id, uid=None):
+        '''download a message into the raw cache and return its uid,
+        reconnecting on timeouts and BYE'''
+        connector = self.idle.get()
+        download  = lambda fp: connector.download_message(message_id, uid, fp)
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    fetched_uid, _ = self.cache.store(message_id, download)
+                    return fetched_uid
+                except (IMAP4.abort, socket.timeout, OSError) as e:
+                    if attempt == self.retries:
+                        raise
+                    logger.warning(F"IMAP connection lost while fetching {message_id}: {e} "
+                                   F"=> reconnecting")
+                    # the next attempt connects again: if that fails, it is an attempt too
+                    connector.drop()
+        finally:
+            self.idle.put(connector)
+
+    def fetch_bodies(self, entries, wanted=lambda entry: True):
+        '''yield (entry, fetched) for all entries, in their original order
+
+        Bodies are only downloaded (into the raw cache) for entries where wanted(entry) is
+        true. At most twice the pool size downloads are in flight.'''
+        with ThreadPoolExecutor(max_workers=self.size, thread_name_prefix='imap') as executor:
+            pending = collections.deque()
+            for entry in entries:
+                future = None
+                if wanted(entry):
+                    future = executor.submit(self.fetch, entry.message_id, entry.uid)
+                pending.append((entry, future))
+                while len(pending) > 2 * self.size or (pending and pending[0][1] is None):
+                    yield self._result(*pending.popleft())
+            while pending:
+                yield self._result(*pending.popleft())
+
+    @staticmethod
+    def _result(entry, future):
+        if future is None:
+            return entry, False
+        try:
+            entry.uid = future.result()
+            return entry, True
+        except Exception as e:
+            logger.error(F"Could not fetch {entry.message_id}: {e}")
+            return entry, False
+
+    def close(self):
+        for connector in self.connectors:
+            if connector.connected:
+                connector.disconnect()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+'''Take mails via LMTP in a resident process, instead of one controller.parse_mail per mail'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# mail2blog-lmtpd listens on [lmtp] host:port (default 127.0.0.1 and --port), or on the unix
+# socket [lmtp] socket, e.g. for postfix:
+#     mailbox_transport = lmtp:inet:127.0.0.1:3888
+# Every message is stored as controller.store_message does it: raw.mail in raw_output and an
+# entry in the database. The messages that arrive while a commit is running are committed
+# together with the next one (at most [lmtp] batch_size, optionally waiting [lmtp] batch_delay
+# milliseconds for more), and a message is only acknowledged after its commit.
+# At most [lmtp] queue_size messages wait for a commit; a connection with another one is not
+# read from until there is room again, so a burst of mail slows the MTA down instead of
+# piling up here.
+# A message is not kept in memory: DATA is spooled to a file in raw_output/%lmtp (no
+# message directory has that name, see rawcache.message_directory), which becomes its
+# raw.mail by a rename.
+
+import asyncio
+import email
+import itertools
+import logging
+import os
+import signal
+import socket
+import sys
+
+from mail2blog import context
+from mail2blog import controller
+from mail2blog import tools
+from mail2blog.config import CONFIG
+from mail2blog.database import store_entries
+
+logger = logging.getLogger(__name__)
+
+SPOOL = '%lmtp'
+
+class LMTPServer:
+    '''LMTP (RFC 2033) server storing every message it gets in the blog'''
+    def __init__(self):
+        self.host        = CONFIG.get('lmtp', 'host', fallback = '127.0.0.1')
+        self.port        = CONFIG.getint('lmtp', 'port',
+                                         fallback = int(context.current().args.port))
+        self.socket_path = CONFIG.get('lmtp', 'socket', fallback = None)
+        self.batch_size  = CONFIG.getint('lmtp', 'batch_size', fallback = 100)
+        self.batch_delay = CONFIG.getint('lmtp', 'batch_delay', fallback = 0) / 1000
+        self.max_size    = CONFIG.getint('lmtp', 'max_size', fallback = 50 * 2**20)
+        self.queue_size  = CONFIG.getint('lmtp', 'queue_size', fallback = 100)
+        self.hostname    = socket.gethostname()
+        self.spool       = os.path.join(CONFIG.get('locations', 'raw_output',
+                                                   fallback = '/tmp/mail2blog'), SPOOL)
+        self.spooled     = itertools.count()
+        self.queue       = None
+        self.server      = None
+        self.committer   = None
+        self.commits     = 0
+        self.stored      = 0
+
+    async def start(self):
+        '''start listening; with [lmtp] port = 0 the port is chosen by the system'''
+        tools.makepath(self.spool, 2)
+        for name in os.listdir(self.spool):
+            # from a run that did not stop cleanly; those messages were never acknowledged
+            os.remove(os.path.join(self.spool, name))
+        self.queue = asyncio.Queue(self.queue_size)
+        self.committer = asyncio.create_task(self._committer())
+        if self.socket_path:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self.server = await asyncio.start_unix_server(self._session, self.socket_path)
+            logger.info(F"LMTP on {self.socket_path}")
+        else:
+            self.server = await asyncio.start_server(self._session, self.host, self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+            logger.info(F"LMTP on {self.host}:{self.port}")
+        return self
+
+    async def stop(self):
+        '''stop listening, and wait until what was received is committed'''
+        self.server.close()
+        await self.server.wait_closed()
+        await self.queue.join()
+        self.committer.cancel()
+        logger.info(F"stored {self.stored} messages in {self.commits} commits")
+
+    async def serve(self):
+        '''run until SIGTERM or SIGINT'''
+        await self.start()
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stopping.set)
+        await stopping.wait()
+        await self.stop()
+
+    async def deliver(self, path):
+        '''queue the message spooled to path for the next commit; return the reply once it
+        is committed'''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((path, future))    # waits while the queue is full
+        return await future
+
+    async def _committer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            if self.batch_delay:
+                await asyncio.sleep(self.batch_delay)
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                replies = await loop.run_in_executor(None, self._store,
+                                                     [path for path, _ in batch])
+            except Exception as e: # pylint: disable=broad-except
+                logger.error(F"could not store {len(batch)} messages: {e}")
+                replies = [F"451 4.3.0 could not store the message: {e}"] * len(batch)
+                for path, _ in batch:
+                    self._discard(path)
+            for (_, future), reply in zip(batch, replies):
+                if not future.done():
+                    future.set_result(reply)
+                self.queue.task_done()
+
+    def _store(self, paths):
+        '''move the spooled messages to their raw.mail, then insert their entries in one
+        transaction. Return the reply for each message'''
+        replies = []
+        entries = []
+        for path in paths:
+            try:
+                with open(path, 'rb') as fp:
+                    header = controller.read_header(fp)
+                msg = email.message_from_bytes(header)
+                if msg['message-id'] is None:
+                    raise ValueError("no Message-ID")
+                entry = controller.entry_from_header(msg)
+                directory = controller.message_directory(entry.message_id)
+                tools.makepath(directory)
+                os.replace(path, os.path.join(directory, 'raw.mail'))
+            except Exception as e: # pylint: disable=broad-except
+                logger.warning(F"rejecting a message: {e}")
+                replies.append(F"554 5.6.0 cannot store this message: {e}")
+                self._discard(path)
+                continue
+            logger.info(F"Storing incoming message >>{entry.subject}<< of {entry.email_from}")
+            entries.append(entry)
+            replies.append(F"250 2.0.0 <{entry.message_id}> stored")
+        if entries:
+            store_entries(entries)
+            self.commits += 1
+            self.stored += len(entries)
+        return replies
+
+    @staticmethod
+    def _discard(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    async def _read_data(self, reader):
+        '''spool the message after DATA, up to the line with the single dot, with \\n line
+        ends; return the path of the spool file, or None if it is bigger than [lmtp] max_size'''
+        path = os.path.join(self.spool, F"{os.getpid()}-{next(self.spooled)}")
+        size = 0
+        start_of_line = True
+        try:
+            with open(path, 'xb') as fp:
+                while True:
+                    try:
+                        line = await reader.readuntil(b'\n')
+                    except asyncio.LimitOverrunError as e:
+                        line = await reader.read(e.consumed)    # a piece of a very long line
+                    except asyncio.IncompleteReadError as e:
+                        raise ConnectionResetError("connection closed during DATA") from e
+                    if start_of_line:
+                        if line in (b'.\r\n', b'.\n'):
+                            break
+                        if line.startswith(b'.'):
+                            line = line[1:]
+                    start_of_line = line.endswith(b'\n')
+                    size += len(line)
+                    if size <= self.max_size:
+                        fp.write(line[:-2] + b'\n' if line.endswith(b'\r\n') else line)
+        except BaseException:
+            self._discard(path)
+            raise
+        if size > self.max_size:
+            self._discard(path)
+            return None
+        return path
+
+    async def _session(self, reader, writer):
+        def reply(*lines):
+            writer.write(''.join(line + '\r\n' for line in lines).encode())
+        greeted = False
+        sender = None
+        recipients = []
+        reply(F"220 {self.hostname} LMTP mail2blog ready")
+        try:
+            while True:
+                await writer.drain()
+                line = await reader.readline()
+                if not line:
+                    break
+                verb, _, argument = line.decode('utf-8', 'replace').rstrip('\r\n').partition(' ')
+                verb = verb.upper()
+                if verb == 'LHLO':
+                    greeted, sender, recipients = True, None, []
+                    reply(F"250-{self.hostname}", "250-PIPELINING", "250-ENHANCEDSTATUSCODES",
+                          "250-8BITMIME", F"250 SIZE {self.max_size}")
+                elif verb == 'MAIL':
+                    if not greeted:
+                        reply("503 5.5.1 LHLO first")
+                    elif sender is not None:
+                        reply("503 5.5.1 MAIL already given")
+                    else:
+                        sender = argument
+                        reply("250 2.1.0 OK")
+                elif verb == 'RCPT':
+                    if sender is None:
+                        reply("503 5.5.1 MAIL first")
+                    else:
+                        recipients.append(argument)
+                        reply("250 2.1.5 OK")
+                elif verb == 'DATA':
+                    if not recipients:
+                        reply("503 5.5.1 RCPT first")
+                        continue
+                    reply("354 end data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    path = await self._read_data(reader)
+                    if path is None:
+                        result = F"552 5.3.4 message bigger than {self.max_size} bytes"
+                    else:
+                        result = await self.deliver(path)
+                    # LMTP: one reply for every recipient
+                    reply(*[result] * len(recipients))
+                    sender, recipients = None, []
+                elif verb == 'RSET':
+                    sender, recipients = None, []
+                    reply("250 2.0.0 OK")
+                elif verb == 'NOOP':
+                    reply("250 2.0.0 OK")
+                elif verb == 'QUIT':
+                    reply("221 2.0.0 bye")
+                    break
+                elif verb in ('HELO', 'EHLO'):
+                    reply("500 5.5.1 this is LMTP, use LHLO")
+                else:
+                    reply("500 5.5.2 unknown command")
+            await writer.drain()
+        except ValueError:
+            reply("500 5.5.2 line too long")
+        except ConnectionError as e:
+            logger.info(F"LMTP connection lost: {e}")
+        finally:
+            writer.close()
+
+def main():
+    '''the mail2blog-lmtpd command'''
+    context.start()
+    asyncio.run(LMTPServer().serve())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,7 +8,6 @@
 import logging
 from logging.handlers import RotatingFileHandler
 
-from .parse_args import args
 from .config import CONFIG
 
 # logger = logging.getLogger(__name__)
@@ -23,8 +22,8 @@ class PathTruncatingFormatter(logging.Formatter):
         record.pathname = pathname
         return super(PathTruncatingFormatter, self).format(record)
 
-def setup_logging():
-    '''setup logging'''
+def setup_logging(args):
+    '''setup logging, as the command line args and the config say'''
 
     # Define Formatter
     formatter = logging.Formatter("[%(asctime)s]%(levelname)8s - %(message)s")
@@ -65,4 +64,4 @@ def setup_logging():
     werkzeug_log.addHandler(handler)
     return logger
 
-logger = setup_logging()
+# setup_logging() is called by context.start(), not on import
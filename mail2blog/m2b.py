@@ -13,14 +13,13 @@
 
 import logging
 import sys
-from mail2blog import logsetup
-
+from mail2blog import context
 from mail2blog.config import CONFIG
-from mail2blog.parse_args import args
 
 logger = logging.getLogger(__name__)
 
 def main():
+    args = context.start().args
     print ("YES")
     logger.warning("SHURE")
     if args.verbose:
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+'''Remember which inputs every generated file was built from'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import functools
+import hashlib
+import logging
+import os
+import time
+
+from mail2blog import db
+from mail2blog.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+def file_digest(path):
+    '''sha256 of a file. Templates and themes are hashed once per version of the file:
+    a resident process (--watch) picks up their changes'''
+    if path is None:
+        return 'none'
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 'missing'
+    return _file_digest(path, stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize=256)
+def _file_digest(path, mtime_ns, size):     # pylint: disable=unused-argument
+    try:
+        with open(path, 'rb') as fh:
+            return hashlib.sha256(fh.read()).hexdigest()
+    except OSError:
+        return 'missing'
+
+def config_digest(keys):
+    '''digest of a list of (section, option) config values'''
+    return digest(*[F"{section}.{option}={CONFIG.get(section, option, fallback=None)}"
+                    for section, option in keys])
+
+def digest(*parts):
+    '''sha256 over a list of strings and bytes'''
+    sha = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode('utf-8', 'surrogateescape')
+        sha.update(len(part).to_bytes(8, 'little'))
+        sha.update(part)
+    return sha.hexdigest()
+
+def theme_digest():
+    '''digest of all theme include files, with and without map'''
+    return digest(*[file_digest(CONFIG.get('themes', option, fallback=None)) for option in
+                    ('header_include', 'body_before_include', 'body_after_include',
+                     'header_include_no_map', 'body_before_include_no_map',
+                     'body_after_include_no_map')])
+
+class BuildManifest:
+    '''Input digests of generated files, kept in the build_manifest table
+
+    An output is current if it exists and was built from inputs with the same digest.
+    Outputs that already exist without a manifest entry (e.g. rendered before the manifest
+    existed) are adopted as current, just like the old "the file is there" check.'''
+    def is_current(self, output, input_digest, adopt=True):
+        if not os.path.exists(output):
+            return False
+        rows = db.query('''select digest from build_manifest where output=?''', (output,))
+        row = rows[0] if rows else None
+        if row is None and adopt:
+            logger.debug(F"adopting {output} into the build manifest")
+            self.record(output, input_digest)
+            return True
+        return row is not None and row[0] == input_digest
+
+    def record(self, output, input_digest):
+        with db.transaction() as cur:
+            cur.execute('''insert or replace into build_manifest values(?, ?, ?)''',
+                    (output, input_digest, time.time()))
+
+    def forget(self, output):
+        with db.transaction() as cur:
+            cur.execute('''delete from build_manifest where output=?''', (output,))
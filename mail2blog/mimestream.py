@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+'''Walk the parts of a MIME message from a file without loading it into memory'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# email.message_from_file() keeps every part, including a 200 MB video, as a string in
+# memory, and get_payload(decode=True) makes a decoded copy on top. walk() below reads the
+# message line by line (lines are cut at buffer_size) and hands out the parts one after the
+# other; their payload is decoded on the fly while it is copied to its destination.
+
+import binascii
+import email
+import logging
+
+from mail2blog.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = b' \t\r\n'
+
+def buffer_size():
+    return CONFIG.getint('mime', 'buffer_size', fallback = 2**20)
+
+class _LineReader:
+    '''readline() with a length limit and the possibility to push one line back'''
+    def __init__(self, fp, limit):
+        self.fp     = fp
+        self.limit  = max(limit, 1024)    # delimiter lines must never be cut
+        self.pushed = []
+        self.at_line_start = True
+
+    def readline(self):
+        '''return (line, starts_a_line)'''
+        if self.pushed:
+            return self.pushed.pop()
+        starts_a_line = self.at_line_start
+        line = self.fp.readline(self.limit)
+        self.at_line_start = line.endswith(b'\n')
+        return line, starts_a_line
+
+    def unread(self, line, starts_a_line):
+        self.pushed.append((line, starts_a_line))
+
+def _split_newline(line):
+    if line.endswith(b'\r\n'):
+        return line[:-2], b'\r\n'
+    if line.endswith(b'\n'):
+        return line[:-1], b'\n'
+    return line, b''
+
+def _boundary_of(line, starts_a_line, boundaries):
+    '''if line is a delimiter of one of the open multiparts, return (boundary, is_last)'''
+    if not starts_a_line or not line.startswith(b'--') or len(line) > 200:
+        return None
+    text = line.rstrip(WHITESPACE)
+    for boundary in reversed(boundaries):
+        if text == b'--' + boundary:
+            return boundary, False
+        if text == b'--' + boundary + b'--':
+            return boundary, True
+    return None
+
+class _Base64Decoder:
+    def __init__(self):
+        self.carry = b''
+
+    def feed(self, data):
+        data = self.carry + data.translate(None, WHITESPACE)
+        cut = len(data) // 4 * 4
+        self.carry = data[cut:]
+        return binascii.a2b_base64(data[:cut]) if cut else b''
+
+    def finish(self):
+        data, self.carry = self.carry, b''
+        if not data:
+            return b''
+        try:
+            return binascii.a2b_base64(data + b'=' * (-len(data) % 4))
+        except binascii.Error:
+            return b''
+
+class _QuotedPrintableDecoder:
+    def __init__(self):
+        self.carry = b''
+
+    def feed(self, data):
+        data = self.carry + data
+        cut = data.rfind(b'\n') + 1
+        self.carry = data[cut:]
+        return binascii.a2b_qp(data[:cut]) if cut else b''
+
+    def finish(self):
+        data, self.carry = self.carry, b''
+        return binascii.a2b_qp(data)
+
+class _Identity:
+    def feed(self, data):
+        return data
+
+    def finish(self):
+        return b''
+
+def _decoder_for(cte):
+    cte = str(cte or '').strip().lower()
+    if cte == 'base64':
+        return _Base64Decoder()
+    if cte == 'quoted-printable':
+        return _QuotedPrintableDecoder()
+    return _Identity()
+
+class StreamedPart:
+    '''A MIME part whose headers are parsed and whose payload is still in the file
+
+    It offers the parts of the email.message.Message interface that the renderers use.
+    The payload can be read once, and only until walk() moves on to the next part.'''
+    def __init__(self, headers, chunks=None):
+        self.headers = headers
+        self._chunks = chunks
+
+    def __getattr__(self, name):
+        # get_content_maintype, get_content_charset, get_filename, ... come from the headers
+        return getattr(self.headers, name)
+
+    def __getitem__(self, name):
+        return self.headers[name]
+
+    def is_multipart(self):
+        return self.headers.get_content_maintype() in ('multipart', 'message')
+
+    def iter_payload(self):
+        '''the decoded payload, chunk by chunk'''
+        chunks, self._chunks = self._chunks, None
+        if chunks is None:
+            return
+        decoder = _decoder_for(self.headers['content-transfer-encoding'])
+        for chunk in chunks:
+            data = decoder.feed(chunk)
+            if data:
+                yield data
+        data = decoder.finish()
+        if data:
+            yield data
+
+    def get_payload(self, decode=False):
+        if self.is_multipart():
+            return None
+        if not decode:
+            raise ValueError("streamed parts can only return the decoded payload")
+        return b''.join(self.iter_payload())
+
+    def save_payload(self, fp):
+        '''write the decoded payload to a binary file, return the number of bytes written'''
+        size = 0
+        for data in self.iter_payload():
+            fp.write(data)
+            size += len(data)
+        return size
+
+    def drain(self):
+        for _ in self.iter_payload():
+            pass
+
+def _read_headers(reader, boundaries):
+    lines = []
+    while True:
+        line, starts_a_line = reader.readline()
+        if not line:
+            break
+        if _boundary_of(line, starts_a_line, boundaries):
+            reader.unread(line, starts_a_line)
+            break
+        if starts_a_line and line in (b'\n', b'\r\n'):
+            break
+        lines.append(line)
+    return email.message_from_bytes(b''.join(lines))
+
+def _body_lines(reader, boundaries):
+    '''yield the raw body of a part up to (not including) the next delimiter line'''
+    pending_newline = b''
+    while True:
+        line, starts_a_line = reader.readline()
+        if not line:
+            if pending_newline:
+                yield pending_newline
+            return
+        if _boundary_of(line, starts_a_line, boundaries):
+            # the newline in front of a delimiter belongs to the delimiter
+            reader.unread(line, starts_a_line)
+            return
+        text, newline = _split_newline(line)
+        if pending_newline or text:
+            yield pending_newline + text
+        pending_newline = newline
+
+def _skip_to_delimiter(reader, boundaries):
+    '''skip preamble or epilogue; return the (boundary, is_last) that ended it, or None'''
+    while True:
+        line, starts_a_line = reader.readline()
+        if not line:
+            return None
+        found = _boundary_of(line, starts_a_line, boundaries)
+        if found:
+            return found
+
+def _walk_entity(reader, boundaries):
+    headers = _read_headers(reader, boundaries)
+    maintype = headers.get_content_maintype()
+    if maintype == 'multipart' and headers.get_boundary():
+        yield StreamedPart(headers)
+        boundary = headers.get_boundary().encode('ascii', 'replace')
+        inner = boundaries + [boundary]
+        found = _skip_to_delimiter(reader, inner)
+        while found and found[0] == boundary and not found[1]:
+            yield from _walk_entity(reader, inner)
+            found = _skip_to_delimiter(reader, inner)
+        if found and found[0] != boundary:
+            # delimiter of an enclosing multipart: not ours to consume
+            reader.unread(b'--' + found[0] + (b'--' if found[1] else b'') + b'\n', True)
+        elif found:
+            # skip the epilogue up to the next delimiter of an enclosing multipart
+            found = _skip_to_delimiter(reader, boundaries)
+            if found:
+                reader.unread(b'--' + found[0] + (b'--' if found[1] else b'') + b'\n', True)
+    elif maintype == 'message' and headers.get_content_subtype() == 'rfc822':
+        yield StreamedPart(headers)
+        yield from _walk_entity(reader, boundaries)
+    else:
+        part = StreamedPart(headers, _body_lines(reader, boundaries))
+        yield part
+        part.drain()
+
+def walk(fp, limit=None):
+    '''yield all parts of the message in the binary file fp, like email.message.Message.walk()
+
+    Every leaf part must be used (or ignored) before the next one is requested.'''
+    reader = _LineReader(fp, limit or buffer_size())
+    yield from _walk_entity(reader, [])
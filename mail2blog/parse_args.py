@@ -12,8 +12,8 @@ import argparse
 
 logger = logging.getLogger(__name__)
 
-def parseOptions():
-    '''Parse the commandline options'''
+def parseOptions(argv=None):
+    '''Parse the commandline options: argv, or sys.argv[1:] if it is None'''
 
     folder_of_executable = os.path.split(sys.argv[0])[0]
     # basename = os.path.basename(sys.argv[0]).rstrip('.py')
@@ -46,12 +46,25 @@ def parseOptions():
     parser.add_argument('--verbose',  '-v'  ,default=False, action="store_true")
     parser.add_argument('--nopix',           default=False, action="store_true")
     parser.add_argument('--force',    '-f',  default=False, action="store_true")
+    parser.add_argument('--offline',         default=False, action="store_true",
+                                             help='don\'t contact the IMAP server, render what is local')
+    parser.add_argument('--watch',           default=False, action="store_true",
+                                             help='stay in IMAP IDLE and publish new mails as they arrive')
+    parser.add_argument('--jobs',     '-j',  default=1, type=int,
+                                             help='render articles in this many processes')
+    parser.add_argument('--profile',         default=0, type=int, metavar='N',
+                                             help='keep cProfile data of the N slowest articles')
+    parser.add_argument('command',  nargs='?', default='render', choices=['render', 'search'],
+                                             help='render the blog (default) or search it')
+    parser.add_argument('words',    nargs='*', help='search: words the articles must contain, '
+                                                    'word* for a prefix')
     # parser.add_argument(dest='target_file'   ,default=None,
     #         nargs='*', help='Just an example')
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     return args
 
-# reparse args on import
-args = parseOptions()
+def defaults():
+    '''the options of a command line without any arguments'''
+    return parseOptions([])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+'''Size-bounded on-disk cache of raw messages downloaded from IMAP'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import logging
+import os
+import threading
+import time
+import urllib.parse
+
+from mail2blog import db
+from mail2blog import timing
+from mail2blog import tools
+from mail2blog.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Message-IDs come from whoever sent the mail. Their directory name keeps the characters
+# RFC 5322 allows in an id, except '/' and '%', which are %-escaped like everything else.
+SAFE_CHARACTERS = "@!#$&'*+-=?^_`{|}~."
+
+def message_directory(message_id, directory=None):
+    '''<raw_output>/<message_id>, where the raw.mail of a message goes
+
+    Raise ValueError for a Message-ID that would not name a directory inside raw_output'''
+    if directory is None:
+        directory = CONFIG.get('locations', 'raw_output', fallback='/tmp/mail2blog')
+    name = urllib.parse.quote(message_id, safe=SAFE_CHARACTERS)
+    path = os.path.join(directory, name)
+    if name in ('', '.', '..') or \
+            os.path.dirname(os.path.realpath(path)) != os.path.realpath(directory):
+        raise ValueError(F"unusable Message-ID: {message_id!r}")
+    return path
+
+class RawMessageCache:
+    '''Keep raw RFC822 messages in the raw_output layout that controller.parse_mail writes:
+    <raw_output>/<message_id>/raw.mail (see message_directory)
+
+    Only files written by the cache are tracked in the raw_cache table and evicted
+    (least recently used first) once they exceed [cache] raw_max_bytes.
+    Mails delivered via controller.parse_mail are never evicted.'''
+    def __init__(self):
+        self.directory = CONFIG.get('locations', 'raw_output', fallback='/tmp/mail2blog')
+        self.max_bytes = CONFIG.getint('cache', 'raw_max_bytes', fallback = 2**30)
+
+    def path(self, message_id):
+        return os.path.join(message_directory(message_id, self.directory), 'raw.mail')
+
+    def touch(self, message_id):
+        '''return the path of the cached message and mark it as used, or None'''
+        path = self.path(message_id)
+        if not os.path.exists(path):
+            return None
+        with db.transaction() as cur:
+            cur.execute('''update raw_cache set last_used=? where message_id=?''',
+                    (time.time(), message_id))
+        logger.debug(F"raw cache hit: {message_id}")
+        return path
+
+    def store(self, message_id, write):
+        '''write(fp) downloads the raw message into the binary file fp and returns its uid.
+        Return (uid, path) of the stored message and evict old ones if the cache grew too big.
+
+        The message itself is always kept until the next store(), even with a
+        raw_max_bytes of 0, because the renderer reads it from this file.'''
+        path = self.path(message_id)
+        tools.makepath(os.path.dirname(path))
+        temp_path = F"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with timing.stage('body_fetch', message_id) as stage, open(temp_path, 'wb') as fp:
+                uid  = write(fp)
+                size = stage.bytes = fp.tell()
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        with db.transaction() as cur:
+            cur.execute('''insert or replace into raw_cache values(?, ?, ?, ?)''',
+                    (message_id, uid, size, time.time()))
+            self._evict(cur, keep=message_id)
+        return uid, path
+
+    def _evict(self, cur, keep=None):
+        cur.execute('''select sum(size) from raw_cache''')
+        total = cur.fetchone()[0] or 0
+        if total <= self.max_bytes:
+            return
+        cur.execute('''select message_id, size from raw_cache order by last_used''')
+        evicted = []
+        for message_id, size in cur.fetchall():
+            if total <= self.max_bytes:
+                break
+            if message_id == keep:
+                continue
+            try:
+                path = self.path(message_id)
+                os.remove(path)
+                os.rmdir(os.path.dirname(path))
+            except (OSError, ValueError):
+                pass
+            evicted.append((message_id,))
+            total -= size
+        logger.info(F"raw cache: evicted {len(evicted)} messages")
+        cur.executemany('''delete from raw_cache where message_id=?''', evicted)
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+'''Turn markdown pages into themed html files, many pages per pandoc process'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+from mail2blog import timing
+from mail2blog import tools
+from mail2blog.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Runs inside "pandoc lua". Every line of the job file holds the tab separated paths of
+# markdown, title, header include, before body include, after body include and output.
+# This is the same conversion as "pandoc -s --metadata=title:... --include-*", but the
+# pandoc startup cost is paid once per batch instead of once per page.
+BATCH_SCRIPT = r'''
+local function slurp(path)
+  if path == '' then return '' end
+  local fh = assert(io.open(path, 'rb'))
+  local data = fh:read('a')
+  fh:close()
+  return data
+end
+local template = pandoc.template.compile(pandoc.template.default('html'))
+for line in io.lines(arg[1]) do
+  local f = {}
+  for field in (line .. '\t'):gmatch('([^\t]*)\t') do table.insert(f, field) end
+  local ok, err = pcall(function()
+    local doc = pandoc.read(slurp(f[1]), 'markdown')
+    doc.meta.title = slurp(f[2])
+    local html = pandoc.write(doc, 'html', {template = template, variables = {
+        ['header-includes'] = slurp(f[3]),
+        ['include-before']  = slurp(f[4]),
+        ['include-after']   = slurp(f[5])}})
+    local fh = assert(io.open(f[6], 'wb'))
+    fh:write(html)
+    fh:close()
+  end)
+  if not ok then io.stderr:write(f[6] .. ': ' .. tostring(err) .. '\n') end
+end
+'''
+
+def batch_supported():
+    '''"pandoc lua" and pandoc.template came with pandoc 3'''
+    import pypandoc
+    try:
+        return int(pypandoc.get_pandoc_version().split('.')[0]) >= 3
+    except (OSError, ValueError):
+        return False
+
+class PandocRenderer:
+    '''Render pages through pandoc, in batches of [tools] pandoc_batch_size pages
+
+    With a batch size of 1 (or a pandoc older than 3) every page gets its own pandoc
+    process, exactly as tools.render_pandoc_with_theme does. Otherwise pages are queued
+    by submit() and written when the batch is full or on flush(). A page of a batch that
+    can't be written is logged and listed in failed; the other pages are not affected.'''
+    def __init__(self, batch_size=None):
+        if batch_size is None:
+            batch_size = CONFIG.getint('tools', 'pandoc_batch_size', fallback = 50)
+        if batch_size > 1 and not batch_supported():
+            logger.warning("pandoc is too old for batch rendering => one process per page")
+            batch_size = 1
+        self.batch_size = batch_size
+        self.jobs       = []
+        self.workdir    = None
+        self.failed     = []     # output files of batched pages that could not be written
+
+    def submit(self, markdown, output_file, title="Title", gpx_data=False, geolocation=False,
+               done=None, failed=None):
+        '''render markdown to output_file. done() is called once the file is written,
+        failed() if it could not be written in a batch'''
+        if self.batch_size <= 1:
+            html_data = tools.render_pandoc_with_theme(markdown, title=title,
+                    geolocation=geolocation, gpx_data=gpx_data)
+            self._write(output_file, html_data)
+            if done is not None:
+                done()
+            return
+
+        if self.workdir is None:
+            temp_dir = CONFIG.get('locations', 'temp_output', fallback = '/tmp')
+            tools.makepath(temp_dir, 1)
+            self.workdir = tempfile.mkdtemp(prefix='pandoc-batch-', dir=temp_dir)
+        job = os.path.join(self.workdir, str(len(self.jobs)))
+        header, before, after = tools.theme_includes(geo=bool(geolocation or gpx_data))
+        if geolocation or gpx_data:
+            after = job + '.geo'
+            with open(after, 'w', encoding='utf-8') as fh:
+                fh.write(tools.geo_include(gpx_data, geolocation))
+        with open(job + '.md', 'w', encoding='utf-8') as fh:
+            fh.write(markdown)
+        with open(job + '.title', 'w', encoding='utf-8') as fh:
+            fh.write(str(title))
+        self.jobs.append(dict(paths=[job + '.md', job + '.title', header or '', before or '',
+                                     after or '', job + '.html'],
+                              output_file=output_file, title=title, done=done,
+                              failed=failed))
+        if len(self.jobs) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''render all queued pages'''
+        if not self.jobs:
+            return
+        jobs, self.jobs = self.jobs, []
+        workdir, self.workdir = self.workdir, None
+        try:
+            job_file    = os.path.join(workdir, 'jobs')
+            script_file = os.path.join(workdir, 'batch.lua')
+            with open(job_file, 'w') as fh:
+                for job in jobs:
+                    fh.write('\t'.join(job['paths']) + '\n')
+            with open(script_file, 'w') as fh:
+                fh.write(BATCH_SCRIPT)
+
+            logger.info(F"rendering {len(jobs)} pages with one pandoc process")
+            import pypandoc
+            try:
+                with timing.subprocess('pandoc'):
+                    res = subprocess.run([pypandoc.get_pandoc_path(), 'lua', script_file,
+                                          job_file], stdout=subprocess.PIPE,
+                                         stderr=subprocess.PIPE, check=False)
+                if res.returncode != 0 or res.stderr:
+                    logger.error(F"pandoc batch: {res.stderr.decode(errors='replace')}")
+            except OSError as e:
+                logger.error(F"pandoc batch: {e}")
+
+            for job in jobs:
+                self._finish(job)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def _finish(self, job):
+        '''write the output file of a page of the batch, and tell its submitter'''
+        try:
+            html_file = job['paths'][-1]
+            if os.path.exists(html_file):
+                with open(html_file, 'r', encoding='utf-8') as fh:
+                    self._write(job['output_file'], fh.read())
+            else:
+                # render the page on its own, so its error shows up in the log
+                self._write(job['output_file'], self._render_single(job))
+            if job['done'] is not None:
+                job['done']()
+        except Exception as e:
+            logger.error(F"Could not render {job['output_file']}: {e.__class__.__name__}: {e}")
+            self.failed.append(job['output_file'])
+            if job['failed'] is not None:
+                job['failed']()
+
+    @staticmethod
+    def _render_single(job):
+        markdown_file, _, header, before, after, _ = job['paths']
+        pandoc_args = ['-s', F"--metadata=title:{job['title']}",
+                F'--include-in-header={header}',
+                F'--include-before-body={before}',
+                F'--include-after-body={after}']
+        import pypandoc
+        with timing.subprocess('pandoc'):
+            return pypandoc.convert_file(markdown_file, 'html', format='md',
+                                         extra_args=pandoc_args)
+
+    @staticmethod
+    def _write(output_file, html_data):
+        logger.debug(F"saving html to {output_file}")
+        with open(output_file, 'w') as fp:
+            fp.write(html_data)
+        os.chmod(output_file, 0o644)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+'''Full-text search of the articles: FTS5 in the database, and a static index for readers'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# The text of every article (without internal header and footer) is put into the FTS5 table
+# article_text when the article is rendered. "mail2blog search words..." queries it.
+#
+# For readers, the index is also written as static json to [locations] blog_output/search:
+#   terms-<prefix>.json  {term: [doc, ...]} of all terms starting with prefix, where prefix
+#                        is the first [search] prefix_length characters of a term. The docs
+#                        are ascending, each given as the difference to the one before
+#   docs-<n>.json        [[link, subject, date], ...] of docs n * DOCS_PER_FILE ...
+#   search.js            search(query) => Promise of [{link, subject, date}], newest first
+# so a browser fetches one small terms file per word and the docs files of the hits, not one
+# file with everything. Terms are the ones FTS5 made (lowercase, without diacritics), docs are
+# the numbers article_doc gave the articles, which never change, so a new post only touches
+# the files it is in.
+# A page can use it with <script src="search/search.js"></script>.
+
+import json
+import logging
+import os
+import sqlite3
+
+from mail2blog import db
+from mail2blog import manifest
+from mail2blog import tools
+from mail2blog.config import CONFIG
+from mail2blog.manifest import BuildManifest
+
+logger = logging.getLogger(__name__)
+
+DOCS_PER_FILE = 500
+
+SEARCH_JS = '''// generated by mail2blog, see mail2blog/search.py
+(function () {
+    var base = document.currentScript ? document.currentScript.src.replace(/[^\\/]*$/, '') : '';
+    var PREFIX_LENGTH = %(prefix_length)d, DOCS_PER_FILE = %(docs_per_file)d;
+    var cache = {};
+    function load(name) {
+        if (!(name in cache)) {
+            cache[name] = fetch(base + name).then(function (r) { return r.ok ? r.json() : {}; });
+        }
+        return cache[name];
+    }
+    function fileName(prefix) {
+        var name = '';
+        for (var c of prefix) {
+            name += /[a-z0-9]/.test(c) ? c : '_' + c.codePointAt(0).toString(16);
+        }
+        return name;
+    }
+    function words(query) {
+        return (query.normalize('NFD').replace(/\\p{M}/gu, '').toLowerCase()
+                .match(/[\\p{L}\\p{N}]+/gu) || []);
+    }
+    function docsOf(word) {
+        // every word is a prefix: "hik" finds "hike" and "hiking"
+        return load('terms-' + fileName([...word].slice(0, PREFIX_LENGTH).join('')) + '.json')
+            .then(function (terms) {
+                var docs = {};
+                for (var term in terms) {
+                    if (term.startsWith(word)) {
+                        var doc = 0;
+                        terms[term].forEach(function (delta) { doc += delta; docs[doc] = true; });
+                    }
+                }
+                return docs;
+            });
+    }
+    window.search = function (query) {
+        var list = words(query);
+        if (!list.length) { return Promise.resolve([]); }
+        return Promise.all(list.map(docsOf)).then(function (sets) {
+            var hits = Object.keys(sets[0]).filter(function (doc) {
+                return sets.every(function (set) { return doc in set; });
+            }).map(Number);
+            hits.sort(function (a, b) { return b - a; });
+            return Promise.all(hits.map(function (doc) {
+                return load('docs-' + Math.floor(doc / DOCS_PER_FILE) + '.json').then(
+                    function (docs) { return docs[doc %% DOCS_PER_FILE]; });
+            })).then(function (docs) {
+                return docs.filter(Boolean).map(function (d) {
+                    return {link: d[0], subject: d[1], date: d[2]};
+                });
+            });
+        });
+    };
+})();
+'''
+
+def available():
+    '''FTS5 is compiled into almost every sqlite, but it is optional'''
+    return bool(db.query('''select 1 from sqlite_master where name='article_text' '''))
+
+def index_article(message_id, subject, text):
+    '''(re)index the text of an article. Its rowid is its doc number in article_doc'''
+    if not available():
+        return
+    with db.transaction() as cur:
+        cur.execute('''select 1 from mail2blog where message_id=?''', (message_id,))
+        if cur.fetchone() is None:
+            logger.warning(F"not indexing {message_id}: not in the database")
+            return
+        cur.execute('''insert or ignore into article_doc(message_id) values(?)''', (message_id,))
+        cur.execute('''select doc from article_doc where message_id=?''', (message_id,))
+        doc = cur.fetchone()[0]
+        cur.execute('''delete from article_text where rowid=?''', (doc,))
+        cur.execute('''insert into article_text(rowid, message_id, subject, body) '''
+                '''values(?, ?, ?, ?)''', (doc, message_id, str(subject), text))
+        cur.execute('''update search_state set generation=generation+1''')
+
+def prune():
+    '''drop the text of articles that are no longer in mail2blog'''
+    if not available():
+        return
+    with db.transaction() as cur:
+        cur.execute('''delete from article_doc where message_id not in '''
+                '''(select message_id from mail2blog)''')
+        cur.execute('''delete from article_text where rowid not in (select doc from article_doc)''')
+        if cur.rowcount:
+            cur.execute('''update search_state set generation=generation+1''')
+
+def fts_query(words):
+    '''an FTS5 query for articles containing all words. Every word is quoted, so that
+    nothing in it is taken for FTS5 syntax; a trailing * makes a word a prefix'''
+    terms = []
+    for word in words:
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' '.join(terms)
+
+def search(words, limit=20):
+    '''the best matching articles as dicts of message_id, subject, date, link and snippet'''
+    query = fts_query(words)
+    if not query or not available():
+        return []
+    return db.query('''select article_text.message_id as message_id, '''
+            '''mail2blog.subject as subject, mail2blog.date as date, mail2blog.link as link, '''
+            '''snippet(article_text, 2, '[', ']', '...', 12) as snippet '''
+            '''from article_text join mail2blog '''
+            '''on mail2blog.message_id=article_text.message_id '''
+            '''where article_text match ? order by bm25(article_text) limit ?''',
+            (query, limit), row_factory=db.dict_factory)
+
+def main(words):
+    '''the "mail2blog search" command'''
+    if not available():
+        logger.error("this sqlite has no FTS5 => no search")
+        return 1
+    try:
+        results = search(words, CONFIG.getint('search', 'results', fallback = 20))
+    except sqlite3.OperationalError as e:
+        logger.error(F"search failed: {e}")
+        return 1
+    for row in results:
+        snippet = ' '.join(row['snippet'].split())
+        print(F"{tools.format_date(row['date'])} | {row['subject']} | {row['link']}\n    {snippet}")
+    if not results:
+        print("nothing found")
+    return 0
+
+def _file_name(prefix):
+    return ''.join(c if c.isascii() and c.isalnum() else F"_{ord(c):x}" for c in prefix)
+
+class StaticIndex:
+    '''The sharded json index in [locations] blog_output/search'''
+    def __init__(self, force=False):
+        self.force = force
+        self.output = os.path.join(CONFIG.get('locations', 'blog_output'), 'search')
+        self.prefix_length = max(1, CONFIG.getint('search', 'prefix_length', fallback = 2))
+        self.manifest = BuildManifest()
+
+    def _files(self):
+        '''{file name: content} of the whole index'''
+        # the instances come ordered by term and doc
+        terms = {}
+        for term, doc in db.query('''select term, doc from article_vocab'''):
+            docs = terms.get(term)
+            if docs is None:
+                terms[term] = [doc]
+            elif docs[-1] != doc:
+                docs.append(doc)
+        shards = {}
+        for term, docs in terms.items():
+            # doc numbers as differences to the previous one: much shorter for common words
+            shards.setdefault(_file_name(term[:self.prefix_length]), {})[term] = \
+                    [docs[0]] + [b - a for a, b in zip(docs, docs[1:])]
+        files = {F"terms-{name}.json": json.dumps(shard, ensure_ascii=False, separators=(',', ':'))
+                 for name, shard in shards.items()}
+
+        docs = {}
+        for doc, link, subject, date in db.query('''select doc, link, subject, date '''
+                '''from article_doc join mail2blog on mail2blog.message_id=article_doc.message_id '''
+                '''where doc in (select rowid from article_text)'''):
+            chunk = docs.setdefault(doc // DOCS_PER_FILE, [None] * DOCS_PER_FILE)
+            chunk[doc % DOCS_PER_FILE] = [link, subject, tools.format_date(date)]
+        for number, chunk in docs.items():
+            files[F"docs-{number}.json"] = json.dumps(chunk, ensure_ascii=False,
+                                                      separators=(',', ':'))
+        files['search.js'] = SEARCH_JS % {'prefix_length': self.prefix_length,
+                                          'docs_per_file': DOCS_PER_FILE}
+        return files
+
+    def write(self):
+        '''bring the index up to date; return the names of the files that were written'''
+        if not available():
+            return []
+        generation = db.query('''select generation from search_state''')[0][0]
+        index_digest = manifest.digest(generation, self.prefix_length, DOCS_PER_FILE, SEARCH_JS)
+        if not self.force and self.manifest.is_current(self.output, index_digest, adopt=False):
+            logger.info("search index is up to date")
+            return []
+        tools.makepath(self.output)
+        files = self._files()
+        written = []
+        for name, content in files.items():
+            path = os.path.join(self.output, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as fh:
+                    if fh.read() == content:
+                        continue
+            except FileNotFoundError:
+                pass
+            with open(path, 'w', encoding='utf-8') as fh:
+                fh.write(content)
+            os.chmod(path, 0o644)
+            written.append(name)
+        for name in os.listdir(self.output):
+            if name not in files:
+                os.remove(os.path.join(self.output, name))
+        self.manifest.record(self.output, index_digest)
+        logger.info(F"search index: {len(written)} of {len(files)} files written")
+        return written
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+'''One jinja environment for all templates'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import logging
+import os
+
+from mail2blog.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+_environment = None
+
+def _load_template(name):
+    '''template names are the options of the [templates] config section, e.g. "article"'''
+    path = CONFIG.get('templates', name)
+    with open(path, 'r') as fh:
+        source = fh.read()
+    mtime = os.path.getmtime(path)
+    return source, path, lambda: os.path.exists(path) and os.path.getmtime(path) == mtime
+
+def environment():
+    '''the process-wide environment. Compiled templates are kept in memory, and their
+    bytecode on disk in [cache] jinja_bytecode (default: a per-user temp directory).
+    jinja2 is imported here, so runs that render nothing don't pay for it'''
+    global _environment
+    if _environment is None:
+        from jinja2 import Environment, FunctionLoader, FileSystemBytecodeCache
+        directory = CONFIG.get('cache', 'jinja_bytecode', fallback = None)
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        _environment = Environment(loader=FunctionLoader(_load_template),
+                                   bytecode_cache=FileSystemBytecodeCache(directory))
+    return _environment
+
+def get_template(name):
+    return environment().get_template(name)
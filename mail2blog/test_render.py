@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-'''Load entries and make a nice view'''
+'''Render a markdown snippet with the theme'''
 # pylint
 # vim: tw=100 foldmethod=indent
 #
@@ -11,22 +11,25 @@
 # pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
 
 import logging
-import sys
 import os
-import re
-import subprocess
-from jinja2 import Template
 
-from mail2blog import logsetup
+from mail2blog import context
 from mail2blog import tools 
-from mail2blog.parse_args import args
 from mail2blog.config import CONFIG
-from mail2blog.database import Blog_entry, Blog
 
 logger = logging.getLogger(__name__)
 
-md = "# this is a title\n- list1\n- list2\n\ntext text text"
+THEMES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'themes')
 
-html = tools.render_pandoc_with_theme2(md)
+md = "# this is a title\n- list1\n- list2\n\ntext text text"
 
-print (html)
+def test_render_pandoc_with_theme():
+    context.activate(context.AppContext())
+    CONFIG.read_dict({'themes': {option: os.path.join(THEMES, option + '.html') for option in
+                                 ('header_include_no_map', 'body_before_include_no_map',
+                                  'body_after_include_no_map')}})
+    html = tools.render_pandoc_with_theme(md, title='a title')
+    assert '<title>a title</title>' in html
+    assert 'this is a title</h1>' in html
+    assert '<li>list1</li>' in html and '<li>list2</li>' in html
+    assert '<p>text text text</p>' in html
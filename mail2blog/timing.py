@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+'''Where the time of a run goes: per stage, per article, and in subprocesses'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# The code marks its stages with
+#
+#     with timing.stage('walker', message_id) as stage:
+#         ...
+#         stage.bytes = size
+#
+# Recording is on for a run if [timing] report (a JSON file), [timing] prometheus (a file for
+# the textfile collector of the node exporter, e.g. /var/lib/node_exporter/mail2blog.prom)
+# or --profile N is given. Otherwise stage() returns one shared object that does nothing.
+# With --profile N every article is rendered under cProfile; the profiles of the N slowest
+# go to [timing] profile_output (default: temp_output/profile), for python -m pstats.
+#
+# Pages rendered in a pandoc batch (see renderbackend.py) are timed as one "pandoc" subprocess
+# of the batch, not as part of their article.
+
+import contextlib
+import heapq
+import json
+import logging
+import marshal
+import os
+import time
+import urllib.parse
+
+from mail2blog.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+_recorder = None
+
+class _NullStage:
+    '''what stage() returns while nothing is recorded'''
+    __slots__ = ('bytes',)
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        return False
+
+_NULL_STAGE = _NullStage()
+
+class _Stage:
+    __slots__ = ('recorder', 'kind', 'name', 'article', 'bytes', 'start')
+    def __init__(self, recorder, kind, name, article):
+        self.recorder = recorder
+        self.kind     = kind
+        self.name     = name
+        self.article  = article
+        self.bytes    = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        # list.append is atomic: stages of the download threads need no lock
+        self.recorder.events.append((self.kind, self.name, self.article,
+                                     time.perf_counter() - self.start, self.bytes))
+        return False
+
+class Recorder:
+    '''The events of one run, and the profiles of its slowest articles'''
+    def __init__(self, profile=0):
+        self.profile  = profile
+        self.events   = []       # (kind, name, article, seconds, bytes)
+        self.profiles = []       # heap of (seconds, article, pstats data)
+        self.started  = time.time()
+        self.start    = time.perf_counter()
+
+    def stage(self, name, article=None, kind='stage'):
+        return _Stage(self, kind, name, article)
+
+    @contextlib.contextmanager
+    def article(self, article):
+        profiler = None
+        if self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            seconds = time.perf_counter() - start
+            self.events.append(('stage', 'article', article, seconds, None))
+            if profiler is not None:
+                profiler.create_stats()
+                self.keep_profile(seconds, article, profiler.stats)
+
+    def keep_profile(self, seconds, article, stats):
+        item = (seconds, article, stats)
+        if len(self.profiles) < self.profile:
+            heapq.heappush(self.profiles, item)
+        elif seconds > self.profiles[0][0]:
+            heapq.heapreplace(self.profiles, item)
+
+    def drain(self):
+        '''hand the events and profiles recorded so far to the parent process'''
+        events, profiles = self.events, self.profiles
+        self.events, self.profiles = [], []
+        return events, profiles
+
+    def merge(self, events, profiles):
+        self.events.extend(events)
+        for seconds, article, stats in profiles:
+            self.keep_profile(seconds, article, stats)
+
+    def report(self):
+        '''the JSON run report'''
+        stages, subprocesses, articles = {}, {}, {}
+        for kind, name, article, seconds, size in self.events:
+            total = (subprocesses if kind == 'subprocess' else stages).setdefault(
+                    name, {'count': 0, 'seconds': 0.0, 'bytes': 0})
+            total['count']   += 1
+            total['seconds'] += seconds
+            total['bytes']   += size or 0
+            if article is not None:
+                per_article = articles.setdefault(article, {'seconds': 0.0, 'stages': {},
+                                                            'bytes': {}})
+                if name == 'article':
+                    per_article['seconds'] += seconds
+                else:
+                    per_article['stages'][name] = per_article['stages'].get(name, 0) + seconds
+                    if size:
+                        per_article['bytes'][name] = per_article['bytes'].get(name, 0) + size
+        return {'started': self.started, 'seconds': time.perf_counter() - self.start,
+                'stages': stages, 'subprocesses': subprocesses, 'articles': articles}
+
+    def prometheus(self, report):
+        '''the report in the text format of the textfile collector'''
+        lines = []
+        def metric(name, kind, text, samples):
+            if not samples:
+                return
+            lines.append(F"# HELP mail2blog_{name} {text}")
+            lines.append(F"# TYPE mail2blog_{name} {kind}")
+            for labels, value in samples:
+                lines.append(F"mail2blog_{name}{labels} {value}")
+        for group, label in (('stages', 'stage'), ('subprocesses', 'command')):
+            totals = sorted(report[group].items())
+            prefix = 'stage' if group == 'stages' else 'subprocess'
+            metric(F"{prefix}_seconds", 'gauge', F"seconds per {label} in the last run",
+                   [(F'{{{label}="{name}"}}', total['seconds']) for name, total in totals])
+            metric(F"{prefix}_calls", 'gauge', F"calls per {label} in the last run",
+                   [(F'{{{label}="{name}"}}', total['count']) for name, total in totals])
+            metric(F"{prefix}_bytes", 'gauge', F"bytes per {label} in the last run",
+                   [(F'{{{label}="{name}"}}', total['bytes']) for name, total in totals
+                    if total['bytes']])
+        metric('articles', 'gauge', 'articles rendered in the last run',
+               [('', len([a for a in report['articles'].values() if a['seconds']]))])
+        metric('run_seconds', 'gauge', 'duration of the last run', [('', report['seconds'])])
+        metric('last_run_timestamp_seconds', 'gauge', 'start of the last run',
+               [('', report['started'])])
+        return '\n'.join(lines) + '\n'
+
+    def write_profiles(self, directory):
+        '''one .prof file per kept profile, slowest first; their list for the report.
+        The file is named after the Message-ID like its directory in raw_output, cut short
+        to stay within the limits of the file system; the rank keeps the names apart'''
+        from mail2blog.rawcache import SAFE_CHARACTERS
+        os.makedirs(directory, exist_ok=True)
+        written  = []
+        profiles = sorted(self.profiles, key=lambda item: -item[0])
+        for rank, (seconds, article, stats) in enumerate(profiles):
+            name = urllib.parse.quote(str(article), safe=SAFE_CHARACTERS)[:200]
+            path = os.path.join(directory, F"{rank + 1:02d}-{name}.prof")
+            try:
+                with open(path, 'wb') as fh:
+                    marshal.dump(stats, fh)      # what cProfile.Profile.dump_stats writes
+            except OSError as e:
+                logger.warning(F"could not write the profile of {article}: {e}")
+                continue
+            written.append({'article': article, 'seconds': seconds, 'file': path})
+        return written
+
+def _write(path, data):
+    '''replace path at once: the textfile collector must never see half a file'''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'w', encoding='utf-8') as fh:
+        fh.write(data)
+    os.replace(path + '.tmp', path)
+
+def recording():
+    return _recorder is not None
+
+def stage(name, article=None):
+    '''time the with block as stage name, of article if given'''
+    if _recorder is None:
+        return _NULL_STAGE
+    return _recorder.stage(name, article)
+
+def subprocess(command, article=None):
+    '''time the with block as a run of the external command'''
+    if _recorder is None:
+        return _NULL_STAGE
+    return _recorder.stage(command, article, kind='subprocess')
+
+def article(message_id):
+    '''time (and with --profile profile) the rendering of one article'''
+    if _recorder is None:
+        return _NULL_STAGE
+    return _recorder.article(message_id)
+
+def start(profile=0):
+    '''record from now on; also in a --jobs worker, see drain()'''
+    global _recorder
+    _recorder = Recorder(profile)
+    return _recorder
+
+def drain():
+    '''([], []) unless recording'''
+    if _recorder is None:
+        return [], []
+    return _recorder.drain()
+
+def merge(events, profiles):
+    if _recorder is not None:
+        _recorder.merge(events, profiles)
+
+def finish():
+    '''stop recording; write the report, the prometheus file and the profiles'''
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is None:
+        return None
+    report = recorder.report()
+    if recorder.profile:
+        temp_output = CONFIG.get('locations', 'temp_output', fallback = '/tmp')
+        directory   = CONFIG.get('timing', 'profile_output',
+                                 fallback = os.path.join(temp_output, 'profile'))
+        report['profiles'] = recorder.write_profiles(directory)
+        for profile in report['profiles']:
+            print(F"{profile['seconds']:8.3f} s  {profile['article']}  {profile['file']}")
+    report_file = CONFIG.get('timing', 'report', fallback = None)
+    if report_file:
+        _write(report_file, json.dumps(report, indent=2, sort_keys=True))
+    prometheus_file = CONFIG.get('timing', 'prometheus', fallback = None)
+    if prometheus_file:
+        _write(prometheus_file, recorder.prometheus(report))
+    logger.info(F"run took {report['seconds']:.1f} s: " + ', '.join(
+        F"{name} {total['seconds']:.1f} s" for name, total in sorted(
+            report['stages'].items(), key=lambda item: -item[1]['seconds'])))
+    return report
+
+@contextlib.contextmanager
+def run(profile=0):
+    '''record the with block if [timing] report or prometheus, or profile, ask for it'''
+    if not (profile or CONFIG.get('timing', 'report', fallback = None)
+            or CONFIG.get('timing', 'prometheus', fallback = None)):
+        yield
+        return
+    start(profile)
+    try:
+        yield
+    finally:
+        finish()
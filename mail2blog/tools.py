@@ -10,15 +10,19 @@
 # pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
 
 import os
+import time
 import email
+import email.header
+import json
+import tempfile
 from datetime import datetime
-import pypandoc
 from html.entities import codepoint2name
 import logging
 
 logger = logging.getLogger(__name__)
 
 from mail2blog.config import CONFIG
+from mail2blog import timing
 
 def makepath(directory, depth=3):
     basepath = '/'.join(directory.split('/')[0:-depth])
@@ -41,6 +45,10 @@ def email_decode(value):
     '''Decode email encoding'''
     return email.header.make_header(email.header.decode_header(value))
 
+def format_date(epoch):
+    '''the date of an entry as shown in the blog'''
+    return time.strftime('%a %d.%m. %y', time.gmtime(epoch))
+
 def dateparser(text):
     for fmt in ('%a, %d %b %Y %H:%M:%S %z', '%m/%d/%y %H:%M', '%m/%d/%Y %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S'):
         try:
@@ -51,12 +59,8 @@ def dateparser(text):
     raise ValueError(F'no valid date format found: >>{text}<<')
 
 # >>Tue, 13 Jul 2021 10:52:08 +0200<<
-def render_pandoc_with_geolocation (inpt, title="Title", gpx_data=False, geolocation=False):
-    temp_dir                 = CONFIG.get('locations', 'temp_output', fallback      = '/tmp')
-    header_include_file      = CONFIG.get('themes', 'header_include', fallback      = None)
-    # body_after_include_file  = CONFIG.get('themes', 'body_after_include', fallback  = None)
-    body_after_include_file  = os.path.join(temp_dir, 'geo.tmp')
-    body_before_include_file = CONFIG.get('themes', 'body_before_include', fallback  = None)
+def geo_include(gpx_data=False, geolocation=False):
+    '''html with the map script, included after the body of pages with a map'''
     geo_data = F'''
         </article>
 
@@ -95,26 +99,18 @@ def render_pandoc_with_geolocation (inpt, title="Title", gpx_data=False, geoloca
         #     </script>'''
     if gpx_data: 
         logger.debug(F"got gpx_data")
-
-        geo_data += '''
+        from mail2blog import geometry  # numpy: only for pages with a map
+        if not isinstance(gpx_data, list):
+            gpx_data = geometry.encode_gpx(gpx_data)
+        # one encoded polyline per track segment, see geometry.encode_gpx
+        encoded = ',\n                '.join(json.dumps(polyline) for polyline in gpx_data)
+        geo_data += F'''
             <script>
-            <!--gpx_data-->
+            <!--gpx_data-->{geometry.DECODE_POLYLINE_JS}
             var latlngs = [
-            '''
-        is_first = True
-        for track in gpx_data.tracks:
-            for segment in track.segments:
-                # print("new segment")
-                for point in segment.points:
-                    if not is_first:
-                        geo_data += ",\n"
-                    if is_first:
-                        is_first=False
-                    geo_data += F"[{point.latitude}, {point.longitude}]"
-
-        geo_data += '''
-            ];
-            var polyline = L.polyline(latlngs, {color: 'red'}).addTo(mymap);
+                {encoded}
+            ].map(decodePolyline);
+            var polyline = L.polyline(latlngs, {{color: 'red'}}).addTo(mymap);
             <!--gpx_data-->
             </script>
             '''
@@ -125,10 +121,31 @@ def render_pandoc_with_geolocation (inpt, title="Title", gpx_data=False, geoloca
                 # ];
                 #
                 # var polyline = L.polyline(latlngs, {color: 'red'}).addTo(map);
+    return geo_data
+
+def theme_includes(geo=False):
+    '''(header, before body, after body) include files of the theme
+
+    The after body include of pages with a map is generated, see geo_include'''
+    if geo:
+        return (CONFIG.get('themes', 'header_include', fallback      = None),
+                CONFIG.get('themes', 'body_before_include', fallback = None),
+                None)
+    return (CONFIG.get('themes', 'header_include_no_map', fallback      = None),
+            CONFIG.get('themes', 'body_before_include_no_map', fallback = None),
+            CONFIG.get('themes', 'body_after_include_no_map', fallback  = None))
 
-    logger.debug(F"Writing to {body_after_include_file}")
-    with open(body_after_include_file, 'w') as tf:
-        tf.write(geo_data)
+def render_pandoc_with_geolocation (inpt, title="Title", gpx_data=False, geolocation=False):
+    temp_dir                 = CONFIG.get('locations', 'temp_output', fallback      = '/tmp')
+    header_include_file, body_before_include_file, _ = theme_includes(geo=True)
+    # body_after_include_file  = CONFIG.get('themes', 'body_after_include', fallback  = None)
+    # one file per page: several articles may be rendered at the same time (--jobs)
+    makepath(temp_dir, 1)
+    with tempfile.NamedTemporaryFile('w', prefix='geo-', suffix='.tmp', dir=temp_dir,
+                                     delete=False) as tf:
+        body_after_include_file = tf.name
+        logger.debug(F"Writing to {body_after_include_file}")
+        tf.write(geo_include(gpx_data, geolocation))
         logger.debug(F"wrote to {body_after_include_file}")
 
     pandoc_args = ['-s', F'--metadata=title:{title}', 
@@ -137,16 +154,19 @@ def render_pandoc_with_geolocation (inpt, title="Title", gpx_data=False, geoloca
             F'--include-after-body={body_after_include_file}']
     logger.debug(F"pandoc args: {pandoc_args}")
     # header = F'title: {title}\n---\n'
-    html_data = pypandoc.convert_text(inpt, 'html', format='md', extra_args=pandoc_args)
+    import pypandoc
+    try:
+        with timing.subprocess('pandoc'):
+            html_data = pypandoc.convert_text(inpt, 'html', format='md', extra_args=pandoc_args)
+    finally:
+        os.remove(body_after_include_file)
     return html_data
 
 def render_pandoc_with_theme(inpt, title="Title", gpx_data=False, geolocation=False):
     if geolocation or gpx_data:
         return render_pandoc_with_geolocation(inpt, title, gpx_data, geolocation)
 
-    header_include_file      = CONFIG.get('themes', 'header_include_no_map', fallback      = None)
-    body_after_include_file  = CONFIG.get('themes', 'body_after_include_no_map', fallback  = None)
-    body_before_include_file = CONFIG.get('themes', 'body_before_include_no_map', fallback = None)
+    header_include_file, body_before_include_file, body_after_include_file = theme_includes()
 
     pandoc_args = ['-s', F'--metadata=title:{title}', 
             F'--include-in-header={header_include_file}',
@@ -154,7 +174,9 @@ def render_pandoc_with_theme(inpt, title="Title", gpx_data=False, geolocation=Fa
             F'--include-after-body={body_after_include_file}']
     logger.debug(F"pandoc args: {pandoc_args}")
     # header = F'title: {title}\n---\n'
-    html_data = pypandoc.convert_text(inpt, 'html', format='md', extra_args=pandoc_args)
+    import pypandoc
+    with timing.subprocess('pandoc'):
+        html_data = pypandoc.convert_text(inpt, 'html', format='md', extra_args=pandoc_args)
     return html_data
 
 def htmlescape(text):
@@ -181,11 +203,11 @@ def parse_internal_header(header):
         retval[key] = values 
     return retval
 
-def decode_message(msg):
-    '''Decode as much as possible'''
+def decode_message(msg, fields=None):
+    '''Decode as much as possible, or only the given fields'''
     FIELDS = ['from', 'to', 'subject', 'date', 'Message-ID', 'Return-Path', 'Content-Type']
     dec_msg = {}
-    for field in FIELDS:
+    for field in fields or FIELDS:
         dec_msg[field] = email_decode(msg[field])
     dec_msg['message-id']=msg['message-id'].replace('<','').replace('>','')
     return dec_msg
@@ -10,73 +10,125 @@
 # pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
 # pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
 
+import io
 import logging
 import sys
 import os
 import re
-import subprocess
-from jinja2 import Template
-
-import gpxpy
-import gpxpy.gpx
 
+from mail2blog import context
 from mail2blog import logsetup
 from mail2blog import tools 
-from mail2blog.parse_args import args
+from mail2blog import manifest
+from mail2blog import mimestream
+from mail2blog import search
+from mail2blog import templating
+from mail2blog import timing
+from mail2blog.manifest import BuildManifest
+from mail2blog.archive import IndexPages
+from mail2blog.feeds import Feeds
+from mail2blog.gallery import Gallery
 from mail2blog.config import CONFIG
 from mail2blog.database import Blog_entry, Blog
+from mail2blog.imappool import ImapPool
+from mail2blog.renderbackend import PandocRenderer
+from mail2blog.watch import Watcher
 
 logger = logging.getLogger(__name__)
 
+# Config options that end up in the article html or in the gallery
+ARTICLE_CONFIG = [('locations', 'gallery_link_base'), ('map', 'gpx_tolerance')]
+GALLERY_CONFIG = [('gallery', 'thumb_size'), ('gallery', 'image_size'), ('gallery', 'quality')]
+
 class ArticleRenderer():
     '''Methods for rendering various mime types'''
-    def __init__(self, blog_entry):
+    def __init__(self, blog_entry, renderer=None):
         self.blog_entry       = blog_entry
+        self.renderer         = renderer if renderer is not None else PandocRenderer(batch_size=1)
         self.message_id       = blog_entry.get_message_id()
         self.subject          = blog_entry.get_subject(replace_spaces=True)
         self.media_part_found = False
         self.location         = None
         self.gpx_data         = None
+        self.attachments      = {}    # number of attachments by kind, e.g. {'image': 3}
+        self.search_text      = None
 
         # Define locations
         blog_output_dir       = CONFIG.get('locations', 'blog_output')
-        self.html_output_file = os.path.join(blog_output_dir, F"{self.subject}-{self.message_id}.html")
+        self.html_output_file = self.output_file(blog_entry)
         temp_output_dir       = CONFIG.get('locations', 'temp_output')
         self.media_output_dir = os.path.join(temp_output_dir, F"{self.subject}-{self.message_id}")
         self.markdown         = ''
         self.gallery_name     = self.blog_entry.get_subject(replace_spaces=True) + '-' + self.blog_entry.get_message_id()
         self.gallery_icon     = None
         self.gallery_icon_basename = None
-
-        # If the html file is already there, we don't need to re-render:
-        if os.path.exists(self.html_output_file):
-            if args.force:
-                logger.info(F"{self.subject} already exists => removing article")
-                os.remove(self.html_output_file)
-        if os.path.exists(self.html_output_file):
-            logger.info(F"{self.subject} already exists => skipping article")
+        self.gallery_output   = os.path.join(CONFIG.get('locations', 'gallery_output', fallback=''),
+                                             self.gallery_name)
+        self.manifest         = BuildManifest()
+        self.article_digest   = self.input_digest(blog_entry)
+        self.gallery_digest   = manifest.digest(blog_entry.get_message_digest(),
+                manifest.config_digest(GALLERY_CONFIG))
+
+        # If the html file was built from the same inputs, we don't need to re-render:
+        if context.current().args.force and os.path.exists(self.html_output_file):
+            logger.info(F"{self.subject} already exists => removing article")
+            os.remove(self.html_output_file)
+        if self.manifest.is_current(self.html_output_file, self.article_digest):
+            logger.info(F"{self.subject} is up to date => skipping article")
+            if blog_entry.render_state != 'rendered':
+                blog_entry.set_render_state('rendered')
 
         else:
-            self.msg          = blog_entry.get_message()
-
             tools.makepath(blog_output_dir, 2)
 
             self.text = None
             self.media = []
+            # Only extract media and build the gallery if it is outdated
+            self.gallery_current = (not context.current().args.force and
+                    self.manifest.is_current(self.gallery_output, self.gallery_digest))
 
             self.walker()
             if self.media_part_found:
-                self._run_bic()
+                if self.gallery_current:
+                    logger.info(F"gallery of {self.subject} is up to date => skipping it")
+                else:
+                    self._build_gallery()
+                    self.manifest.record(self.gallery_output, self.gallery_digest)
                 self._add_gallery_url()
             self.write_output()
 
+    @staticmethod
+    def output_file(blog_entry):
+        blog_output_dir = CONFIG.get('locations', 'blog_output')
+        subject         = blog_entry.get_subject(replace_spaces=True)
+        return os.path.join(blog_output_dir, F"{subject}-{blog_entry.get_message_id()}.html")
+
+    @staticmethod
+    def input_digest(blog_entry):
+        '''digest of everything the article html is built from'''
+        return manifest.digest(blog_entry.get_message_digest(),
+                manifest.file_digest(CONFIG.get('templates', 'article', fallback=None)),
+                manifest.theme_digest(),
+                manifest.config_digest(ARTICLE_CONFIG))
+
+    @classmethod
+    def is_up_to_date(cls, blog_entry):
+        return (not context.current().args.force and
+                BuildManifest().is_current(cls.output_file(blog_entry), cls.input_digest(blog_entry)))
+
+    @classmethod
+    def needs_message(cls, blog_entry):
+        '''True if rendering this entry will have to download its body from IMAP'''
+        return (blog_entry.source == "imap"
+                and not cls.is_up_to_date(blog_entry)
+                and not blog_entry.has_cached_message())
+
     def write_output(self):
         '''render:
             - md message via jinja to md
             - md to html 
             and write output'''
         # collect data:
-        template_file     = CONFIG.get('templates', 'article')
         date              = self.blog_entry.date
         subject           = self.blog_entry.subject
         subject_no_spaces = self.blog_entry.get_subject(replace_spaces=True)
@@ -84,29 +136,35 @@ class ArticleRenderer():
         author_email      = self.blog_entry.author_email
         message_id        = self.blog_entry.message_id
         
-        # render template
-        with open(template_file, 'r') as fh:
-            template_data = fh.read()
-        template = Template(template_data)
-
-        markdown_data = template.render(date = date, 
-                                subject = subject,
-                                author = author,
-                                author_first = author.split(' ')[0],
-                                author_last  = author.split(' ')[1],
-                                author_email = author_email, 
-                                content = self.markdown,
-                                link = F"{subject_no_spaces}-{self.message_id}.html")
-
-        # if self.gpx_data:
-        html_data = tools.render_pandoc_with_theme(markdown_data, title=subject,
-                geolocation=self.location,
-                gpx_data = self.gpx_data)
-
-        logger.debug(F"saving html to {self.html_output_file}")
-        with open(self.html_output_file, 'w') as fp:
-            fp.write(html_data)
-        os.chmod(self.html_output_file, 0o644)
+        with timing.stage('write_output', self.message_id) as stage:
+            # render template
+            template = templating.get_template('article')
+
+            markdown_data = template.render(date = date, 
+                                    subject = subject,
+                                    author = author,
+                                    author_first = author.split(' ')[0],
+                                    author_last  = author.split(' ')[1],
+                                    author_email = author_email, 
+                                    content = self.markdown,
+                                    link = F"{subject_no_spaces}-{self.message_id}.html")
+            stage.bytes = len(markdown_data)
+
+            # if self.gpx_data:
+            self.renderer.submit(markdown_data, self.html_output_file, title=subject,
+                    geolocation=self.location,
+                    gpx_data = self.gpx_data,
+                    done = self._done,
+                    failed = self._failed)
+
+    def _done(self):
+        self.manifest.record(self.html_output_file, self.article_digest)
+        self.blog_entry.set_render_state('rendered', self.attachments)
+        if self.search_text is not None:
+            search.index_article(self.message_id, self.blog_entry.subject, self.search_text)
+
+    def _failed(self):
+        self.blog_entry.set_render_state('failed')
 
     def render(self, maintype, *myargs, **mykwargs):
         if maintype == "text":
@@ -139,8 +197,13 @@ class ArticleRenderer():
             extension = os.path.splitext(filename)[1] 
             logger.debug(F"extension: {extension}")
             if extension == ".gpx":
-                temp = payload.decode('iso-8859-1')
-                self.gpx_data = gpxpy.parse(temp)
+                # numpy is only imported for articles with a track
+                from mail2blog import geometry, gpxreduce
+                # only the simplified, encoded tracks go into the page
+                with timing.stage('gpx', self.message_id) as stage:
+                    self.gpx_data = gpxreduce.map_polylines(io.BytesIO(payload),
+                                                            geometry.tolerance())
+                    stage.bytes = len(payload)
                 logger.debug("fine; stored gpx data")
                 return None
 
@@ -170,6 +233,7 @@ class ArticleRenderer():
         except Exception as e:
             logger.error(F"exception when trying to get rid of footer: {e}")
             # logger.error(F"actual markdown: {self.markdown}")
+        self.search_text = self.markdown
 
 
     def image_renderer(self, part):
@@ -180,12 +244,13 @@ class ArticleRenderer():
         for ext in JPEG_EXTENSIONS:
             filename = filename.replace(ext, 'jpg')
         logger.info(F"image: {filename}")
-        actual_extension = filename.split('.')[-1]
-        if actual_extension.lower() == 'png':
-            logger.warning("PNG not yet supported by bic, skipping {filename}")
-            return
-        with open(os.path.join(self.media_output_dir  + '/' + filename), 'wb') as fp:
-            fp.write(part.get_payload(decode=True))
+        if not self.gallery_current:
+            with open(os.path.join(self.media_output_dir  + '/' + filename), 'wb') as fp:
+                # streamed parts are decoded straight into the file
+                if hasattr(part, 'save_payload'):
+                    part.save_payload(fp)
+                else:
+                    fp.write(part.get_payload(decode=True))
         self.media_part_found = True
         self.gallery_icon_basename = os.path.basename(filename)
         logger.debug(F" gallery_icon_basename: {self.gallery_icon_basename }") 
@@ -199,26 +264,25 @@ class ArticleRenderer():
         self.media_part_found = True
 
     def walker(self):
-        for part in self.msg.walk():
-            # print (F"message part: {part}")
-            # charset  = part.get_content_charset()
-            maintype = part.get_content_maintype()
-            self.render(maintype, part)
-
-    def _run_bic(self):
-        bic = CONFIG.get('tools', 'bic') 
-        # Works for ~marcus/public_html
+        logger.info(F"loading message {self.blog_entry.subject}...")
+        with timing.stage('walker', self.message_id) as stage, \
+                self.blog_entry.open_message() as msg_file:
+            for part in mimestream.walk(msg_file):
+                # print (F"message part: {part}")
+                # charset  = part.get_content_charset()
+                maintype = part.get_content_maintype()
+                filename = part.get_filename()
+                if filename:
+                    kind = 'gpx' if filename.lower().endswith('.gpx') else maintype
+                    self.attachments[kind] = self.attachments.get(kind, 0) + 1
+                self.render(maintype, part)
+            stage.bytes = msg_file.tell()
+
+    def _build_gallery(self):
+        with timing.stage('gallery', self.message_id):
+            Gallery(self.gallery_name, self.media_output_dir,
+                    force=context.current().args.force).build()
         gallery_output = CONFIG.get('locations', 'gallery_output')
-        gallery_link_base = CONFIG.get('locations', 'gallery_link_base') 
-        tools.makepath(gallery_output)
-        os.umask(0o022)
-
-        logger.info(F"Generating gallery for {self.message_id}...")
-        command = F'{bic} -i "{self.media_output_dir}" -n "{self.gallery_name}" -f -t any -r 0 -d {gallery_link_base} -o {gallery_output}> /dev/null 2>&1'
-        logger.debug(F"gallery command: >>{command}<<")
-        res = subprocess.call(command, shell = True)
-        if res != 0:
-            logger.error(F"Error when generating the gallery: {res}")
         self.gallery_icon = os.path.join(gallery_output, self.gallery_icon_basename)
 
     def _add_gallery_url(self):
@@ -228,26 +292,159 @@ class ArticleRenderer():
         icon_url          = F"{gallery_link_base}/{self.gallery_name}/gallery/thumbs/{self.gallery_icon_basename}"
         self.markdown    += F"[![icon]({icon_url})]({gallery_link})"
 
+def render_article(entry, pandoc):
+    '''render one article; a broken mail is logged instead of aborting the run'''
+    try:
+        with timing.article(entry.get_message_id()):
+            ArticleRenderer(entry, pandoc)
+        return True
+    except Exception as e:
+        logger.error(F"Could not render {entry.get_message_id()} ({entry.get_subject()}): "
+                     F"{e.__class__.__name__}: {e}")
+        entry.set_render_state('failed')
+        return False
+
+def _init_worker(config, arguments, recording):
+    '''set up a --jobs worker like its parent. Workers are spawned, not forked, so
+    they share neither the IMAP connection nor the threads of the parent'''
+    CONFIG.read_dict(config)
+    logsetup.setup_logging(arguments)
+    context.activate(context.AppContext(arguments))
+    if recording:
+        timing.start(arguments.profile)
+
+def _render_chunk(entries):
+    '''render some articles in a worker process, returning the ids of failed ones and
+    what timing recorded'''
+    pandoc = PandocRenderer()
+    failed = [entry.get_message_id() for entry in entries if not render_article(entry, pandoc)]
+    pandoc.flush()
+    return failed + failed_pages(entries, pandoc), timing.drain()
+
+def failed_pages(entries, pandoc):
+    '''ids of the entries whose page pandoc could not write in a batch'''
+    return [entry.get_message_id() for entry in entries
+            if ArticleRenderer.output_file(entry) in pandoc.failed]
+
+def render_articles(entries, pandoc, jobs=1):
+    '''render all articles. Bodies are downloaded in the parent by the ImapPool (or the
+    AsyncImapPool with [imap] client = asyncio); with jobs > 1 the articles are rendered in a
+    pool of worker processes'''
+    if CONFIG.get('imap', 'client', fallback = 'imaplib') == 'asyncio':
+        from mail2blog.aioimap import AsyncImapPool
+        pool = AsyncImapPool()
+    else:
+        pool = ImapPool()
+    failed = []
+    try:
+        # bodies arrive in the order of blog.entries, while later ones are still downloading
+        bodies = pool.fetch_bodies(entries, wanted=ArticleRenderer.needs_message)
+        if jobs <= 1:
+            for entry, _ in bodies:
+                if not render_article(entry, pandoc):
+                    failed.append(entry.get_message_id())
+            return failed
+
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+        chunk_size = CONFIG.getint('tools', 'jobs_chunk_size', fallback = 8)
+        config = {section: dict(CONFIG.items(section, raw=True)) for section in CONFIG.sections()}
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker,
+                                 initargs=(config, context.current().args,
+                                           timing.recording())) as executor:
+            futures = []
+            chunk   = []
+            for entry, _ in bodies:
+                if ArticleRenderer.is_up_to_date(entry):
+                    logger.info(F"{entry.get_subject(replace_spaces=True)} is up to date => skipping article")
+                    continue
+                chunk.append(entry)
+                if len(chunk) >= chunk_size:
+                    futures.append(executor.submit(_render_chunk, chunk))
+                    chunk = []
+                    # don't queue up more downloaded bodies than the workers can take
+                    while len([f for f in futures if not f.done()]) > 2 * jobs:
+                        wait(futures, return_when=FIRST_COMPLETED)
+            if chunk:
+                futures.append(executor.submit(_render_chunk, chunk))
+            for future in futures:
+                chunk_failed, recorded = future.result()
+                failed += chunk_failed
+                timing.merge(*recorded)
+    finally:
+        pool.close()
+    return failed
+
+def publish(blog, entries, jobs=1):
+    '''render the entries, then the index pages, search index and feeds that changed'''
+    force  = context.current().args.force
+    pandoc = PandocRenderer()
+    failed = render_articles(entries, pandoc, jobs)
+    # articles first: rendering records what the index shows of them
+    pandoc.flush()
+    failed += failed_pages(entries, pandoc)
+    if failed:
+        logger.error(F"{len(failed)} articles could not be rendered: {', '.join(failed)}")
+    # blog_index_md   = blog.generate_index()
+    with timing.stage('index'):
+        IndexPages(blog, force=force).write(pandoc)
+        pandoc.flush()
+    if CONFIG.getboolean('search', 'static_index', fallback = True):
+        with timing.stage('search_index'):
+            search.StaticIndex(force=force).write()
+    if CONFIG.getint('feed', 'entries', fallback = 20) > 0:
+        with timing.stage('feeds'):
+            Feeds(force=force).write()
+
+def publish_new():
+    '''look for new messages, and publish the articles that were never rendered'''
+    args = context.current().args
+    with timing.run(args.profile):
+        Blog.update_from_imap()
+        blog = Blog()
+        blog.read_entries_from_db(newest_first=True, render_state='new')
+        logger.info(F"{len(blog.entries)} new articles")
+        publish(blog, blog.entries, args.jobs)
+
 def generate_index():
+    '''render the blog, search it or watch the IMAP folder, as the arguments of the
+    current context say'''
+    args = context.current().args
+    if args.command == 'search':
+        return search.main(args.words)
+    if args.watch:
+        return Watcher(context.current().imap, publish_new).run()
+    with timing.run(args.profile):
+        return render_blog(args)
+
+def render_blog(args):
+    '''render what is new, or --message, or just list the messages'''
     blog=Blog()
-    blog.read_entries_from_imap(args.message, args.list_messages)
+    if args.message is not None or args.list_messages:
+        blog.read_entries_from_imap(args.message, args.list_messages)
+    else:
+        # the index comes from the database; IMAP is only asked for what is new
+        if args.offline:
+            logger.info("offline => not looking for new messages")
+        else:
+            blog.update_from_imap()
+        blog.read_entries_from_db(newest_first=True)
     if args.list_messages:
         sys.exit(0)
-    for entry in blog.entries:
-        renderer=ArticleRenderer(entry)
-
-    # blog_index_md   = blog.generate_index()
-    blog_index_md   = blog.generate_index_new()
-    blog_title = CONFIG.get('main', 'title', fallback='Blog')
-    blog_index_html = tools.render_pandoc_with_theme(blog_index_md, title=blog_title)
-    index_file_name = CONFIG.get('locations', 'blog_output') + "/index.html"
-
+    entries = blog.entries
+    if args.offline:
+        entries = [entry for entry in entries if not ArticleRenderer.needs_message(entry)]
+        if len(entries) < len(blog.entries):
+            logger.warning(F"offline => {len(blog.entries) - len(entries)} articles can't be "
+                           F"rendered until their messages are downloaded")
+    publish(blog, entries, args.jobs)
 
-    tools.makepath(CONFIG.get('locations', 'blog_output'))
-    with open(index_file_name, 'w') as fh:
-        fh.write(blog_index_html)
+def main():
+    '''the mail2blog command'''
+    context.start()
+    return generate_index()
 
 
 if __name__ == '__main__':
-    # sys.exit(main())
-    sys.exit(generate_index())
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+'''Publish new mails as they arrive, by waiting for them in IMAP IDLE'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=logging-fstring-interpolation
+# pylint: disable=redefined-outer-name, logging-not-lazy, logging-format-interpolation
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+# "mail2blog --watch" keeps the IMAP connection of database.py in IDLE. The server tells it
+# about new mail right away; then only the headers of the new UIDs are fetched (see ImapSync)
+# and publish() renders the new articles and the index pages, search index and feeds that
+# changed. Every [watch] keepalive seconds (default 300, below the 29 minutes of RFC 2177 and
+# the timeouts of most NAT routers) IDLE is left for a NOOP.
+# A lost connection is retried after [watch] backoff_min seconds, doubling up to
+# [watch] backoff_max; after a reconnect whatever arrived meanwhile is published. A publish
+# that fails for any other reason, also with a local OSError like a full disk, is logged, and
+# the watcher goes on idling: the next change publishes what was missed. (Should such an
+# OSError have come from the IMAP socket after all, the next IDLE finds out.)
+
+import logging
+import socket
+import time
+from imaplib import IMAP4
+
+from mail2blog.config import CONFIG
+
+logger = logging.getLogger(__name__)
+
+class Watcher:
+    '''Call publish() at the start, and whenever the IMAP folder changed'''
+    def __init__(self, connector, publish):
+        self.imap        = connector
+        self.publish     = publish
+        self.keepalive   = CONFIG.getfloat('watch', 'keepalive', fallback = 300)
+        self.backoff_min = CONFIG.getfloat('watch', 'backoff_min', fallback = 1)
+        self.backoff_max = CONFIG.getfloat('watch', 'backoff_max', fallback = 300)
+        self.running     = True
+        self.publishes   = 0
+        self.failures    = 0
+        self.reconnects  = 0
+
+    def stop(self):
+        '''end run() after the current IDLE'''
+        self.running = False
+
+    def run(self):
+        backoff  = self.backoff_min
+        catch_up = True
+        while self.running:
+            try:
+                if not self.imap.connected:
+                    self.imap.connect()
+                if catch_up:
+                    self._publish()
+                    catch_up = False
+                if self.imap.idle(self.keepalive) or self.imap.noop():
+                    self.imap.refresh()
+                    self._publish()
+                backoff = self.backoff_min
+            except (IMAP4.abort, IMAP4.error, socket.timeout, OSError) as e:
+                logger.warning(F"IMAP connection lost: {e} => reconnecting in {backoff:.0f} s")
+                self.imap.drop()
+                self.reconnects += 1
+                time.sleep(backoff)
+                backoff  = min(backoff * 2, self.backoff_max)
+                catch_up = True
+        return 0
+
+    def _publish(self):
+        start = time.perf_counter()
+        try:
+            self.publish()
+        except (IMAP4.abort, IMAP4.error, socket.timeout, ConnectionError):
+            raise
+        except Exception as e: # pylint: disable=broad-except
+            logger.error(F"publishing failed: {e!r}", exc_info=True)
+            self.failures += 1
+            return
+        self.publishes += 1
+        logger.info(F"published in {time.perf_counter() - start:.1f} s")
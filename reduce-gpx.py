@@ -13,77 +13,70 @@ import os
 import sys
 import argparse
 import logging
-import gpxpy
-import gpxpy.gpx
+from concurrent.futures import ProcessPoolExecutor
 
 logger = logging.getLogger(__name__)
 
 
 def parseOptions():
     '''Parse the commandline options'''
-    folder_of_executable = os.path.split(sys.argv[0])[0]
     parser = argparse.ArgumentParser(description='''reduce-gpx''')
+    parser.add_argument(dest='inputs',                  default=[], nargs='*',
+                                                        help='gpx files to reduce')
     parser.add_argument('--input',  '--in',  '-i',      default=None)
-    parser.add_argument('--output', '--out', '-o',      default=None)
-    parser.add_argument('--interval', '--int', '-t',    default=60, type=int)
+    parser.add_argument('--output', '--out', '-o',      default=None,
+                                                        help='output file (only for one input)')
+    parser.add_argument('--strategy', '-s',             default='time',
+                                                        choices=['time', 'distance', 'rdp'])
+    parser.add_argument('--interval', '--int', '-t',    default=60, type=int,
+                                                        help='seconds between points (time)')
+    parser.add_argument('--distance',                   default=10, type=float,
+                                                        help='metres between points (distance)')
+    parser.add_argument('--tolerance',                  default=5, type=float,
+                                                        help='allowed error in metres (rdp)')
+    parser.add_argument('--jobs',     '-j',             default=os.cpu_count() or 1, type=int,
+                                                        help='files to reduce in parallel')
     parser.add_argument('--debug',    '-d',             default=False, action="store_true")
     parser.add_argument('--verbose',  '-v',             default=False, action="store_true")
     args = parser.parse_args()
     return args
 
-# reparse args on import
-args = parseOptions()
-
-
-# Creating a new file:
-# --------------------
-r_gpx = gpxpy.gpx.GPX()
-
-# Create first track in our GPX:
-r_gpx_track = gpxpy.gpx.GPXTrack()
-r_gpx.tracks.append(r_gpx_track)
-
-# Create first segment in our GPX track:
-r_gpx_segment = gpxpy.gpx.GPXTrackSegment()
-r_gpx_track.segments.append(r_gpx_segment)
-
-# Create points:
-# r_gpx_segment.points.append(gpxpy.gpx.GPXTrackPoint(2.1234, 5.1234, elevation=1234))
-
-
-# Parsing an existing file:
-# -------------------------
-if args.input is None:
-    print("Error: must use --in or -i to specify input file")
-    sys.exit(1)
-if args.output is None:
-    args.output = os.path.splitext(args.input)[0] + '-reduced' + os.path.splitext(args.input)[1]
-
-gpx_file = open(args.input, 'r')
-r_gpx_file = open(args.output, 'w')
-
-gpx = gpxpy.parse(gpx_file)
-
-last_time = gpx.tracks[0].segments[0].points[0].time
-for track in gpx.tracks:
-    for segment in track.segments:
-        # print("new segment")
-        for point in segment.points:
-            timedelta = point.time - last_time
-            # print (F"timedelta: {last_time}")
-            if (timedelta.total_seconds()) > args.interval:
-                last_time = point.time
-                r_gpx_segment.points.append(point)
-
-
-# for waypoint in gpx.waypoints:
-#     print('waypoint {0} -> ({1},{2})'.format(waypoint.name, waypoint.latitude, waypoint.longitude))
-#
-# for route in gpx.routes:
-#     print('Route:')
-#     for point in route.points:
-#         print('Point at ({0},{1}) -> {2}'.format(point.latitude, point.longitude, point.elevation))
-
-r_gpx_file.write(r_gpx.to_xml())
-
-
+from mail2blog import gpxreduce
+
+STRATEGY_VALUE = {'time': 'interval', 'distance': 'distance', 'rdp': 'tolerance'}
+
+def output_name(input_file):
+    return os.path.splitext(input_file)[0] + '-reduced' + os.path.splitext(input_file)[1]
+
+def reduce_one(input_file, output_file, strategy, value):
+    new_reducer = gpxreduce.reducer_factory(strategy, value)
+    with open(output_file, 'w', encoding='utf-8') as out:
+        total, kept = gpxreduce.reduce_file(input_file, out, new_reducer)
+    return input_file, output_file, total, kept
+
+def main():
+    args = parseOptions()
+    inputs = args.inputs + ([args.input] if args.input else [])
+    if not inputs:
+        print("Error: must name at least one input file (or use --in or -i)")
+        return 1
+    if args.output is not None and len(inputs) > 1:
+        print("Error: --output only works with a single input file")
+        return 1
+    if args.verbose or args.debug:
+        logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    value = getattr(args, STRATEGY_VALUE[args.strategy])
+    outputs = [args.output or output_name(f) for f in inputs]
+
+    jobs = [(i, o, args.strategy, value) for i, o in zip(inputs, outputs)]
+    if args.jobs <= 1 or len(jobs) == 1:
+        results = [reduce_one(*job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(reduce_one, *zip(*jobs)))
+    for input_file, output_file, total, kept in results:
+        print(F"{input_file}: kept {kept} of {total} points => {output_file}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
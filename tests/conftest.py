@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+'''Shared setup of the tests: the benchmark helpers (imap_standin, synthmail) are importable'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, wrong-import-position
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+sys.path.insert(0, ROOT)
+
+from mail2blog import context
+from mail2blog.config import CONFIG
+
+@pytest.fixture
+def locations(tmp_path):
+    '''[locations] in a fresh temporary directory, and a context with the default arguments.
+    What the test changes in CONFIG is undone afterwards'''
+    saved = {section: dict(CONFIG.items(section, raw=True)) for section in CONFIG.sections()}
+    CONFIG.read_dict({'locations': {
+        'database':    str(tmp_path / 'mail2blog.db'),
+        'raw_output':  str(tmp_path / 'raw'),
+        'temp_output': str(tmp_path / 'tmp'),
+        'blog_output': str(tmp_path / 'blog')}})
+    context.activate(context.AppContext())
+    yield tmp_path
+    context.current().close()
+    context.activate(None)
+    for section in CONFIG.sections():
+        CONFIG.remove_section(section)
+    CONFIG.read_dict(saved)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+'''The asyncio IMAP pool reconnects when the server drops the connection'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import os
+import tracemalloc
+
+import pytest
+
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox
+from mail2blog import context
+from mail2blog.aioimap import AsyncImapPool
+from mail2blog.config import CONFIG
+from mail2blog.database import Blog
+from mail2blog.imapconnector import message_id_of
+
+@pytest.fixture
+def server(locations):
+    mailbox = Mailbox(text_mailbox(30))
+    with ImapStandIn(mailbox, network_latency=0.002) as server:
+        CONFIG.read_dict({'imap': dict(server.config(), pipeline_depth='8')})
+        yield server
+
+def entries():
+    blog = Blog()
+    blog.read_entries_from_imap()
+    context.current().close()       # before the stand-in goes away
+    return blog.entries
+
+def test_reconnect_on_bye(server, locations):
+    entries_ = entries()
+    server.bye_every = 7
+    pool = AsyncImapPool()
+    try:
+        fetched = [(entry.message_id, ok) for entry, ok in pool.fetch_bodies(entries_)]
+        generation = pool.imap.generation
+    finally:
+        pool.close()
+    assert fetched == [(entry.message_id, True) for entry in entries_]
+    assert server.byes >= 3
+    assert generation > 1
+    raws = {message_id_of(raw): raw for _, raw in server.mailbox.messages}
+    for entry in entries_:
+        with open(os.path.join(locations, 'raw', entry.message_id, 'raw.mail'), 'rb') as fh:
+            assert fh.read() == raws[entry.message_id]
+
+def test_give_up_after_retries(server):
+    entries_ = entries()[:3]
+    server.bye_every = 1
+    pool = AsyncImapPool()
+    try:
+        fetched = [ok for _, ok in pool.fetch_bodies(entries_)]
+    finally:
+        pool.close()
+    assert fetched == [False, False, False]
+
+BIG_MESSAGES = 4
+BIG_BYTES    = 16 * 2**20
+
+def big_message(i):
+    line = F"{i:04d}" + 'x' * 72 + '\r\n'
+    return (F"From: Jane Doe <jane@example.org>\r\n"
+            F"To: blog@example.org\r\n"
+            F"Subject: big {i}\r\n"
+            F"Date: Thu, 01 Oct 2020 10:00:00 +0000\r\n"
+            F"Message-ID: <big-{i}@mail2blog.example.org>\r\n"
+            F"\r\n").encode() + line.encode() * (BIG_BYTES // len(line))
+
+def test_memory_is_bounded(locations):
+    with ImapStandIn(Mailbox([big_message(i) for i in range(BIG_MESSAGES)])) as server:
+        CONFIG.read_dict({'imap': dict(server.config(), fetch_chunk_size='65536',
+                                       pipeline_bytes=str(2**20))})
+        entries_ = entries()
+        # each message was held as a whole before it was written
+        pool = AsyncImapPool()
+        tracemalloc.start()
+        try:
+            fetched = [ok for _, ok in pool.fetch_bodies(entries_)]
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+            pool.close()
+    assert fetched == [True] * BIG_MESSAGES
+    for i in range(BIG_MESSAGES):
+        path = os.path.join(locations, 'raw', F"big-{i}@mail2blog.example.org", 'raw.mail')
+        with open(path, 'rb') as fh:
+            assert fh.read() == big_message(i)
+    assert peak < 6 * 2**20, F"peak {peak / 2**20:.1f} MiB"
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+'''Index pages stay small, and a new post only touches the pages that show it'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import calendar
+
+from mail2blog.archive import IndexPages
+from mail2blog.config import CONFIG
+from mail2blog.database import Blog_entry, store_entries
+
+def post(i, year, month, day):
+    return Blog_entry(F"post-{i}@example.org", "Jane Doe <jane@example.org>", F"Post {i}",
+                      calendar.timegm((year, month, day, 12, 0, 0)))
+
+def plan():
+    # IndexPages._digest is what decides whether a page is rendered again
+    pages = IndexPages()
+    return {name: pages._digest(title, context)      # pylint: disable=protected-access
+            for name, (title, context) in pages.plan().items()}, pages.plan()
+
+def test_year_archive_links_to_months(locations):
+    CONFIG.read_dict({'index': {'page_size': '2'}})
+    store_entries([post(i, 2021, 1 + i // 3, 1 + i % 3) for i in range(9)])
+    _, pages = plan()
+    _, year = pages['archive-2021.html']
+    assert year['article_list'] == []
+    assert [month['link'] for month in year['archives'][0]['months']] == \
+           ['archive-2021-01.html', 'archive-2021-02.html', 'archive-2021-03.html']
+    assert len(pages['archive-2021-02.html'][1]['article_list']) == 3
+    assert max(len(context['article_list']) for _, context in pages.values()) == 3
+
+def test_new_post_leaves_year_archive_alone(locations):
+    store_entries([post(i, 2021, 1 + i // 3, 1 + i % 3) for i in range(9)])
+    before, _ = plan()
+    store_entries([post(9, 2021, 3, 20)])
+    after, _ = plan()
+    changed = {name for name in after if before.get(name) != after[name]}
+    assert 'archive-2021.html' not in changed and 'archive-2021-03.html' in changed
+    store_entries([post(10, 2021, 4, 1)])
+    assert plan()[0]['archive-2021.html'] != after['archive-2021.html']
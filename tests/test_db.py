@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+'''Entries go into sqlite as parameters: whatever a subject holds, it comes back unchanged'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import pytest
+
+from mail2blog import db
+from mail2blog.database import Blog, Blog_entry, store_entries
+
+HOSTILE_SUBJECTS = [
+    "Rock'n'Roll",
+    'the "best" day',
+    "'); drop table mail2blog; --",
+    "100% %s %d %(name)s",
+    "back\\slash and ? and :name",
+    "Grüße aus Åre — 山 🏔",
+    "nul\x00byte",
+    "line\nbreak",
+    "",
+]
+
+@pytest.fixture
+def entries():
+    return [Blog_entry(F"hostile-{i}@example.org", F"O'Brien \"{i}\" <ob@example.org>",
+                       subject, 1600000000 + i) for i, subject in enumerate(HOSTILE_SUBJECTS)]
+
+def test_hostile_subjects_round_trip(locations, entries):
+    entries[0].store_in_db()
+    assert store_entries(entries) == len(entries) - 1
+    blog = Blog()
+    blog.read_entries_from_db()
+    assert [(e.message_id, e.email_from, str(e.subject)) for e in blog.entries] == \
+           [(e.message_id, e.email_from, str(e.subject)) for e in entries]
+    assert db.query('''select count(*) from mail2blog''') == [(len(entries),)]
+
+def test_duplicates_are_ignored(locations, entries):
+    assert store_entries(entries) == len(entries)
+    assert store_entries(entries) == 0
+    entries[3].store_in_db()
+    assert db.query('''select count(*) from mail2blog''') == [(len(entries),)]
+
+def test_connection_is_in_wal_mode(locations):
+    assert db.query('''pragma journal_mode''') == [('wal',)]
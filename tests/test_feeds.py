@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+'''Feeds link absolutely to the blog, or are not written at all'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import logging
+import os
+import xml.etree.ElementTree as ET
+
+from mail2blog.config import CONFIG
+from mail2blog.database import Blog_entry, store_entries
+from mail2blog.feeds import Feeds
+
+def stored_posts():
+    entries = [Blog_entry(F"post-{i}@example.org", "Jane Doe <jane@example.org>", F"Post {i}",
+                          1600000000 + i) for i in range(3)]
+    store_entries(entries)
+
+def test_no_feeds_without_blog_link_base(locations, caplog):
+    stored_posts()
+    with caplog.at_level(logging.WARNING):
+        assert Feeds().write() == []
+    assert 'blog_link_base' in caplog.text
+    assert not os.path.exists(locations / 'blog' / 'rss.xml')
+
+def test_feed_links_are_absolute(locations):
+    stored_posts()
+    CONFIG.read_dict({'locations': {'blog_link_base': 'https://blog.example.org/'}})
+    assert sorted(Feeds().write()) == ['atom.xml', 'rss.xml']
+    rss = ET.parse(locations / 'blog' / 'rss.xml').getroot()
+    links = [link.text for link in rss.iter('link')]
+    assert len(links) == 4
+    assert all(link.startswith('https://blog.example.org/') for link in links), links
+    atom = ET.parse(locations / 'blog' / 'atom.xml').getroot()
+    hrefs = [link.get('href') for link in atom.iter('{http://www.w3.org/2005/Atom}link')]
+    assert all(href.startswith('https://blog.example.org/') for href in hrefs), hrefs
+    assert Feeds().write() == []
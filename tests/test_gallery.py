@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+'''The gallery page shows subjects and file names from mails as text, never as markup'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+from mail2blog.config import CONFIG
+from mail2blog.gallery import Gallery
+
+def test_gallery_index_is_escaped(locations):
+    CONFIG.read_dict({'locations': {'gallery_output': str(locations / 'gallery')},
+                      'gallery':   {'workers': '1'}})
+    source = locations / 'media'
+    source.mkdir()
+    (source / '<script>alert(1)<script> "x".txt').write_text('not an image')
+    title = '<img src=x onerror=alert(2)>'
+    gallery = Gallery(title, str(source))
+    gallery.build()
+    html = (locations / 'gallery' / title / 'index.html').read_text()
+    assert '<script>' not in html and '<img src=x' not in html
+    assert '&lt;img src=x onerror=alert(2)&gt;' in html
+    assert 'href="gallery/images/%3Cscript%3Ealert%281%29%3Cscript%3E%20%22x%22.txt"' in html
+    assert '&lt;script&gt;alert(1)&lt;script&gt; &#34;x&#34;.txt' in html
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+'''A body download survives a server that is gone for a moment'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+from imaplib import IMAP4
+
+import pytest
+
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox
+from mail2blog.config import CONFIG
+from mail2blog.imappool import ImapPool
+
+MESSAGE_ID = 'bench-0-0@mail2blog.example.org'
+
+class RefusingStandIn(ImapStandIn):
+    '''closes the connections with the numbers in refuse before the greeting'''
+    refuse = ()
+
+    async def _handle(self, reader, writer):
+        if self.connections + 1 in self.refuse:
+            self.connections += 1
+            writer.close()
+            return
+        await super()._handle(reader, writer)
+
+@pytest.fixture
+def server(locations):
+    with RefusingStandIn(Mailbox(text_mailbox(1))) as server:
+        CONFIG.read_dict({'imap': dict(server.config(), retries='2')})
+        yield server
+
+def test_failed_reconnect_is_retried(server):
+    server.refuse = (1, 2)
+    pool = ImapPool(1)
+    try:
+        assert pool.fetch(MESSAGE_ID, 1) == 1
+    finally:
+        pool.close()
+    assert server.connections == 3
+
+def test_gives_up_after_retries(server):
+    server.refuse = (1, 2, 3)
+    pool = ImapPool(1)
+    try:
+        with pytest.raises(IMAP4.abort):
+            pool.fetch(MESSAGE_ID, 1)
+    finally:
+        pool.close()
+    assert server.connections == 3
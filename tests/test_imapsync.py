@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+'''The header mirror catches up with everything on the server, also after a failed batch'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+from imaplib import IMAP4
+
+import pytest
+
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox, text_message
+from mail2blog import db
+from mail2blog.config import CONFIG
+from mail2blog.database import ImapSync
+from mail2blog.imapconnector import ImapConnector
+
+class RefusingStandIn(ImapStandIn):
+    '''answers the header FETCH of one UID with NO'''
+    refuse = None
+
+    def _dispatch(self, tag, command, arguments):
+        if (command == 'UID' and arguments.upper().startswith('FETCH ')
+                and 'HEADER.FIELDS' in arguments.upper()
+                and arguments.split(' ')[1].split(':')[0] == str(self.refuse)):
+            return F'{tag} NO temporary failure\r\n'.encode()
+        return super()._dispatch(tag, command, arguments)
+
+@pytest.fixture
+def server(locations):
+    with RefusingStandIn(Mailbox(text_mailbox(6))) as server:
+        CONFIG.read_dict({'imap': dict(server.config(), fetch_batch_size='2')})
+        yield server
+
+def mirrored():
+    return [row[0] for row in db.query('''select uid from imap_messages order by uid''')]
+
+def test_failed_batch_is_fetched_again(server):
+    imap = ImapConnector()
+    server.refuse = 3
+    with pytest.raises(IMAP4.error):
+        ImapSync(imap).sync()
+    assert mirrored() == []
+    assert db.query('''select * from imap_sync''') == []
+
+    server.refuse = None
+    assert [row['uid'] for row in ImapSync(imap).sync()] == [1, 2, 3, 4, 5, 6]
+    assert db.query('''select highest_uid from imap_sync''') == [(6,)]
+
+    # only the new UIDs are asked for; their batch fails once, then comes through
+    server.mailbox.append(text_message(6))
+    server.mailbox.append(text_message(7))
+    imap.refresh()
+    server.refuse = 7
+    with pytest.raises(IMAP4.error):
+        ImapSync(imap).sync()
+    assert mirrored() == [1, 2, 3, 4, 5, 6]
+    server.refuse = None
+    assert [row['uid'] for row in ImapSync(imap).sync()] == [1, 2, 3, 4, 5, 6, 7, 8]
+    imap.disconnect()
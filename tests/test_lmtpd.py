@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+'''mail2blog-lmtpd spools messages to disk: a burst of big mails doesn't pile up in memory'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import asyncio
+import os
+import tracemalloc
+
+from mail2blog import db
+from mail2blog import rawcache
+from mail2blog.config import CONFIG
+from mail2blog.lmtpd import LMTPServer, SPOOL
+
+MESSAGE_BYTES = 2**20
+LINE          = 'x' * 76 + '\n'
+
+def big_message(i):
+    '''the message in pieces: the client must not take much memory itself'''
+    yield (F"From: Jane Doe <jane@example.org>\nSubject: Big {i}\n"
+           F"Message-ID: <big-{i}@example.org>\n\n")
+    for _ in range(MESSAGE_BYTES // (len(LINE) * 1024)):
+        yield LINE * 1024
+
+async def read_reply(reader):
+    lines = []
+    while True:
+        line = (await reader.readline()).decode().rstrip('\r\n')
+        lines.append(line)
+        if line[3:4] != '-':
+            return lines
+
+async def send(port, messages):
+    '''deliver messages over one connection; return the first reply line to each'''
+    reader, writer = await asyncio.open_connection('127.0.0.1', port, limit=2**20)
+    await read_reply(reader)
+    writer.write(b'LHLO test\r\n')
+    await read_reply(reader)
+    replies = []
+    for message in messages:
+        writer.write(b'MAIL FROM:<jane@example.org>\r\nRCPT TO:<blog@example.org>\r\nDATA\r\n')
+        for _ in range(3):
+            await read_reply(reader)
+        for piece in message:
+            writer.write(piece.encode().replace(b'\n', b'\r\n'))
+            await writer.drain()
+        writer.write(b'.\r\n')
+        replies.append((await read_reply(reader))[0])
+    writer.write(b'QUIT\r\n')
+    await read_reply(reader)
+    writer.close()
+    return replies
+
+async def burst(count, connections):
+    server = await LMTPServer().start()
+    tracemalloc.start()
+    try:
+        # the messages are made one at a time by each connection
+        results = await asyncio.gather(*[send(server.port, map(big_message,
+                                                               range(n, count, connections)))
+                                         for n in range(connections)])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        await server.stop()
+    return [reply for replies in results for reply in replies], peak
+
+def test_burst_of_big_mails_is_spooled(locations):
+    CONFIG.read_dict({'lmtp': {'port': '0', 'queue_size': '8', 'max_size': str(4 * 2**20)}})
+    # a connection buffers up to 1 MiB; the 16 messages would take 16 MiB if they were
+    # kept until their commit
+    replies, peak = asyncio.run(burst(16, 4))
+    assert all(reply.startswith('250 ') for reply in replies), replies
+    assert peak < 6 * 2**20, F"peak {peak / 2**20:.1f} MiB"
+    assert db.query('''select count(*) from mail2blog''') == [(16,)]
+    raw = os.path.join(rawcache.message_directory('big-3@example.org'), 'raw.mail')
+    with open(raw, 'rb') as fh:
+        assert fh.read() == ''.join(big_message(3)).encode()
+    assert not os.listdir(locations / 'raw' / SPOOL)
+
+def test_too_big_and_broken_mails_leave_no_spool_files(locations):
+    CONFIG.read_dict({'lmtp': {'port': '0', 'max_size': str(2**19)}})
+    async def run():
+        server = await LMTPServer().start()
+        try:
+            return await send(server.port, [big_message(0), ['Subject: no id\n\nbody\n']])
+        finally:
+            await server.stop()
+    assert [reply[:3] for reply in asyncio.run(run())] == ['552', '554']
+    assert not os.listdir(locations / 'raw' / SPOOL)
+    assert db.query('''select count(*) from mail2blog''') == [(0,)]
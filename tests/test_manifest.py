@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+'''The build manifest notices changed inputs, also within one resident process'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import os
+
+from mail2blog import manifest
+from mail2blog.config import CONFIG
+
+def test_file_digest_follows_edits(tmp_path):
+    theme = tmp_path / 'header_include.html'
+    theme.write_text('<style>a {}</style>')
+    before = manifest.file_digest(str(theme))
+    assert manifest.file_digest(str(theme)) == before
+    theme.write_text('<style>b {}</style>')
+    os.utime(theme, ns=(0, os.stat(theme).st_mtime_ns + 1))
+    assert manifest.file_digest(str(theme)) != before
+    theme.unlink()
+    assert manifest.file_digest(str(theme)) == 'missing'
+    assert manifest.file_digest(None) == 'none'
+
+def test_edited_theme_outdates_pages(locations):
+    theme  = locations / 'header_include.html'
+    output = locations / 'page.html'
+    theme.write_text('one')
+    output.write_text('<html/>')
+    CONFIG.read_dict({'themes': {'header_include': str(theme)}})
+    try:
+        build = manifest.BuildManifest()
+        build.record(str(output), manifest.theme_digest())
+        assert build.is_current(str(output), manifest.theme_digest())
+        theme.write_text('two, longer')
+        assert not build.is_current(str(output), manifest.theme_digest())
+    finally:
+        CONFIG.remove_option('themes', 'header_include')
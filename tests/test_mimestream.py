@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+'''mimestream.walk() decodes like the email package, with memory bounded by the buffer size'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import base64
+import email
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+
+from mail2blog import mimestream
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+HEADER = ('From: Jane Doe <jane@example.org>\n'
+          'Subject: A video\n'
+          'Message-ID: <test-video@mail2blog.example.org>\n'
+          'MIME-Version: 1.0\n'
+          'Content-Type: multipart/mixed; boundary="==test=="\n'
+          '\n'
+          '--==test==\n'
+          'Content-Type: text/plain; charset="utf-8"\n'
+          'Content-Transfer-Encoding: quoted-printable\n'
+          '\n'
+          'We went to the sea =E2=98=BA\n'
+          '\n'
+          '--==test==\n'
+          'Content-Type: video/mp4; name="sea.mp4"\n'
+          'Content-Transfer-Encoding: base64\n'
+          'Content-Disposition: attachment; filename="sea.mp4"\n'
+          '\n')
+
+# Peak RSS of the child that walks a message with a VIDEO_MIB attachment (BASE64 encoded it
+# is a third larger). Parsing it with the email package would take several times that.
+VIDEO_MIB = 64
+CAP_MIB   = 48
+
+# ru_maxrss would do on the child, but Linux carries it over fork and exec from the parent,
+# which may be bigger. VmHWM is the peak of this process only.
+WALK = '''
+import hashlib, json, sys
+from mail2blog import mimestream
+sha = hashlib.sha256()
+with open(sys.argv[1], 'rb') as fp:
+    for part in mimestream.walk(fp, 2**16):
+        if part.get_content_maintype() == 'video':
+            for data in part.iter_payload():
+                sha.update(data)
+with open('/proc/self/status', encoding='ascii') as fh:
+    hwm = int(fh.read().split('VmHWM:')[1].split()[0])
+print(json.dumps({'maxrss': hwm * 1024, 'sha256': sha.hexdigest()}))
+'''
+
+def write_message(fp, size):
+    '''the message, with a video of size random bytes; return the sha256 of the video'''
+    sha = hashlib.sha256()
+    fp.write(HEADER.encode())
+    block = 57 * 2**12
+    while size > 0:
+        data = os.urandom(min(block, size))
+        sha.update(data)
+        fp.write(base64.encodebytes(data))
+        size -= len(data)
+    fp.write(b'\n--==test==--\n')
+    return sha.hexdigest()
+
+def test_walk_decodes_like_email():
+    fp = io.BytesIO()
+    write_message(fp, 100000)
+    expected = [(part.get_content_type(), part.get_payload(decode=True))
+                for part in email.message_from_bytes(fp.getvalue()).walk()]
+    fp.seek(0)
+    parts = [(part.get_content_type(), part.get_payload(decode=True))
+             for part in mimestream.walk(fp, 256)]
+    assert parts == expected
+    assert parts[1][1].decode('utf-8') == 'We went to the sea ☺\n'
+
+def test_walk_memory_is_bounded(tmp_path):
+    message = tmp_path / 'video.mail'
+    with open(message, 'wb') as fp:
+        digest = write_message(fp, VIDEO_MIB * 2**20)
+    res = subprocess.run([sys.executable, '-c', WALK, str(message)], capture_output=True,
+                         check=True, cwd=ROOT, env=dict(os.environ, PYTHONPATH=ROOT))
+    result = json.loads(res.stdout)
+    assert result['sha256'] == digest
+    assert result['maxrss'] < CAP_MIB * 2**20, F"peak RSS {result['maxrss'] / 2**20:.1f} MiB"
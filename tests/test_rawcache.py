@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+'''The raw message cache stays inside raw_output, whatever the Message-ID'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import os
+
+import pytest
+
+from mail2blog import rawcache
+from mail2blog.config import CONFIG
+
+def store(cache, message_id, data=b'x' * 100):
+    def write(fp):
+        fp.write(data)
+        return 1
+    return cache.store(message_id, write)[1]
+
+def test_plain_message_ids_keep_their_directory(locations):
+    assert rawcache.message_directory('1234.abc+x@example.org') == \
+           str(locations / 'raw' / '1234.abc+x@example.org')
+
+@pytest.mark.parametrize('message_id', ['../../etc/passwd', '../x@y', 'a/../../b', '/abs@x',
+                                        '..%2F..@x', 'a\0b'])
+def test_hostile_message_ids_stay_inside(locations, message_id):
+    path = rawcache.message_directory(message_id)
+    assert os.path.dirname(path) == str(locations / 'raw')
+    assert rawcache.message_directory(message_id) != rawcache.message_directory('x')
+
+@pytest.mark.parametrize('message_id', ['', '.', '..'])
+def test_unusable_message_ids_are_rejected(locations, message_id):
+    with pytest.raises(ValueError):
+        rawcache.message_directory(message_id)
+
+def test_eviction_removes_only_cached_files(locations):
+    victim = locations / 'victim'
+    victim.mkdir()
+    (victim / 'raw.mail').write_bytes(b'keep me')
+    CONFIG.read_dict({'cache': {'raw_max_bytes': '150'}})
+    try:
+        cache = rawcache.RawMessageCache()
+        first = store(cache, '../victim')
+        assert first.startswith(str(locations / 'raw') + os.sep)
+        store(cache, 'second@example.org')
+        assert not os.path.exists(first)
+        assert (victim / 'raw.mail').read_bytes() == b'keep me'
+    finally:
+        CONFIG.remove_section('cache')
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+'''A page that fails in a pandoc batch doesn't take the other pages of the batch with it'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import os
+
+import pytest
+
+from mail2blog import renderbackend
+from mail2blog.renderbackend import PandocRenderer
+
+pytestmark = pytest.mark.skipif(not renderbackend.batch_supported(),
+                                reason='batch rendering needs pandoc 3')
+
+def test_failed_page_is_isolated(locations, monkeypatch):
+    out    = locations / 'blog'
+    out.mkdir()
+    pages  = [str(out / 'one.html'), str(locations / 'missing' / 'two.html'),
+              str(out / 'three.html')]
+    done, failed = [], []
+    pandoc = PandocRenderer(batch_size=10)
+    for number, page in enumerate(pages):
+        pandoc.submit(F"# page {number}\n", page, title=F"page {number}",
+                      done=lambda page=page: done.append(page),
+                      failed=lambda page=page: failed.append(page))
+    workdir = pandoc.workdir
+    # the page that pandoc did not write is rendered on its own; let that fail as well
+    monkeypatch.setattr(PandocRenderer, '_render_single', staticmethod(lambda job: 1 / 0))
+    os.remove(pandoc.jobs[2]['paths'][0])
+    pandoc.flush()
+
+    assert done == [pages[0]]
+    assert failed == pages[1:] == pandoc.failed
+    assert 'page 0</h1>' in open(pages[0], encoding='utf-8').read()
+    assert not os.path.exists(workdir) and pandoc.workdir is None
+
+def test_workdir_is_removed_when_pandoc_is_missing(locations, monkeypatch):
+    pandoc = PandocRenderer(batch_size=10)
+    page   = str(locations / 'one.html')
+    pandoc.submit('# page\n', page, failed=lambda: None)
+    workdir = pandoc.workdir
+    import pypandoc
+    monkeypatch.setattr(pypandoc, 'get_pandoc_path', lambda: str(locations / 'no-pandoc'))
+    monkeypatch.setattr(pypandoc, 'convert_file', lambda *args, **kwargs: 1 / 0)
+    pandoc.flush()
+    assert pandoc.failed == [page]
+    assert not os.path.exists(workdir)
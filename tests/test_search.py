@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+'''The search text stays with its article, also when sqlite renumbers the rows of mail2blog'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import pytest
+
+from mail2blog import db
+from mail2blog import search
+from mail2blog.database import Blog_entry, store_entries
+
+pytestmark = pytest.mark.usefixtures('locations')
+
+def entry(i):
+    return Blog_entry(F"post-{i}@example.org", "Jane Doe <jane@example.org>", F"Post {i}",
+                      1600000000 + i)
+
+def vacuum():
+    '''what VACUUM may do to a table without INTEGER PRIMARY KEY: number its rows anew,
+    here the other way round'''
+    with db.transaction() as cur:
+        cur.execute('''update mail2blog set rowid=rowid+1000''')
+        cur.execute('''update mail2blog set rowid=1004-rowid''')
+    db.connection().execute('''vacuum''')
+
+def test_search_text_follows_message_id():
+    if not search.available():
+        pytest.skip('this sqlite has no FTS5')
+    store_entries([entry(i) for i in range(3)])
+    for i in range(3):
+        search.index_article(F"post-{i}@example.org", F"Post {i}", F"word{i} common")
+    vacuum()
+    assert db.query('''select rowid from mail2blog order by date''') == [(3,), (2,), (1,)]
+    for i in range(3):
+        hits = search.search([F"word{i}"])
+        assert [hit['message_id'] for hit in hits] == [F"post-{i}@example.org"]
+        assert hits[0]['subject'] == F"Post {i}"
+    search.index_article('post-1@example.org', 'Post 1', 'reindexed')
+    assert not search.search(['word1'])
+    assert [hit['message_id'] for hit in search.search(['reindexed'])] == ['post-1@example.org']
+
+def test_prune_drops_deleted_articles():
+    if not search.available():
+        pytest.skip('this sqlite has no FTS5')
+    store_entries([entry(i) for i in range(2)])
+    for i in range(2):
+        search.index_article(F"post-{i}@example.org", F"Post {i}", 'common')
+    with db.transaction() as cur:
+        cur.execute('''delete from mail2blog where message_id='post-0@example.org' ''')
+    search.prune()
+    assert [hit['message_id'] for hit in search.search(['common'])] == ['post-1@example.org']
+    assert db.query('''select message_id from article_doc''') == [('post-1@example.org',)]
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+'''Importing mail2blog is cheap and has no side effects (see context.py)'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT  = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY = {'numpy', 'PIL', 'pypandoc', 'jinja2'}
+# twice the budgets of benchmarks/bench_startup.py: test machines are slower and busier
+BUDGET_MS = {'mail2blog.view': 300, 'mail2blog.controller': 200}
+
+def importtime(code, *argv):
+    '''run code in a fresh python: (stdout, stderr lines that are no timings, {module: us})'''
+    res = subprocess.run([sys.executable, '-X', 'importtime', '-c', code] + list(argv),
+                         capture_output=True, check=True, cwd=ROOT,
+                         env=dict(os.environ, PYTHONPATH=ROOT))
+    imports, other = {}, []
+    for line in res.stderr.decode().splitlines():
+        if line.startswith('import time:') and '|' in line:
+            _, cumulative, module = line.split('|')
+            if cumulative.strip().isdigit():
+                imports[module.strip()] = int(cumulative)
+        else:
+            other.append(line)
+    return res.stdout.decode(), other, imports
+
+@pytest.mark.parametrize('module', ['mail2blog.view', 'mail2blog.controller',
+                                    'mail2blog.lmtpd', 'mail2blog.database'])
+def test_import_skips_heavy_dependencies(module):
+    _, _, imports = importtime(F"import {module}")
+    assert not {name.split('.')[0] for name in imports} & HEAVY
+
+@pytest.mark.parametrize('module', sorted(BUDGET_MS))
+def test_import_time_budget(module):
+    best = min(importtime(F"import {module}")[2][module] for _ in range(3)) / 1000
+    assert best < BUDGET_MS[module], F"import {module} took {best:.0f} ms"
+
+def test_import_has_no_side_effects():
+    out, other, _ = importtime('import logging, mail2blog.view, mail2blog.lmtpd, '
+                               'mail2blog.context as c; '
+                               'print(logging.getLogger().handlers, c._current)',
+                               '--no-such-option')
+    assert out.strip() == '[] None' and not other, (out, other)
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+'''Profiles are written under profile_output, whatever the Message-ID of their article'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import marshal
+import os
+
+from mail2blog import timing
+
+ARTICLES = ['../../escape/me@example.org', 'plain@example.org', 'x' * 300 + '@example.org']
+
+def test_profile_names_stay_in_the_directory(tmp_path):
+    recorder = timing.Recorder(profile=len(ARTICLES))
+    for seconds, article in enumerate(ARTICLES, 1):
+        recorder.keep_profile(float(seconds), article, {'calls': seconds})
+    directory = tmp_path / 'profile'
+    written = recorder.write_profiles(str(directory))
+    assert [profile['article'] for profile in written] == ARTICLES[::-1]
+    assert sorted(os.listdir(tmp_path)) == ['profile']
+    for profile in written:
+        assert os.path.dirname(profile['file']) == str(directory)
+        with open(profile['file'], 'rb') as fh:
+            assert marshal.load(fh) == {'calls': ARTICLES.index(profile['article']) + 1}
+    assert os.path.basename(written[2]['file']) == '03-..%2F..%2Fescape%2Fme@example.org.prof'
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+'''The IDLE watcher survives failing publishes and folder changes between commands'''
+# pylint
+# vim: tw=100 foldmethod=indent
+#
+# This code is distributed under the MIT License
+#
+# pylint: disable=invalid-name, superfluous-parens, redefined-outer-name, unused-argument
+# pylint: disable=missing-docstring, trailing-whitespace, trailing-newlines, too-few-public-methods
+
+import threading
+import time
+
+import pytest
+
+from imap_standin import ImapStandIn, Mailbox
+from synthmail import text_mailbox, text_message
+from mail2blog.config import CONFIG
+from mail2blog.imapconnector import ImapConnector
+from mail2blog.watch import Watcher
+
+def wait_for(condition, timeout=10):
+    start = time.perf_counter()
+    while not condition():
+        assert time.perf_counter() - start < timeout, "timed out"
+        time.sleep(0.005)
+
+@pytest.fixture
+def server(locations):
+    mailbox = Mailbox(text_mailbox(3))
+    with ImapStandIn(mailbox) as server:
+        CONFIG.read_dict({'imap':  server.config(),
+                          'watch': {'keepalive': '0.2', 'backoff_min': '0.1'}})
+        yield server
+
+def test_exists_before_idle_continuation(server):
+    imap = ImapConnector()
+    imap.connect()
+    server.mailbox.append(text_message(3))
+    server.notify()
+    time.sleep(0.1)
+    # the EXISTS is on the wire before the server's "+ idling"
+    assert imap.idle(5) is True
+    assert imap.idle(0.1) is False
+    imap.disconnect()
+
+def test_exists_during_noop(server):
+    imap = ImapConnector()
+    imap.connect()
+    assert imap.noop() is False
+    server.mailbox.append(text_message(3))
+    server.notify()
+    time.sleep(0.1)
+    assert imap.noop() is True
+    assert imap.noop() is False
+    imap.disconnect()
+
+@pytest.mark.parametrize('error', [RuntimeError("pandoc crashed"),
+                                   PermissionError(13, "Permission denied", 'blog/index.html'),
+                                   OSError(28, "No space left on device")])
+def test_publish_failure_keeps_watching(server, error):
+    calls = []
+    def publish():
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise error
+    imap    = ImapConnector()
+    watcher = Watcher(imap, publish)
+    thread  = threading.Thread(target=watcher.run, daemon=True)
+    thread.start()
+    try:
+        wait_for(lambda: watcher.failures == 1)
+        server.mailbox.append(text_message(3))
+        server.notify()
+        wait_for(lambda: watcher.publishes == 1)
+        assert thread.is_alive()
+        assert watcher.reconnects == 0
+        assert len(calls) == 2
+    finally:
+        watcher.stop()
+        thread.join(timeout=5)
+    imap.disconnect()